@@ -0,0 +1,19 @@
+// File name: projects/08/ProgramFlow/NotGoto/NotGoto.tst
+
+load NotGoto.asm,
+output-file NotGoto.out,
+compare-to NotGoto.cmp,
+output-list RAM[0]%D1.6.1 RAM[6]%D1.6.1;
+
+set RAM[0] 256,
+set RAM[1] 300,
+set RAM[300] 0,
+set RAM[301] 5,
+set RAM[302] 5,
+set RAM[6] 1,
+
+repeat 100 {
+  ticktock;
+}
+
+output;
@@ -11,30 +11,159 @@
 import sys
 import os
 import re
+import argparse
+import time
+import multiprocessing
+import hashlib
+import array
+import json
 
 
-# command type, described by hex codes starting from 0x60
-C_ARITHEMETIC=0x60
-C_PUSH=0x61
-C_POP=0x62
-C_LABEL=0x63
-C_GOTO=0x64
-C_IF=0x65
-C_FUNCTION=0x66
-C_RETURN=0x67
-C_CALL=0x68
-
-# Patterns for types of commands
-regex_cmd_push  = re.compile("^push\s+(\w+)\s+(\d+)$")
-regex_cmd_pop   = re.compile("^pop\s+(\w+)\s+(\d+)$")
-regex_mem_seg   = re.compile("(argument|local|static|constant|this|that|pointer|temp)")
-regex_cmd_ari   = re.compile("(add|sub|neg|eq|gt|lt|and|or|not)")
-regex_cmd_label = re.compile("label\s+([\w|\.|\$]+)")
-regex_cmd_goto  = re.compile("goto\s+([\w|\.|\$]+)")
-regex_cmd_if    = re.compile("if-goto\s+([\w|\.|\$]+)")
-regex_cmd_func  = re.compile("function\s+([\w|\.|\$]+)\s+(\d+)")
-regex_cmd_call  = re.compile("call\s+([\w|\.|\$]+)\s+(\d+)")
-regex_cmd_ret   = re.compile("return")
+# opcodes of the vm commands. They are small consecutive integers so that they could index
+# the dispatch tables of the code writer
+C_ADD=0x00
+C_SUB=0x01
+C_NEG=0x02
+C_EQ=0x03
+C_GT=0x04
+C_LT=0x05
+C_AND=0x06
+C_OR=0x07
+C_NOT=0x08
+C_PUSH=0x09
+C_POP=0x0a
+C_LABEL=0x0b
+C_GOTO=0x0c
+C_IF=0x0d
+C_FUNCTION=0x0e
+C_RETURN=0x0f
+C_CALL=0x10
+# inverted if-goto, jumps when the value popped is 0. It is not part of the vm language, only
+# the optimizer creates it
+C_IFNOT=0x11
+# a run of commands with no label, jump or return, arg1 is their list. Only used by the optimizer
+# while it rewrites the jumps of a function, it never reaches the code writer
+C_RUN=0x12
+
+# capability levels of the translator: the stack arithmetic and memory access commands of
+# project 07, or the whole vm language of project 08. A level accepts the opcodes up to
+# list_level_max_opcode[level]
+LEVEL_STACK=0
+LEVEL_FULL=1
+list_level_max_opcode = [C_POP, C_CALL]
+
+# memory segments, used as indexes of the push/pop dispatch tables
+SEG_ARGUMENT=0
+SEG_LOCAL=1
+SEG_STATIC=2
+SEG_CONSTANT=3
+SEG_THIS=4
+SEG_THAT=5
+SEG_POINTER=6
+SEG_TEMP=7
+
+dict_mem_segs = {
+    "argument": SEG_ARGUMENT,
+    "local":    SEG_LOCAL,
+    "static":   SEG_STATIC,
+    "constant": SEG_CONSTANT,
+    "this":     SEG_THIS,
+    "that":     SEG_THAT,
+    "pointer":  SEG_POINTER,
+    "temp":     SEG_TEMP,
+}
+
+# the largest index accepted by every segment
+list_seg_max_index = [32767, 32767, 32767, 32767, 32767, 32767, 1, 7]
+
+# the vm commands by their first word: the opcode, and the kind of operands taken by the command
+OPD_NONE=0      # no operand
+OPD_SEGMENT=1   # segment index
+OPD_SYMBOL=2    # label
+OPD_FUNCTION=3  # functionName nArgs/nLocals
+list_num_operands = [0, 2, 1, 2]
+
+dict_vm_commands = {
+    "add":      (C_ADD, OPD_NONE),
+    "sub":      (C_SUB, OPD_NONE),
+    "neg":      (C_NEG, OPD_NONE),
+    "eq":       (C_EQ, OPD_NONE),
+    "gt":       (C_GT, OPD_NONE),
+    "lt":       (C_LT, OPD_NONE),
+    "and":      (C_AND, OPD_NONE),
+    "or":       (C_OR, OPD_NONE),
+    "not":      (C_NOT, OPD_NONE),
+    "push":     (C_PUSH, OPD_SEGMENT),
+    "pop":      (C_POP, OPD_SEGMENT),
+    "label":    (C_LABEL, OPD_SYMBOL),
+    "goto":     (C_GOTO, OPD_SYMBOL),
+    "if-goto":  (C_IF, OPD_SYMBOL),
+    "function": (C_FUNCTION, OPD_FUNCTION),
+    "return":   (C_RETURN, OPD_NONE),
+    "call":     (C_CALL, OPD_FUNCTION),
+}
+
+# Pattern for labels and function names
+regex_symbol = re.compile("^[\w\.\$:]+$")
+
+# Folding rules for the arithmetic commands, values are 16-bit two's complement integers.
+# The comparisons mirror the generated code, which tests the sign of x - y.
+def to_int16(val):
+    val &= 0xFFFF
+    if val & 0x8000:
+        return val - 0x10000
+    return val
+
+dict_fold_unary = {
+    C_NEG: lambda x: to_int16(-x),
+    C_NOT: lambda x: to_int16(~x),
+}
+
+dict_fold_binary = {
+    C_ADD: lambda x, y: to_int16(x + y),
+    C_SUB: lambda x, y: to_int16(x - y),
+    C_AND: lambda x, y: to_int16(x & y),
+    C_OR:  lambda x, y: to_int16(x | y),
+    C_EQ:  lambda x, y: -1 if 0 == to_int16(x - y) else 0,
+    C_GT:  lambda x, y: -1 if 0 < to_int16(x - y) else 0,
+    C_LT:  lambda x, y: -1 if 0 > to_int16(x - y) else 0,
+}
+
+# Longest run of constants the optimizer holds back while waiting for a command to fold them
+FOLD_WINDOW = 64
+
+# Stack effect of the vm commands by opcode: the number of values popped and pushed. A call pops
+# its arguments, given by the command
+list_stack_pops   = [2, 2, 1, 2, 2, 2, 2, 2, 1, 0, 1, 0, 0, 1, 0, 1, 0, 1]
+list_stack_pushes = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 1, 0]
+
+# the jumps of the vm code, and the opposite of every conditional jump
+set_jumps = set([C_GOTO, C_IF, C_IFNOT])
+# the commands which change the flow of the code or may be jumped to
+set_control = set([C_LABEL, C_GOTO, C_IF, C_IFNOT, C_RETURN])
+dict_opposite_jumps = {
+    C_IF:    C_IFNOT,
+    C_IFNOT: C_IF,
+}
+
+# Largest distance from SP at which the stack is addressed while SP is not up to date (-O 2),
+# farther than that SP is committed first
+SP_OFFSET_MAX = 3
+
+# Number of asm lines gathered before each write to the output file
+ASM_WRITE_BATCH = 4096
+
+# Default number of entries kept in the translation cache
+CACHE_MAX_ENTRIES = 512
+
+# RAM used by the profiler counters, they are allocated downwards from PROFILE_ADDR_TOP. The OS
+# manages the heap in RAM[2048..16383] and the screen and keyboard maps follow it, so the counters
+# are kept above the keyboard, in the part of the 32K RAM of the CPU emulator nothing else uses
+PROFILE_ADDR_TOP = 32767
+PROFILE_ADDR_MIN = 24577
+# The cycle counters take 2 words, RAM[addr] * PROFILE_LOW_RANGE + RAM[addr - 1], as a single
+# word would wrap after a fraction of a second of emulated run
+PROFILE_LOW_RANGE = 32768
 
 BOOTSTRAP_CODE = [
     "@256",  # set SP to 256
@@ -92,6 +221,239 @@ BOOTSTRAP_CODE = [
     "0;JMP",
     "(FUNC_Sys.init_END)"
 ]
+
+# Enough for a Sys.init which never returns and never reads the frame of its caller,
+# there is no caller frame at all: the stack starts at 256 with LCL on it
+BOOTSTRAP_MINIMAL_CODE = [
+    "@256",  # set SP and LCL to 256
+    "D=A",
+    "@SP",
+    "M=D",
+    "@LCL",
+    "M=D",
+    "@FUNC_Sys.init_START",  # goto Sys.init
+    "0;JMP",
+]
+
+# Ends a program translated at the stack level, there is nothing to return to
+ASM_END_OF_FILE = [
+    "(END_OF_FILE)",
+    "@END_OF_FILE",
+    "0;JMP",
+]
+
+# Assembly templates used by the code writer
+ASM_PUSH_D = [  # push the D register onto the stack
+    "@SP",
+    "A=M",
+    "M=D",
+    "@SP",
+    "M=M+1"
+]
+
+ASM_POP_D = [  # pop the top of the stack into the D register
+    "@SP",
+    "AM=M-1",
+    "D=M"
+]
+
+# arithmetic commands indexed by opcode, comparisons are generated by writeCompare
+ASM_ARITHMETIC = [
+    ASM_POP_D + ["A=A-1", "M=M+D"],  # add
+    ASM_POP_D + ["A=A-1", "M=M-D"],  # sub
+    ["@SP", "A=M-1", "M=-M"],        # neg
+    None,                            # eq
+    None,                            # gt
+    None,                            # lt
+    ASM_POP_D + ["A=A-1", "M=M&D"],  # and
+    ASM_POP_D + ["A=A-1", "M=M|D"],  # or
+    ["@SP", "A=M-1", "M=!M"],        # not
+]
+
+# jump conditions of the comparisons for the true and false results
+dict_compare_jumps = {
+    C_EQ: ("JEQ", "JNE"),
+    C_GT: ("JGT", "JLE"),
+    C_LT: ("JLT", "JGE"),
+}
+
+# jump on the value popped by the conditional jumps
+dict_if_jumps = {
+    C_IF:    "D;JNE",
+    C_IFNOT: "D;JEQ",
+}
+
+# segments indexed by segment number. Pointer segments are addressed as *(base) + i while
+# the fixed ones as base + i
+list_seg_pointers = ["@ARG", "@LCL", None, None, "@THIS", "@THAT", None, None]
+list_seg_fixed    = [None, None, None, None, None, None, "@R3", "@R5"]
+
+ASM_PUSH_ZERO = [  # initialize a local variable
+    "@SP",
+    "A=M",
+    "M=0",
+    "@SP",
+    "M=M+1",
+]
+
+ASM_CALL_FRAME = [
+    "@LCL",  # push LCL
+    "D=M",
+] + ASM_PUSH_D + [
+    "@ARG",  # push ARG
+    "D=M",
+] + ASM_PUSH_D + [
+    "@THIS",  # push THIS
+    "D=M",
+] + ASM_PUSH_D + [
+    "@THAT",  # push THAT
+    "D=M",
+] + ASM_PUSH_D + [
+    "@SP",    # ARG = SP - n -5
+    "D=M-1",
+    "D=D-1",
+    "D=D-1",
+    "D=D-1",
+    "D=D-1",
+]
+
+ASM_RETURN_FRAME = [
+    "@LCL",  # FRAME = LCL
+    "D=M",
+    "@R13",  # R13 is for FRAME
+    "M=D",
+    "@5",    # RET = *(FRAME - 5)
+    "A=D-A",
+    "D=M",
+    "@R14",
+    "M=D",   # R14 is for RET
+]
+
+ASM_RETURN_RESTORE = [  # the return value is in D
+    "@ARG",  # *ARG = return value
+    "A=M",
+    "M=D",
+    "@ARG",  # SP = ARG + 1
+    "D=M+1",
+    "@SP",
+    "M=D",
+    "@R13",  # THAT = *(FRAME - 1)
+    "AM=M-1",
+    "D=M",
+    "@THAT",
+    "M=D",
+    "@R13",  # THIS = *(FRAME - 2)
+    "AM=M-1",
+    "D=M",
+    "@THIS",
+    "M=D",
+    "@R13",  # ARG = *(FRAME - 3)
+    "AM=M-1",
+    "D=M",
+    "@ARG",
+    "M=D",
+    "@R13",  # LCL = *(FRAME - 4)
+    "AM=M-1",
+    "D=M",
+    "@LCL",
+    "M=D",
+    "@R14",  # goto RET
+    "A=M",
+    "0;JMP",
+]
+
+ASM_RETURN = ASM_RETURN_FRAME + ASM_POP_D + ASM_RETURN_RESTORE  # *ARG = pop(), ...
+
+# Hack machine code, used by the binary backend. The encodings mirror the ones of the assembler
+# in project 06. comp || a c1 c2 c3 c4 c5 c6
+dict_hack_comp = {
+    "0":   0b0101010,
+    "1":   0b0111111,
+    "-1":  0b0111010,
+    "D":   0b0001100,
+    "A":   0b0110000,
+    "M":   0b1110000,
+    "!D":  0b0001101,
+    "!A":  0b0110001,
+    "!M":  0b1110001,
+    "-D":  0b0001111,
+    "-A":  0b0110011,
+    "-M":  0b1110011,
+    "D+1": 0b0011111,
+    "A+1": 0b0110111,
+    "M+1": 0b1110111,
+    "1+A": 0b0110111,
+    "1+M": 0b1110111,
+    "D-1": 0b0001110,
+    "A-1": 0b0110010,
+    "M-1": 0b1110010,
+    "D+A": 0b0000010,
+    "D+M": 0b1000010,
+    "A+D": 0b0000010,
+    "M+D": 0b1000010,
+    "D-A": 0b0010011,
+    "D-M": 0b1010011,
+    "A-D": 0b0000111,
+    "M-D": 0b1000111,
+    "D&A": 0b0000000,
+    "D&M": 0b1000000,
+    "A&D": 0b0000000,
+    "M&D": 0b1000000,
+    "D|A": 0b0010101,
+    "D|M": 0b1010101,
+    "A|D": 0b0010101,
+    "M|D": 0b1010101,
+}
+
+# dest || d1 d2 d3, by the set of registers written
+dict_hack_dest = {
+    "":     0b000,
+    "null": 0b000,
+    "M":    0b001,
+    "D":    0b010,
+    "MD":   0b011,
+    "DM":   0b011,
+    "A":    0b100,
+    "AM":   0b101,
+    "MA":   0b101,
+    "AD":   0b110,
+    "DA":   0b110,
+    "AMD":  0b111,
+    "ADM":  0b111,
+    "MAD":  0b111,
+    "MDA":  0b111,
+    "DAM":  0b111,
+    "DMA":  0b111,
+}
+
+# jump || j1 j2 j3
+dict_hack_jump = {
+    "":     0b000,
+    "null": 0b000,
+    "JGT":  0b001,
+    "JEQ":  0b010,
+    "JGE":  0b011,
+    "JLT":  0b100,
+    "JNE":  0b101,
+    "JLE":  0b110,
+    "JMP":  0b111,
+}
+
+dict_hack_predefined = {
+    "SP":     0,
+    "LCL":    1,
+    "ARG":    2,
+    "THIS":   3,
+    "THAT":   4,
+    "SCREEN": 16384,
+    "KBD":    24576,
+}
+for i in range(16):
+    dict_hack_predefined["R%d" % (i, )] = i
+
+HACK_ROM_SIZE = 32768
+HACK_VAR_BASE = 16  # variables are allocated from this RAM address on
+
 # The parser
 class Parser:
     '''
@@ -99,58 +461,112 @@ class Parser:
     reads VM commands, parses them, and provides convenient access to their components. In
     addition, it removes all extra white-spaces and comments.
     '''
-    class Command:
+    class Command(object):
         '''
-        Every instance of this class corresponds to a vm command
+        Every instance of this class corresponds to a vm command. The operands are parsed only once:
+        arg1 is the segment number of push/pop and the name used by the other commands, arg2 is
+        the integer operand of push, pop, function and call
         '''
-        def __init__(self):
-            # Common attribute
-            self.raw_str = ""
-            self.type  = ""
-            self.arg1  = ""
-            self.arg2  = ""
-            self.index = 0
-
-        def set_type(self, type):
-            self.type = type
+        __slots__ = ("type", "arg1", "arg2", "index")
 
-        def set_arg1(self, arg):
-            self.arg1 = arg
-
-        def set_arg2(self, arg):
-            self.arg2 = arg
-
-        def set_index(self, ind):
-            self.index = ind
-
-        def get_type(self):
-            return self.type
-
-        def get_arg1(self):
-            if C_RETURN == self.type:
-                return None
-            elif C_ARITHEMETIC == self.type:
-                return self.raw_str
-            else:
-                return self.arg1
-
-        def get_arg2(self):
-            if C_PUSH == self.type or \
-               C_POP == self.type or \
-               C_FUNCTION == self.type or \
-               C_CALL == self.type:
-                return self.arg2
-            else:
-                return None
-
-        def get_index(self):
-            return self.index
+        def __init__(self, cmd_type, arg1 = None, arg2 = 0, index = 0):
+            self.type  = cmd_type
+            self.arg1  = arg1
+            self.arg2  = arg2
+            self.index = index
 
     class CodeWriter:
-        def __init__(self, file_name):
+        def __init__(self, file_name, profiler = None, level = LEVEL_FULL, file_guard = True):
             self.file_name = file_name
+            self.level = level
+            self.file_guard = file_guard  # False when nothing can fall through the bootstrap code into the files
+            self.profiler = profiler  # an instance of Profiler when the code is instrumented
             self.func_name = "Sys.init"
             self.list_ou_asm = []
+            # push/pop code does not depend on the context, so it is generated once per (segment, index)
+            self.dict_push_asm = {}
+            self.dict_pop_asm = {}
+            self.dict_load_asm = {}
+            self.dict_store_asm = {}
+            self.dict_addr_asm = {}
+            # with SP batching, SP + sp_offset is the actual top of the stack
+            self.sp_offset = 0
+            self.reachable = True
+            # with the profiler, the instructions of the current basic block and the function they are counted for
+            self.block_func = self.func_name
+            self.block_cycles = 0
+            # dispatch tables, indexed by opcode and by segment number
+            self.list_writers_direct = [
+                self.writeArithmetic,  # add
+                self.writeArithmetic,  # sub
+                self.writeArithmetic,  # neg
+                self.writeCompare,     # eq
+                self.writeCompare,     # gt
+                self.writeCompare,     # lt
+                self.writeArithmetic,  # and
+                self.writeArithmetic,  # or
+                self.writeArithmetic,  # not
+                self.writePush,
+                self.writePop,
+                self.writeLabel,
+                self.writeGoto,
+                self.writeIf,
+                self.writeFunction,
+                self.writeReturn,
+                self.writeCall,
+                self.writeIf,         # if-not-goto
+            ]
+            self.list_writers_batched = [
+                self.writeArithmeticSP,  # add
+                self.writeArithmeticSP,  # sub
+                self.writeArithmeticSP,  # neg
+                self.writeCompareSP,     # eq
+                self.writeCompareSP,     # gt
+                self.writeCompareSP,     # lt
+                self.writeArithmeticSP,  # and
+                self.writeArithmeticSP,  # or
+                self.writeArithmeticSP,  # not
+                self.writePushSP,
+                self.writePopSP,
+                self.writeLabelSP,
+                self.writeGotoSP,
+                self.writeIfSP,
+                self.writeFunctionSP,
+                self.writeReturnSP,
+                self.writeCallSP,
+                self.writeIfSP,         # if-not-goto
+            ]
+            self.list_writers = self.list_writers_direct
+            self.list_push_writers = [
+                self.pushPointerSegment,  # argument
+                self.pushPointerSegment,  # local
+                self.pushStatic,
+                self.pushConstant,
+                self.pushPointerSegment,  # this
+                self.pushPointerSegment,  # that
+                self.pushFixedSegment,    # pointer
+                self.pushFixedSegment,    # temp
+            ]
+            self.list_pop_writers = [
+                self.popPointerSegment,  # argument
+                self.popPointerSegment,  # local
+                self.popStatic,
+                None,                    # constant
+                self.popPointerSegment,  # this
+                self.popPointerSegment,  # that
+                self.popFixedSegment,    # pointer
+                self.popFixedSegment,    # temp
+            ]
+
+        def set_sp_batching(self, flag):
+            '''
+            With SP batching, pushes and pops do not update SP: the stack is addressed relative to SP
+            and SP is committed only at the labels, the jumps, the calls and the returns
+            '''
+            if True == flag:
+                self.list_writers = self.list_writers_batched
+            else:
+                self.list_writers = self.list_writers_direct
 
         def set_func_name(self, name):
             self.func_name = name
@@ -159,547 +575,1373 @@ class Parser:
             return self.func_name
 
         def writeArithmetic(self, cmd):
-            asm_cmds = []
-            # arithmetic commands
-            if "add" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "M=M+D"
-                ]
-            elif "sub" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "M=M-D"
-                ]
-            elif "neg" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "A=M-1",
-                    "M=-M",
-                ]
-            elif "and" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "M=M&D"
-                ]
-            elif "or" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "M=M|D"
-                ]
-            elif "not" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "A=M-1",
-                    "M=!M",
-                ]
-            # logical commands
-            elif "eq" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "D=M-D",
-                    "@TRUE.%d" % (cmd.index, ),
-                    "D;JEQ",
-                    "@FALSE.%d" % (cmd.index, ),
-                    "D;JNE",
-                    "(TRUE.%d)" % (cmd.index, ),
-                    "D=-1",
-                    "@END.%d" % (cmd.index, ),
-                    "0;JMP",
-                    "(FALSE.%d)" % (cmd.index, ),
-                    "D=0",
-                    "@END.%d" % (cmd.index, ),
-                    "0;JMP",
-                    "(END.%d)" % (cmd.index, ),
-                    "@SP",
-                    "A=M-1",
-                    "M=D",
-                ]
-            elif "gt" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "D=M-D",
-                    "@TRUE.%d" % (cmd.index, ),
-                    "D;JGT",
-                    "@FALSE.%d" % (cmd.index, ),
-                    "D;JLE",
-                    "(TRUE.%d)" % (cmd.index, ),
-                    "D=-1",
-                    "@END.%d" % (cmd.index, ),
-                    "0;JMP",
-                    "(FALSE.%d)" % (cmd.index, ),
-                    "D=0",
-                    "@END.%d" % (cmd.index, ),
-                    "0;JMP",
-                    "(END.%d)" % (cmd.index, ),
-                    "@SP",
-                    "A=M-1",
-                    "M=D",
-                ]
-            elif "lt" == cmd.get_arg1():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "A=A-1",
-                    "D=M-D",
-                    "@TRUE.%d" % (cmd.index, ),
-                    "D;JLT",
-                    "@FALSE.%d" % (cmd.index, ),
-                    "D;JGE",
-                    "(TRUE.%d)" % (cmd.index, ),
-                    "D=-1",
-                    "@END.%d" % (cmd.index, ),
-                    "0;JMP",
-                    "(FALSE.%d)" % (cmd.index, ),
-                    "D=0",
-                    "@END.%d" % (cmd.index, ),
-                    "0;JMP",
-                    "(END.%d)" % (cmd.index, ),
-                    "@SP",
-                    "A=M-1",
-                    "M=D",
-                ]
-            self.list_ou_asm += asm_cmds
-
-        def writePushPop(self, cmd):
-            if "constant" == cmd.get_arg1():
-                asm_cmds = [
-                    "@%s" % (cmd.get_arg2(),),
-                    "D=A",
-                    "@SP",
-                    "A=M",
-                    "M=D",
-                    "@SP",
-                    "M=M+1"
-                ]
+            return ASM_ARITHMETIC[cmd.type]
 
-            elif C_PUSH == cmd.get_type():
-                if "local" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@LCL",
-                        "D=M",
-                        "@%s" % (cmd.get_arg2(), ),
-                        "A=D+A",
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-                elif "argument" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@ARG",
-                        "D=M",
-                        "@%s" % (cmd.get_arg2(), ),
-                        "A=D+A",
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-                elif "pointer" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@%s" % (cmd.get_arg2(), ),
-                        "D=A",
-                        "@R3",
-                        "A=D+A",
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-                elif "this" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@THIS",
-                        "D=M",
-                        "@%s" % (cmd.get_arg2(), ),
-                        "A=D+A",
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-                elif "that" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@THAT",
-                        "D=M",
-                        "@%s" % (cmd.get_arg2(), ),
-                        "A=D+A",
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-                elif "temp" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@%s" % (cmd.get_arg2(), ),
-                        "D=A",
-                        "@R5",
-                        "A=D+A",
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-                elif "static" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@%s.%s" % (self.file_name, cmd.get_arg2(), ),
-                        "D=M",
-                        "@SP",
-                        "A=M",
-                        "M=D",
-                        "@SP",
-                        "M=M+1"
-                    ]
-
-            elif C_POP == cmd.get_type():
-                if "local" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@LCL",
-                        "A=M"
-                    ]
-                    for i in range(int(cmd.get_arg2())):
-                        asm_cmds.append("A=A+1")
-                    asm_cmds.append("M=D")
-                elif "argument" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@ARG",
-                        "A=M"
-                    ]
-                    for i in range(int(cmd.get_arg2())):
-                        asm_cmds.append("A=A+1")
-                    asm_cmds.append("M=D")
-                elif "pointer" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@R3",
-                    ]
-                    for i in range(int(cmd.get_arg2())):
-                        asm_cmds.append("A=A+1")
-                    asm_cmds.append("M=D")
-                elif "this" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@THIS",
-                        "A=M"
-                    ]
-                    for i in range(int(cmd.get_arg2())):
-                        asm_cmds.append("A=A+1")
-                    asm_cmds.append("M=D")
-                elif "that" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@THAT",
-                        "A=M"
-                    ]
-                    for i in range(int(cmd.get_arg2())):
-                        asm_cmds.append("A=A+1")
-                    asm_cmds.append("M=D")
-                elif "temp" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@R5",
-                    ]
-                    for i in range(int(cmd.get_arg2())):
-                        asm_cmds.append("A=A+1")
-                    asm_cmds.append("M=D")
-                elif "static" == cmd.get_arg1():
-                    asm_cmds = [
-                        "@SP",
-                        "AM=M-1",
-                        "D=M",
-                        "@%s.%s" % (self.file_name, cmd.get_arg2(), ),
-                        "M=D",
-                    ]
-
-            self.list_ou_asm += asm_cmds
-
-        def writeProgramFlow(self, cmd):
-            if C_LABEL == cmd.get_type():
-                asm_cmds = [
-                    "(%s$%s)" % (self.get_func_name(), cmd.get_arg1(), )
-                ]
-            elif C_GOTO == cmd.get_type():
-                asm_cmds = [
-                    "@%s$%s" % (self.get_func_name(), cmd.get_arg1(), ),
-                    "0;JMP"
-                ]
-            elif C_IF == cmd.get_type():
-                asm_cmds = [
-                    "@SP",
-                    "AM=M-1",
-                    "D=M",
-                    "@%s$%s" % (self.get_func_name(), cmd.get_arg1(), ),
-                    "D;JNE"
-                ]
+        def compareJumps(self, cmd):
+            '''
+            The result of a comparison in D, from x - y in D
+            '''
+            jump_true, jump_false = dict_compare_jumps[cmd.type]
+            # the labels are namespaced by the file, so they are unique across the whole program
+            suffix = "%s.%d" % (self.file_name, cmd.index, )
+            return [
+                "@TRUE." + suffix,
+                "D;%s" % (jump_true, ),
+                "@FALSE." + suffix,
+                "D;%s" % (jump_false, ),
+                "(TRUE.%s)" % (suffix, ),
+                "D=-1",
+                "@END." + suffix,
+                "0;JMP",
+                "(FALSE.%s)" % (suffix, ),
+                "D=0",
+                "@END." + suffix,
+                "0;JMP",
+                "(END.%s)" % (suffix, ),
+            ]
+
+        def writeCompare(self, cmd):
+            return ASM_POP_D + ["A=A-1", "D=M-D"] + self.compareJumps(cmd) + ["@SP", "A=M-1", "M=D"]
+
+        def pushConstant(self, seg, i):
+            return ["@%d" % (i, ), "D=A"]
+
+        def pushStatic(self, seg, i):
+            return ["@%s.%d" % (self.file_name, i, ), "D=M"]
+
+        def pushPointerSegment(self, seg, i):
+            return [list_seg_pointers[seg], "D=M", "@%d" % (i, ), "A=D+A", "D=M"]
+
+        def pushFixedSegment(self, seg, i):
+            return ["@%d" % (i, ), "D=A", list_seg_fixed[seg], "A=D+A", "D=M"]
+
+        def popStatic(self, seg, i):
+            return ["@%s.%d" % (self.file_name, i, ), "M=D"]
+
+        def popPointerSegment(self, seg, i):
+            return [list_seg_pointers[seg], "A=M"] + ["A=A+1"] * i + ["M=D"]
+
+        def popFixedSegment(self, seg, i):
+            return [list_seg_fixed[seg]] + ["A=A+1"] * i + ["M=D"]
+
+        def writePush(self, cmd):
+            key = (cmd.arg1, cmd.arg2)
+            asm_cmds = self.dict_push_asm.get(key)
+            if None == asm_cmds:
+                asm_cmds = self.list_push_writers[cmd.arg1](cmd.arg1, cmd.arg2) + ASM_PUSH_D
+                self.dict_push_asm[key] = asm_cmds
+            return asm_cmds
+
+        def writePop(self, cmd):
+            key = (cmd.arg1, cmd.arg2)
+            asm_cmds = self.dict_pop_asm.get(key)
+            if None == asm_cmds:
+                pop_writer = self.list_pop_writers[cmd.arg1]
+                if None == pop_writer:
+                    print "Error: cannot pop to the constant segment in %s" % (self.file_name, )
+                    sys.exit(1)
+                asm_cmds = ASM_POP_D + pop_writer(cmd.arg1, cmd.arg2)
+                self.dict_pop_asm[key] = asm_cmds
+            return asm_cmds
+
+        def writeLabel(self, cmd):
+            return ["(%s$%s)" % (self.func_name, cmd.arg1, )]
+
+        def writeGoto(self, cmd):
+            return [
+                "@%s$%s" % (self.func_name, cmd.arg1, ),
+                "0;JMP"
+            ]
+
+        def writeIf(self, cmd):
+            return ASM_POP_D + [
+                "@%s$%s" % (self.func_name, cmd.arg1, ),
+                dict_if_jumps[cmd.type]
+            ]
+
+        def functionEntry(self, cmd):
+            self.func_name = cmd.arg1
+            return ["(FUNC_%s_START)" % (cmd.arg1, )]
 
-            self.list_ou_asm += asm_cmds
+        def writeFunction(self, cmd):
+            # initialize all the local variables
+            return self.functionEntry(cmd) + ASM_PUSH_ZERO * cmd.arg2
 
-        def writeFunctions(self, cmd):
+        def writeReturn(self, cmd):
+            return ASM_RETURN
+
+        def writeCall(self, cmd):
+            label_ret = "FUNC_%s_END_%s.%d" % (cmd.arg1, self.file_name, cmd.index, )
+            asm_cmds = ["@" + label_ret, "D=A"] + ASM_PUSH_D + ASM_CALL_FRAME  # push return-address
+            asm_cmds += ["D=D-1"] * cmd.arg2
+            return asm_cmds + [
+                "@ARG",
+                "M=D",
+                "@SP",  # LCL = SP
+                "D=M",
+                "@LCL",
+                "M=D",
+                "@FUNC_%s_START" % (cmd.arg1, ),
+                "0;JMP",
+                "(%s)" % (label_ret, ),  # declare a label for rthe return address
+            ]
+
+        def addrStack(self, k):
             '''
-            write function related assembly instructions
+            Point A at SP + k, SP itself is left untouched
             '''
-            if C_FUNCTION == cmd.get_type():
-                self.set_func_name(cmd.get_arg1())
-                asm_cmds = [
-                    "(FUNC_%s_START)" % (self.get_func_name(), ),
-                ]
-                for i in range(int(cmd.get_arg2())):
-                    asm_cmds += [
-                        "@SP",  # initialize all the local variables
-                        "A=M",
-                        "M=0",
-                        "@SP",
-                        "M=M+1",
-                    ]
-            elif C_RETURN == cmd.get_type():
-                asm_cmds = [
-                    "@LCL",  # FRAME = LCL
-                    "D=M",
-                    "@R13",  # R13 is for FRAME
-                    "M=D",
-                    "@5",    # RET = *(FRAME - 5)
-                    "A=D-A",
-                    "D=M",
-                    "@R14",
-                    "M=D",   # R14 is for RET
-                    "@SP",   # *ARG = pop()
-                    "AM=M-1",
-                    "D=M",
-                    "@ARG",
-                    "A=M",
-                    "M=D",
-                    "@ARG",  # SP = ARG + 1
-                    "D=M+1",
-                    "@SP",
-                    "M=D",
-                    "@R13",  # THAT = *(FRAME - 1)
-                    "AM=M-1",
-                    "D=M",
-                    "@THAT",
-                    "M=D",
-                    "@R13",  # THIS = *(FRAME - 2)
-                    "AM=M-1",
-                    "D=M",
-                    "@THIS",
-                    "M=D",
-                    "@R13",  # ARG = *(FRAME - 3)
-                    "AM=M-1",
-                    "D=M",
-                    "@ARG",
-                    "M=D",
-                    "@R13",  # LCL = *(FRAME - 4)
-                    "AM=M-1",
-                    "D=M",
-                    "@LCL",
-                    "M=D",
-                    "@R14",  # goto RET
-                    "A=M",
-                    "0;JMP",
-                ]
+            asm_cmds = self.dict_addr_asm.get(k)
+            if None == asm_cmds:
+                if 0 == k:
+                    asm_cmds = ["@SP", "A=M"]
+                elif k > 0:
+                    asm_cmds = ["@SP", "A=M+1"] + ["A=A+1"] * (k - 1)
+                else:
+                    asm_cmds = ["@SP", "A=M-1"] + ["A=A-1"] * (-k - 1)
+                self.dict_addr_asm[k] = asm_cmds
+            return asm_cmds
 
-            elif C_CALL == cmd.get_type():
-                asm_cmds = [
-                    "@FUNC_%s_END_%d" % (cmd.get_arg1(), cmd.get_index()),  # push return-address
-                    "D=A",
-                    "@SP",
-                    "A=M",
-                    "M=D",
-                    "@SP",
-                    "M=M+1",
-                    "@LCL",  # push LCL
-                    "D=M",
-                    "@SP",
-                    "A=M",
-                    "M=D",
-                    "@SP",
-                    "M=M+1",
-                    "@ARG",  # push ARG
-                    "D=M",
-                    "@SP",
-                    "A=M",
-                    "M=D",
-                    "@SP",
-                    "M=M+1",
-                    "@THIS",  # push THIS
-                    "D=M",
-                    "@SP",
-                    "A=M",
-                    "M=D",
-                    "@SP",
-                    "M=M+1",
-                    "@THAT",  # push THAT
-                    "D=M",
-                    "@SP",
-                    "A=M",
-                    "M=D",
-                    "@SP",
-                    "M=M+1",
-                    "@SP",    # ARG = SP - n -5
-                    "D=M-1",
-                    "D=D-1",
-                    "D=D-1",
-                    "D=D-1",
-                    "D=D-1",
-                ]
-                for i in range(int(cmd.get_arg2())):
-                    asm_cmds += [
-                        "D=D-1",
-                    ]
-                asm_cmds += [
-                    "@ARG",
-                    "M=D",
-                    "@SP",  # LCL = SP
-                    "D=M",
-                    "@LCL",
-                    "M=D",
-                    "@FUNC_%s_START" % (cmd.get_arg1(), ),
-                    "0;JMP",
-                    "(FUNC_%s_END_%d)" % (cmd.get_arg1(), cmd.get_index(), ),  # declare a label for rthe return address
-                ]
-            self.list_ou_asm += asm_cmds
+        def commitSP(self):
+            '''
+            Bring SP up to date, D is lost
+            '''
+            offset = self.sp_offset
+            self.sp_offset = 0
+            if 0 == offset:
+                return []
+            elif 1 == offset:
+                return ["@SP", "M=M+1"]
+            elif -1 == offset:
+                return ["@SP", "M=M-1"]
+            elif offset > 0:
+                return ["@%d" % (offset, ), "D=A", "@SP", "M=M+D"]
+            return ["@%d" % (-offset, ), "D=A", "@SP", "M=M-D"]
 
-        def genCmds(self, list_in_vm):
-            if "Sys" != self.file_name:
-                self.list_ou_asm += [
+        def commitFar(self, k):
+            '''
+            Commit SP when SP + k is too far to be addressed
+            '''
+            if k > SP_OFFSET_MAX or k < -SP_OFFSET_MAX:
+                return self.commitSP()
+            return []
+
+        def commitReachable(self):
+            '''
+            Commit SP at the start of a basic block. Nothing has to be done when the previous
+            block does not fall through
+            '''
+            if True == self.reachable:
+                return self.commitSP()
+            self.reachable = True
+            self.sp_offset = 0
+            return []
+
+        def loadPush(self, cmd):
+            key = (cmd.arg1, cmd.arg2)
+            asm_cmds = self.dict_load_asm.get(key)
+            if None == asm_cmds:
+                asm_cmds = self.list_push_writers[cmd.arg1](cmd.arg1, cmd.arg2)
+                self.dict_load_asm[key] = asm_cmds
+            return asm_cmds
+
+        def storePop(self, cmd):
+            key = (cmd.arg1, cmd.arg2)
+            asm_cmds = self.dict_store_asm.get(key)
+            if None == asm_cmds:
+                pop_writer = self.list_pop_writers[cmd.arg1]
+                if None == pop_writer:
+                    print "Error: cannot pop to the constant segment in %s" % (self.file_name, )
+                    sys.exit(1)
+                asm_cmds = pop_writer(cmd.arg1, cmd.arg2)
+                self.dict_store_asm[key] = asm_cmds
+            return asm_cmds
+
+        def writeArithmeticSP(self, cmd):
+            asm_cmds = self.commitFar(self.sp_offset - 2)
+            op = ASM_ARITHMETIC[cmd.type][-1]
+            if cmd.type in dict_fold_unary:
+                return asm_cmds + self.addrStack(self.sp_offset - 1) + [op]
+            asm_cmds = asm_cmds + self.addrStack(self.sp_offset - 1) + ["D=M", "A=A-1", op]
+            self.sp_offset -= 1
+            return asm_cmds
+
+        def writeCompareSP(self, cmd):
+            asm_cmds = self.commitFar(self.sp_offset - 2)
+            asm_cmds = asm_cmds + self.addrStack(self.sp_offset - 1) + ["D=M", "A=A-1", "D=M-D"] + \
+                       self.compareJumps(cmd) + self.addrStack(self.sp_offset - 2) + ["M=D"]
+            self.sp_offset -= 1
+            return asm_cmds
+
+        def writePushSP(self, cmd):
+            asm_cmds = self.commitFar(self.sp_offset)
+            if SEG_CONSTANT == cmd.arg1 and cmd.arg2 <= 1:
+                asm_cmds = asm_cmds + self.addrStack(self.sp_offset) + ["M=%d" % (cmd.arg2, )]
+            else:
+                asm_cmds = asm_cmds + self.loadPush(cmd) + self.addrStack(self.sp_offset) + ["M=D"]
+            self.sp_offset += 1
+            return asm_cmds
+
+        def writePopSP(self, cmd):
+            asm_cmds = self.commitFar(self.sp_offset - 1)
+            asm_cmds = asm_cmds + self.addrStack(self.sp_offset - 1) + ["D=M"] + self.storePop(cmd)
+            self.sp_offset -= 1
+            return asm_cmds
+
+        def writeLabelSP(self, cmd):
+            return self.commitReachable() + self.writeLabel(cmd)
+
+        def writeGotoSP(self, cmd):
+            asm_cmds = self.commitSP() + self.writeGoto(cmd)
+            self.reachable = False
+            return asm_cmds
+
+        def writeIfSP(self, cmd):
+            if 0 == self.sp_offset:
+                return self.writeIf(cmd)
+            # SP is committed right onto the condition, which is thus popped
+            self.sp_offset -= 1
+            return self.commitSP() + ["@SP", "A=M", "D=M", "@%s$%s" % (self.func_name, cmd.arg1, ), dict_if_jumps[cmd.type]]
+
+        def writeFunctionSP(self, cmd):
+            asm_cmds = self.commitReachable() + self.functionEntry(cmd)
+            # the local variables are cleared without moving SP
+            if cmd.arg2 > 0:
+                asm_cmds += ["@SP", "A=M", "M=0"] + ["A=A+1", "M=0"] * (cmd.arg2 - 1)
+                self.sp_offset = cmd.arg2
+            return asm_cmds
+
+        def writeReturnSP(self, cmd):
+            # SP is set from ARG by the return, so it is never committed here
+            asm_cmds = ASM_RETURN_FRAME + self.addrStack(self.sp_offset - 1) + ["D=M"] + ASM_RETURN_RESTORE
+            self.sp_offset = 0
+            self.reachable = False
+            return asm_cmds
+
+        def writeCallSP(self, cmd):
+            return self.commitSP() + self.writeCall(cmd)
+
+        def profileCmd(self, cmd, asm_cmds):
+            '''
+            Instrument the asm code of one vm command. The instructions of a basic block are counted
+            while it is translated, and added to the cycle counters before the block is left: ahead of
+            the label, jump, call or return ending it, where D is free. The entry of a function and
+            every call site get their call counters too
+            '''
+            profiler = self.profiler
+            cycles = profiler.count_cycles(asm_cmds)
+            if cmd.type in dict_compare_jumps:
+                # only one of the branches of a comparison is run, they take 5 and 7 instructions
+                cycles -= 4
+            if C_FUNCTION == cmd.type:
+                # the code falling through into the function, if any, still belongs to the previous block
+                pos = asm_cmds.index("(FUNC_%s_START)" % (cmd.arg1, )) + 1
+                asm_flush = profiler.add_cycles(self.block_func, self.block_cycles + profiler.count_cycles(asm_cmds[:pos]))
+                self.block_func = cmd.arg1
+                self.block_cycles = profiler.count_cycles(asm_cmds[pos:])
+                return asm_flush + asm_cmds[:pos] + profiler.function_entry(cmd.arg1) + asm_cmds[pos:]
+            if cmd.type in set_control or C_CALL == cmd.type:
+                asm_flush = profiler.add_cycles(self.block_func, self.block_cycles + cycles)
+                self.block_cycles = 0
+                if C_CALL == cmd.type:
+                    asm_flush = profiler.call_site(self.func_name, cmd.arg1, self.file_name, cmd.index) + asm_flush
+                return asm_flush + asm_cmds
+            self.block_cycles += cycles
+            return asm_cmds
+
+        def iterCmds(self, iter_in_vm):
+            '''
+            Generator of the asm code, one list of asm lines per vm command. The lists may be shared
+            between commands, so the caller must not modify them
+            '''
+            # the code of a file is skipped over when Sys.init may return into it, unless it is a
+            # whole program of the stack level
+            guard = True == self.file_guard and LEVEL_FULL == self.level and "Sys" != self.file_name
+            if True == guard:
+                yield [
                     "@FILE_%s_END" % (self.file_name, ),
                     "0;JMP",
                 ]
-            for cmd in list_in_vm:
-                if C_ARITHEMETIC == cmd.get_type():
-                    self.writeArithmetic(cmd)
-                elif C_POP == cmd.get_type() or C_PUSH == cmd.get_type():
-                    self.writePushPop(cmd)
-                elif C_LABEL == cmd.get_type() or C_GOTO == cmd.get_type() or C_IF == cmd.get_type():
-                    self.writeProgramFlow(cmd)
-                elif C_FUNCTION == cmd.get_type() or C_RETURN == cmd.get_type() or C_CALL == cmd.get_type():
-                    self.writeFunctions(cmd)
-
-            if "Sys" != self.file_name:
-                self.list_ou_asm += [
+            list_writers = self.list_writers
+            if None == self.profiler:
+                for cmd in iter_in_vm:
+                    yield list_writers[cmd.type](cmd)
+            else:
+                for cmd in iter_in_vm:
+                    yield self.profileCmd(cmd, list_writers[cmd.type](cmd))
+            if list_writers is self.list_writers_batched:
+                yield self.commitReachable()
+
+            if True == guard:
+                yield [
                     "(FILE_%s_END)" % (self.file_name, ),
                 ]
+            elif LEVEL_STACK == self.level:
+                yield ASM_END_OF_FILE
+
+        def genCmds(self, list_in_vm):
+            for asm_cmds in self.iterCmds(list_in_vm):
+                self.list_ou_asm += asm_cmds
+
         def get_output(self):
             return self.list_ou_asm
 
-    def __init__(self, file_path):
+    class Optimizer:
+        '''
+        Simplifies a list of parsed vm commands before the code generation. Constant arithmetic and
+        comparisons are folded, branches on a known condition become a goto or disappear, and the
+        unreachable commands following a goto or a return are removed. Then the jumps of every
+        function are threaded and inverted, and its while loops are rotated.
+        '''
+        def __init__(self, file_name):
+            self.file_name = file_name
+            self.num_in = 0   # number of vm commands read so far
+            self.num_out = 0  # number of vm commands passed on so far
+            self.num_jumps_removed = 0
+            self.num_jumps_threaded = 0
+            self.num_loops_rotated = 0
+
+        def get_num_removed(self):
+            return self.num_in - self.num_out
+
+        def get_stats(self):
+            '''
+            The numbers of vm commands removed, jumps removed, jumps threaded and loops rotated
+            '''
+            return [self.get_num_removed(), self.num_jumps_removed, self.num_jumps_threaded, self.num_loops_rotated]
+
+        def const_commands(self, val, index):
+            '''
+            vm commands that push a constant value, negative values are pushed as the complement
+            of a non-negative one since "push constant" only takes 0..32767
+            '''
+            if val >= 0:
+                return [Parser.Command(C_PUSH, SEG_CONSTANT, val, index)]
+            return [
+                Parser.Command(C_PUSH, SEG_CONSTANT, ~val, index),
+                Parser.Command(C_NOT, index = index),
+            ]
+
+        def fold_constants(self, iter_cmds):
+            '''
+            Generator. Only the trailing run of constant pushes is held back, since it may still be
+            folded by the next commands, and it never grows beyond FOLD_WINDOW values
+            '''
+            list_pending = []
+            # values known at translation time on the top of the stack, along with the position
+            # in list_pending of the first command which pushes them
+            list_known = []
+            for cmd in iter_cmds:
+                self.num_in += 1
+                cmd_type = cmd.type
+                if C_PUSH == cmd_type and SEG_CONSTANT == cmd.arg1:
+                    if len(list_known) >= FOLD_WINDOW:
+                        for pending in list_pending:
+                            yield pending
+                        list_pending = []
+                        list_known = []
+                    list_known.append((cmd.arg2, len(list_pending)))
+                    list_pending.append(cmd)
+                elif cmd_type in dict_fold_unary and len(list_known) >= 1:
+                    x, pos = list_known.pop()
+                    val = dict_fold_unary[cmd_type](x)
+                    del list_pending[pos:]
+                    list_known.append((val, pos))
+                    list_pending += self.const_commands(val, cmd.index)
+                elif cmd_type in dict_fold_binary and len(list_known) >= 2:
+                    y, pos = list_known.pop()
+                    x, pos = list_known.pop()
+                    val = dict_fold_binary[cmd_type](x, y)
+                    del list_pending[pos:]
+                    list_known.append((val, pos))
+                    list_pending += self.const_commands(val, cmd.index)
+                elif C_IF == cmd_type and len(list_known) >= 1:
+                    # the condition is known, so is the branch taken or not
+                    x, pos = list_known.pop()
+                    del list_pending[pos:]
+                    for pending in list_pending:
+                        yield pending
+                    if 0 != x:
+                        yield Parser.Command(C_GOTO, cmd.arg1, index = cmd.index)
+                    list_pending = []
+                    list_known = []
+                else:
+                    for pending in list_pending:
+                        yield pending
+                    yield cmd
+                    list_pending = []
+                    list_known = []
+            for pending in list_pending:
+                yield pending
+
+        def eliminate_dead_code(self, iter_cmds):
+            '''
+            Generator, drops the commands following a goto or a return up to the next label
+            '''
+            reachable = True
+            for cmd in iter_cmds:
+                cmd_type = cmd.type
+                # a label or a function declaration is the only way back into the code
+                if C_LABEL == cmd_type or C_FUNCTION == cmd_type:
+                    reachable = True
+                if True == reachable:
+                    self.num_out += 1
+                    yield cmd
+                if C_GOTO == cmd_type or C_RETURN == cmd_type:
+                    reachable = False
+
+        def iter_functions(self, iter_cmds):
+            '''
+            Generator of the commands grouped by function, one list per function. The commands before
+            the first function of a file make a list of their own
+            '''
+            list_func = []
+            for cmd in iter_cmds:
+                if C_FUNCTION == cmd.type and 0 != len(list_func):
+                    yield list_func
+                    list_func = []
+                list_func.append(cmd)
+            if 0 != len(list_func):
+                yield list_func
+
+        def simplify_control_flow(self, iter_cmds):
+            '''
+            Generator. The commands of a function are held back until the function ends, then they
+            go through simplify_jumps
+            '''
+            for list_func in self.iter_functions(iter_cmds):
+                list_out = self.simplify_jumps(list_func)
+                self.num_out -= len(list_func) - len(list_out)
+                for cmd in list_out:
+                    yield cmd
+
+        def simplify_jumps(self, list_cmds):
+            '''
+            Rewrite the jumps of a function, or of the commands before the first function of a file,
+            until no rule of rewrite_jumps and rotate_loops applies. The passes work on a list of items:
+            the labels, jumps and returns, and the runs of other commands in between as C_RUN items. A
+            function whose labels are defined twice or not at all is left alone, the stack depth check
+            reports it
+            '''
+            list_control = [pos for pos, cmd in enumerate(list_cmds) if cmd.type in set_control]
+            set_labels = set()
+            num_jumps = 0
+            for pos in list_control:
+                cmd = list_cmds[pos]
+                if C_LABEL == cmd.type:
+                    if cmd.arg1 in set_labels:
+                        return list_cmds
+                    set_labels.add(cmd.arg1)
+                elif cmd.type in set_jumps:
+                    num_jumps += 1
+            if 0 == num_jumps:
+                return list_cmds
+            for pos in list_control:
+                if list_cmds[pos].type in set_jumps and list_cmds[pos].arg1 not in set_labels:
+                    return list_cmds
+
+            list_items = []
+            pos_run = 0
+            for pos in list_control:
+                if pos_run < pos:
+                    list_items.append(Parser.Command(C_RUN, list_cmds[pos_run:pos]))
+                list_items.append(list_cmds[pos])
+                pos_run = pos + 1
+            if pos_run < len(list_cmds):
+                list_items.append(Parser.Command(C_RUN, list_cmds[pos_run:]))
+            changed = True
+            while True == changed:
+                list_items, changed = self.rewrite_jumps(list_items)
+                if False == changed:
+                    list_items, changed = self.rotate_loops(list_items)
+
+            list_out = []
+            for item in list_items:
+                if C_RUN == item.type:
+                    list_out += item.arg1
+                else:
+                    list_out.append(item)
+            return list_out
+
+        def rewrite_jumps(self, list_items):
+            '''
+            One pass of the jump rewriting rules over the items of a function:
+            - a jump to a goto jumps to the target of the goto instead (jump threading)
+            - a goto to the command right after it is dropped
+            - a conditional jump over a goto becomes the opposite conditional jump to the target of the goto
+            - the not between a comparison and a conditional jump is dropped, the jump is inverted. The
+              result of a comparison is 0 or -1, so that not turns it into its logical opposite
+            Then the labels no jump goes to are dropped, along with the commands which cannot be reached
+            any more. Return the new items and whether anything changed
+            '''
+            num_items = len(list_items)
+            dict_labels = {}
+            for i, item in enumerate(list_items):
+                if C_LABEL == item.type:
+                    dict_labels[item.arg1] = i
+
+            def labels_from(i):
+                # the labels of the run of labels starting at item i
+                set_run = set()
+                while i < num_items and C_LABEL == list_items[i].type:
+                    set_run.add(list_items[i].arg1)
+                    i += 1
+                return set_run
+
+            def final_target(label):
+                set_seen = set()
+                while label not in set_seen:
+                    set_seen.add(label)
+                    i = dict_labels[label] + 1
+                    while i < num_items and C_LABEL == list_items[i].type:
+                        i += 1
+                    if i >= num_items or C_GOTO != list_items[i].type:
+                        break
+                    label = list_items[i].arg1
+                return label
+
+            dict_new = {}  # item index -> the item replacing it, None when it is removed
+            for i, cmd in enumerate(list_items):
+                if cmd.type not in set_jumps or i in dict_new:
+                    continue
+                target = final_target(cmd.arg1)
+                if target != cmd.arg1:
+                    cmd = Parser.Command(cmd.type, target, index = cmd.index)
+                    self.num_jumps_threaded += 1
+                if C_GOTO == cmd.type:
+                    if target in labels_from(i + 1):
+                        self.num_jumps_removed += 1
+                        cmd = None
+                elif i + 1 < num_items and C_GOTO == list_items[i + 1].type and target in labels_from(i + 2):
+                    cmd = Parser.Command(dict_opposite_jumps[cmd.type], list_items[i + 1].arg1, index = cmd.index)
+                    dict_new[i + 1] = None
+                    self.num_jumps_removed += 1
+                # only a conditional jump pops the negated comparison, a goto leaves it on the stack
+                if None == cmd or cmd.type not in dict_opposite_jumps or 0 == i:
+                    run = None
+                else:
+                    run = list_items[i - 1]
+                if None != run and C_RUN == run.type and len(run.arg1) >= 2 and C_NOT == run.arg1[-1].type \
+                        and run.arg1[-2].type in dict_compare_jumps:
+                    cmd = Parser.Command(dict_opposite_jumps[cmd.type], cmd.arg1, index = cmd.index)
+                    dict_new[i - 1] = Parser.Command(C_RUN, run.arg1[:-1])
+                if cmd is not list_items[i]:
+                    dict_new[i] = cmd
+            changed = 0 != len(dict_new)
+
+            set_targets = set()
+            for i, item in enumerate(list_items):
+                item = dict_new.get(i, item)
+                if None != item and item.type in set_jumps:
+                    set_targets.add(item.arg1)
+            list_out = []
+            reachable = True
+            for i, item in enumerate(list_items):
+                item = dict_new.get(i, item)
+                if None == item:
+                    continue
+                if C_RUN == item.type:
+                    if False == reachable:
+                        changed = True
+                    elif 0 != len(list_out) and C_RUN == list_out[-1].type:
+                        list_out[-1] = Parser.Command(C_RUN, list_out[-1].arg1 + item.arg1)  # the label in between is gone
+                    else:
+                        list_out.append(item)
+                    continue
+                if C_LABEL == item.type:
+                    if item.arg1 not in set_targets:
+                        changed = True
+                        continue
+                    reachable = True
+                if True == reachable:
+                    list_out.append(item)
+                else:
+                    changed = True
+                if C_GOTO == item.type or C_RETURN == item.type:
+                    reachable = False
+            return (list_out, changed)
+
+        def rotate_loops(self, list_items):
+            '''
+            Rotate the loops of a function in the shape of a while loop,
+
+                label H; condition; if-goto E; body; goto H; label E
+
+            into
+
+                goto H; label B; body; label H; condition; if-not-goto B; label E
+
+            so that an iteration runs a conditional jump alone, instead of a conditional jump and a
+            goto. The condition has no label and no jump, the loops in the body are rotated as well.
+            Return the new items and whether a loop was rotated
+            '''
+            num_items = len(list_items)
+            dict_labels = {}
+            for i, item in enumerate(list_items):
+                if C_LABEL == item.type:
+                    dict_labels[item.arg1] = i
+            num_rotated = self.num_loops_rotated
+            list_out = []
+
+            def rotate_range(i, i_stop):
+                i_run = i  # first item not copied yet
+                while i < i_stop:
+                    cmd = list_items[i]
+                    i += 1
+                    if C_LABEL != cmd.type:
+                        continue
+                    i_head = i - 1
+                    i_exit = i
+                    if i_exit < i_stop and C_RUN == list_items[i_exit].type:
+                        i_exit += 1  # the condition
+                    if i_exit >= i_stop or list_items[i_exit].type not in dict_opposite_jumps:
+                        continue
+                    cmd_exit = list_items[i_exit]
+                    i_end = dict_labels[cmd_exit.arg1]
+                    # the goto closing the loop, right before its exit
+                    i_back = i_end - 1
+                    cmd_back = list_items[i_back]
+                    if i_end >= i_stop or i_back <= i_exit + 1 or C_GOTO != cmd_back.type or cmd.arg1 != cmd_back.arg1:
+                        continue
+                    label_body = cmd.arg1 + "$BODY"
+                    while label_body in dict_labels:
+                        label_body += "$"
+                    dict_labels[label_body] = None
+                    index = cmd_exit.index
+                    list_out.extend(list_items[i_run:i_head])
+                    list_out.append(Parser.Command(C_GOTO, cmd.arg1, index = index))
+                    list_out.append(Parser.Command(C_LABEL, label_body, index = index))
+                    rotate_range(i_exit + 1, i_back)
+                    list_out.extend(list_items[i_head:i_exit])
+                    list_out.append(Parser.Command(dict_opposite_jumps[cmd_exit.type], label_body, index = index))
+                    self.num_loops_rotated += 1
+                    i = i_end
+                    i_run = i_end
+                list_out.extend(list_items[i_run:i_stop])
+
+            rotate_range(0, num_items)
+            if num_rotated == self.num_loops_rotated:
+                return (list_items, False)
+            return (list_out, True)
+
+        def check_stack_depths(self, iter_cmds):
+            '''
+            Generator. The commands of a function are held back until the function ends, then they
+            go through analyze_stack_depths
+            '''
+            for list_func in self.iter_functions(iter_cmds):
+                self.analyze_stack_depths(list_func)
+                for func_cmd in list_func:
+                    yield func_cmd
+
+        def analyze_stack_depths(self, list_cmds):
+            '''
+            Follow the stack depth along every path from the entry of a function, the depth being 0
+            once the local variables are pushed. It must never go below 0, and must be the same on
+            every path reaching a label. The commands before the first function of a file are
+            checked the same way
+            '''
+            if C_FUNCTION == list_cmds[0].type:
+                func_name = list_cmds[0].arg1
+            else:
+                func_name = self.file_name
+            dict_labels = {}
+            for pos, cmd in enumerate(list_cmds):
+                if C_LABEL == cmd.type:
+                    if cmd.arg1 in dict_labels:
+                        self.stack_error(func_name, "label %s is defined twice" % (cmd.arg1, ))
+                    dict_labels[cmd.arg1] = pos
+
+            dict_depths = {0: 0}  # position of the first command of a basic block -> stack depth there
+            list_work = [0]
+            def propagate(pos, depth):
+                if pos not in dict_depths:
+                    dict_depths[pos] = depth
+                    list_work.append(pos)
+                elif depth != dict_depths[pos]:
+                    self.stack_error(func_name, "the stack depth at label %s is %d on a path and %d on another" % (
+                        list_cmds[pos].arg1, dict_depths[pos], depth, ))
+
+            while 0 != len(list_work):
+                pos = list_work.pop()
+                depth = dict_depths[pos]
+                pos_start = pos
+                while pos < len(list_cmds):
+                    cmd = list_cmds[pos]
+                    cmd_type = cmd.type
+                    if C_LABEL == cmd_type and pos != pos_start:
+                        propagate(pos, depth)  # the next basic block
+                        break
+                    num_pops = list_stack_pops[cmd_type]
+                    if C_CALL == cmd_type:
+                        num_pops = cmd.arg2
+                    if depth < num_pops:
+                        self.stack_error(func_name, "stack underflow at vm command %d" % (cmd.index, ))
+                    depth += list_stack_pushes[cmd_type] - num_pops
+                    if cmd_type in set_jumps:
+                        pos_target = dict_labels.get(cmd.arg1)
+                        if None == pos_target:
+                            self.stack_error(func_name, "label %s is not defined" % (cmd.arg1, ))
+                        propagate(pos_target, depth)
+                    if C_GOTO == cmd_type or C_RETURN == cmd_type:
+                        break
+                    pos += 1
+
+        def stack_error(self, func_name, message):
+            print "Stack error in %s (%s.vm): %s" % (func_name, self.file_name, message, )
+            sys.exit(1)
+
+        def optimize(self, iter_cmds, level = 1):
+            '''
+            Chain the optimization passes, the result is a generator of vm commands
+            '''
+            iter_cmds = self.simplify_control_flow(self.eliminate_dead_code(self.fold_constants(iter_cmds)))
+            if level >= 2:
+                iter_cmds = self.check_stack_depths(iter_cmds)
+            return iter_cmds
+
+    def __init__(self, file_path, profiler = None, level = LEVEL_FULL, file_guard = True):
         self.list_in_vm = []      # a list of raw vm commands after pre-processing
         self.list_in_parsed = []  # a list of Command instances after vm parsing
         self.file_name = os.path.basename(file_path).split(".")[0]  # file name of the current vm file, used for static variables
-        self.cw = self.CodeWriter(self.file_name)  # an instance of code writer
+        self.max_opcode = list_level_max_opcode[level]  # the commands beyond it are not supported at this level
+        self.cw = self.CodeWriter(self.file_name, profiler, level, file_guard)  # an instance of code writer
+        self.opt = self.Optimizer(self.file_name)  # an instance of optimizer
         self.ind_cmd = 0  # global index for vm commands in a vm file
 
 
+    def iter_vm_lines(self, iter_raw_lines):
+        '''
+        Generator of the vm commands in the given raw lines, with the comments and the extra
+        white-spaces removed. A /* */ comment may span several lines
+        '''
+        in_comment = False
+        for line in iter_raw_lines:
+            if False == in_comment and "/" not in line:
+                line = line.strip()
+                if "" != line:
+                    yield line
+                continue
+            str_code = ""
+            while "" != line:
+                if True == in_comment:
+                    pos_end = line.find("*/")
+                    if -1 == pos_end:
+                        break
+                    line = line[pos_end + 2:]
+                    in_comment = False
+                    continue
+                pos_line = line.find("//")
+                pos_block = line.find("/*")
+                if -1 != pos_line and (-1 == pos_block or pos_line < pos_block):
+                    str_code += line[:pos_line]
+                    break
+                elif -1 != pos_block:
+                    str_code += line[:pos_block] + " "
+                    line = line[pos_block + 2:]
+                    in_comment = True
+                else:
+                    str_code += line
+                    break
+            str_code = str_code.strip()
+            if "" != str_code:
+                yield str_code
+
+    def iter_parsed(self, iter_vm):
+        '''
+        Generator of the Command instances of the given vm commands
+        '''
+        parse_vm_command = self.parse_vm_command
+        for cmd in iter_vm:
+            yield parse_vm_command(cmd)
+
+    def translate(self, iter_raw_lines, optimize, report = None):
+        '''
+        Stream the raw lines of the vm file through the parser, the optimizer and the code writer.
+        The result is a generator of lists of asm lines, only the optimizer holds some commands back.
+        The asm code of every command is measured by report when one is given
+        '''
+        iter_cmds = self.iter_parsed(self.iter_vm_lines(iter_raw_lines))
+        if optimize >= 1:
+            iter_cmds = self.opt.optimize(iter_cmds, optimize)
+        self.cw.set_sp_batching(optimize >= 2)
+        if None != report:
+            return report.iter_asm(self.cw.iterCmds(report.iter_commands(self.file_name, iter_cmds)))
+        return self.cw.iterCmds(iter_cmds)
+
     def set_input_str(self, str_in):
         '''
         Feed the raw vm file content to this class and do some pre-preocessing
         '''
-        # get rid of the leading and trailing whitespaces
-        str_in_vm = str_in.strip()
-        # remove multi-lines comments. Note that the question mark(?) here indicates a non-greedy match mode
-        str_in_vm = re.sub("\/\*.*?\*\/", "", str_in_vm, flags = re.DOTALL)
-        # remove single line comments
-        str_in_vm = re.sub("\/\/.*", "", str_in_vm)
-        str_in_vm = str_in_vm.strip()
-        self.list_in_vm = [i.strip() for i in str_in_vm.split("\n") if "" != i.strip()]
+        self.list_in_vm = list(self.iter_vm_lines(str_in.split("\n")))
 
     def parse_vm_code(self):
         # iterate the list, parse every command, store the result into a new data structure
-        for cmd in self.list_in_vm:
-            self.list_in_parsed.append(self.parse_vm_command(cmd))
+        parse_vm_command = self.parse_vm_command
+        self.list_in_parsed += [parse_vm_command(cmd) for cmd in self.list_in_vm]
+
+    def optimize_vm_code(self, level = 1):
+        '''
+        Run the optimizer over the parsed commands, return the number of commands removed
+        '''
+        self.list_in_parsed = list(self.opt.optimize(self.list_in_parsed, level))
+        return self.opt.get_num_removed()
 
     def generate_asm_code(self):
         self.cw.genCmds(self.list_in_parsed)
         return self.cw.get_output()
 
     def parse_vm_command(self, raw_cmd):
-        cmd = self.Command()
-        cmd.set_index(self.ind_cmd)
+        '''
+        Parse one vm command. The line is split only once and the command is looked up by its first word,
+        the operands are checked on the way
+        '''
+        index = self.ind_cmd
         self.ind_cmd += 1
-        cmd.raw_str = raw_cmd
-
-        if regex_cmd_ari.match(raw_cmd):
-            cmd.set_type(C_ARITHEMETIC)
-        elif regex_cmd_push.match(raw_cmd):
-            cmd.set_type(C_PUSH)
-            obj_matched = regex_cmd_push.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-            cmd.set_arg2(obj_matched.group(2))
-        elif regex_cmd_pop.match(raw_cmd):
-            cmd.set_type(C_POP)
-            obj_matched = regex_cmd_pop.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-            cmd.set_arg2(obj_matched.group(2))
-        elif regex_cmd_label.match(raw_cmd):
-            cmd.set_type(C_LABEL)
-            obj_matched = regex_cmd_label.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-        elif regex_cmd_goto.match(raw_cmd):
-            cmd.set_type(C_GOTO)
-            obj_matched = regex_cmd_goto.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-        elif regex_cmd_if.match(raw_cmd):
-            cmd.set_type(C_IF)
-            obj_matched = regex_cmd_if.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-        elif regex_cmd_func.match(raw_cmd):
-            cmd.set_type(C_FUNCTION)
-            obj_matched = regex_cmd_func.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-            cmd.set_arg2(obj_matched.group(2))
-        elif regex_cmd_ret.match(raw_cmd):
-            cmd.set_type(C_RETURN)
-        elif regex_cmd_call.match(raw_cmd):
-            cmd.set_type(C_CALL)
-            obj_matched = regex_cmd_call.match(raw_cmd)
-            cmd.set_arg1(obj_matched.group(1))
-            cmd.set_arg2(obj_matched.group(2))
-
-        return cmd
+        list_words = raw_cmd.split()
+        entry = dict_vm_commands.get(list_words[0])
+        if None == entry or len(list_words) != list_num_operands[entry[1]] + 1:
+            self.parse_error(raw_cmd)
+        cmd_type, operands = entry
+        if cmd_type > self.max_opcode:
+            print "Unsupported vm command at this level in %s: %s" % (self.file_name, raw_cmd, )
+            sys.exit(1)
+
+        if OPD_NONE == operands:
+            return self.Command(cmd_type, None, 0, index)
+        elif OPD_SEGMENT == operands:
+            seg = dict_mem_segs.get(list_words[1])
+            if None == seg or False == list_words[2].isdigit():
+                self.parse_error(raw_cmd)
+            i = int(list_words[2])
+            if i > list_seg_max_index[seg] or (SEG_CONSTANT == seg and C_POP == cmd_type):
+                self.parse_error(raw_cmd)
+            return self.Command(cmd_type, seg, i, index)
+        elif OPD_SYMBOL == operands:
+            if None == regex_symbol.match(list_words[1]):
+                self.parse_error(raw_cmd)
+            return self.Command(cmd_type, list_words[1], 0, index)
+        else:
+            if None == regex_symbol.match(list_words[1]) or False == list_words[2].isdigit():
+                self.parse_error(raw_cmd)
+            return self.Command(cmd_type, list_words[1], int(list_words[2]), index)
+
+    def parse_error(self, raw_cmd):
+        print "Invalid vm command in %s: %s" % (self.file_name, raw_cmd, )
+        sys.exit(1)
+
+
+class TranslationCache:
+    '''
+    Keeps the asm code of every translated vm file in a folder, one entry per file, so that the
+    files left untouched since the previous build are not translated again. An entry is keyed by
+    the sha1 of the vm code, the file name (static variables and labels are named after it), the
+    options given and the translator itself. The asm code of a file must depend on nothing else:
+    an option that makes it depend on the other files has to be part of the options, or the cache
+    must not be used along with it. The least recently used entries beyond max_entries are evicted.
+    '''
+    def __init__(self, cache_dir, max_entries, options):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.num_hits = 0
+        self.num_misses = 0
+        if False == os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError as e:
+                print "Cannot create the cache folder: %s" % (str(e), )
+                sys.exit(1)
+        fd_translator = open_file(os.path.abspath(__file__), "rb")
+        self.prefix = "%s\0%r\0" % (hashlib.sha1(fd_translator.read()).hexdigest(), options, )
+        fd_translator.close()
+
+    def get_key(self, vm_file, str_in):
+        file_name = os.path.basename(vm_file).split(".")[0]
+        return hashlib.sha1(self.prefix + file_name + "\0" + str_in).hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".asm")
+
+    def load(self, key):
+        '''
+        Return the (asm code, statistics of the optimizer) of an entry, or None if it is not cached
+        '''
+        entry_path = self.get_entry_path(key)
+        try:
+            fd_entry = open(entry_path, "r")
+            list_stats = [int(num) for num in fd_entry.readline().split()]
+            str_asm = fd_entry.read()
+            fd_entry.close()
+            os.utime(entry_path, None)  # the entry is the most recently used one now
+        except (IOError, OSError, ValueError):
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        return (str_asm, list_stats)
+
+    def store(self, key, result):
+        '''
+        Save an entry, it is written aside and renamed so that a concurrent build never reads a
+        partial one
+        '''
+        entry_path = self.get_entry_path(key)
+        temp_path = "%s.%d.tmp" % (entry_path, os.getpid(), )
+        try:
+            fd_entry = open(temp_path, "w")
+            fd_entry.write("%s\n" % (" ".join([str(num) for num in result[1]]), ))
+            fd_entry.write(result[0])
+            fd_entry.close()
+            os.rename(temp_path, entry_path)
+        except (IOError, OSError) as e:
+            print "Cannot write the cache entry %s: %s" % (entry_path, str(e), )
+
+    def evict(self):
+        list_entries = []
+        for f in os.listdir(self.cache_dir):
+            if f.endswith(".asm"):
+                entry_path = os.path.join(self.cache_dir, f)
+                list_entries.append((os.path.getmtime(entry_path), entry_path))
+        list_entries.sort()
+        for mtime, entry_path in list_entries[:max(0, len(list_entries) - self.max_entries)]:
+            os.remove(entry_path)
+
+
+class HackAssembler:
+    '''
+    The binary backend. Assembles the asm code handed over by the code writer in memory, so that
+    the Hack machine code is written without any .asm file in between. Every distinct asm line is
+    encoded only once, since the code writer keeps emitting the same templates. The symbols follow
+    the rules of the assembler in project 06: the first definition of a label wins, the predefined
+    symbols cannot be redefined, and the other symbols are variables allocated from RAM[16] on in
+    the order they are first used.
+    '''
+    def __init__(self):
+        self.list_words = []     # machine code, 0 at the place of a symbol not resolved yet
+        self.list_fixups = []    # (position in list_words, symbol) of the A-instructions to resolve
+        self.dict_labels = {}    # label -> ROM address
+        self.dict_encoded = {}   # asm line -> machine code, or the symbol of an A-instruction
+
+    def add_lines(self, asm_lines):
+        list_words = self.list_words
+        dict_encoded = self.dict_encoded
+        for line in asm_lines:
+            if "(" == line[0]:
+                label = line[1:-1]
+                if label not in self.dict_labels and label not in dict_hack_predefined:
+                    self.dict_labels[label] = len(list_words)
+                continue
+            word = dict_encoded.get(line)
+            if None == word:
+                word = self.encode(line)
+                dict_encoded[line] = word
+            if word.__class__ is int:
+                list_words.append(word)
+            else:
+                self.list_fixups.append((len(list_words), word))
+                list_words.append(0)
+
+    def encode(self, line):
+        '''
+        Encode a single instruction, an A-instruction with a symbol other than a predefined one
+        is returned as the symbol itself
+        '''
+        if "@" == line[0]:
+            symbol = line[1:]
+            if True == symbol.isdigit():
+                addr = int(symbol)
+                if addr >= HACK_ROM_SIZE:
+                    self.asm_error(line)
+                return addr
+            return dict_hack_predefined.get(symbol, symbol)
+        dest, sep, comp = line.rpartition("=")
+        comp, sep, jump = comp.partition(";")
+        if comp not in dict_hack_comp or dest not in dict_hack_dest or jump not in dict_hack_jump:
+            self.asm_error(line)
+        return 0xE000 | dict_hack_comp[comp] << 6 | dict_hack_dest[dest] << 3 | dict_hack_jump[jump]
+
+    def asm_error(self, line):
+        print "Invalid asm instruction: %s" % (line, )
+        sys.exit(1)
+
+    def get_machine_code(self):
+        '''
+        Resolve the symbols and return the machine code as a list of 16-bit words
+        '''
+        if len(self.list_words) > HACK_ROM_SIZE:
+            print "Error: the program takes %d instructions, the ROM only holds %d" % (len(self.list_words), HACK_ROM_SIZE, )
+            sys.exit(1)
+        list_words = self.list_words
+        dict_labels = self.dict_labels
+        dict_vars = {}
+        for pos, symbol in self.list_fixups:
+            addr = dict_labels.get(symbol)
+            if None != addr and addr >= HACK_ROM_SIZE:
+                print "Error: the label %s is out of the ROM" % (symbol, )
+                sys.exit(1)
+            if None == addr:
+                addr = dict_vars.get(symbol)
+                if None == addr:
+                    addr = HACK_VAR_BASE + len(dict_vars)
+                    dict_vars[symbol] = addr
+            list_words[pos] = addr
+        self.list_fixups = []
+        return list_words
+
+
+class OutputWriter:
+    '''
+    Writes the translated program in the requested format: asm for the Hack assembly, hack for the
+    Hack machine code as text, or bin for the machine code packed into big-endian 16-bit words.
+    The asm code may be kept along with the machine code for debugging. Everything goes to
+    temporary files which replace the output files once close() is called.
+    '''
+    def __init__(self, file_path, out_format, keep_asm):
+        if os.path.isdir(file_path):
+            path_base = file_path + "/" + os.path.basename(file_path)
+        else:
+            path_base = file_path.split(".")[0]
+        self.path_base = path_base
+        self.list_paths = []
+        self.fd_asm = None
+        self.list_batch = []
+        self.assembler = None
+        if "asm" == out_format or True == keep_asm:
+            self.list_paths.append(path_base + ".asm")
+            self.fd_asm = open_file(path_base + ".asm.tmp", "w")
+        if "asm" != out_format:
+            self.list_paths.append(path_base + "." + out_format)
+            self.out_format = out_format
+            self.assembler = HackAssembler()
+
+    def write_asm(self, asm_cmds):
+        '''
+        Take a list of asm lines, the asm file is written ASM_WRITE_BATCH lines at a time
+        '''
+        if None != self.fd_asm:
+            self.list_batch += asm_cmds
+            if len(self.list_batch) >= ASM_WRITE_BATCH:
+                self.flush()
+        if None != self.assembler:
+            self.assembler.add_lines(asm_cmds)
+
+    def write_text(self, str_asm):
+        '''
+        Take a block of asm code as text, one instruction per line
+        '''
+        if None != self.fd_asm:
+            self.flush()
+            self.fd_asm.write(str_asm)
+        if None != self.assembler:
+            self.assembler.add_lines(str_asm.splitlines())
+
+    def flush(self):
+        if 0 != len(self.list_batch):
+            self.fd_asm.write("\n".join(self.list_batch) + "\n")
+            self.list_batch = []
+
+    def close(self):
+        if None != self.fd_asm:
+            self.flush()
+            self.fd_asm.close()
+        if None != self.assembler:
+            list_words = self.assembler.get_machine_code()
+            if "hack" == self.out_format:
+                fd_ou_file = open_file(self.list_paths[-1] + ".tmp", "w")
+                dict_lines = {}
+                list_lines = []
+                for word in list_words:
+                    line = dict_lines.get(word)
+                    if None == line:
+                        line = format(word, "016b") + "\n"
+                        dict_lines[word] = line
+                    list_lines.append(line)
+                fd_ou_file.write("".join(list_lines))
+            else:
+                fd_ou_file = open_file(self.list_paths[-1] + ".tmp", "wb")
+                array_words = array.array("H", list_words)
+                if "little" == sys.byteorder:
+                    array_words.byteswap()
+                array_words.tofile(fd_ou_file)
+            fd_ou_file.close()
+        for path in self.list_paths:
+            os.rename(path + ".tmp", path)
+        return self.list_paths
+
+    def discard(self):
+        '''
+        Give up on the output, the temporary files are removed and the previous output files are kept
+        '''
+        if None != self.fd_asm:
+            self.fd_asm.close()
+        for path in self.list_paths:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+
+
+class Profiler:
+    '''
+    Instruments the translated program with counters kept in RAM, from PROFILE_ADDR_TOP downwards:
+    a clock counting the instructions run so far, then for every function the number of calls, the
+    clock at its latest entry and its self cycles, the instructions run in its own code, and for
+    every call site the number of calls made there. The self cycles of all the functions make a
+    flat profile. The instructions of every basic block are counted when it is translated and added
+    to the clock and to the self cycles of its function before the block is left, the call code is
+    counted for the caller and the return code for the callee. A comparison is counted as 6
+    instructions, halfway between its branches, the bootstrap, the file guards and the
+    instrumentation itself are not counted. The clock, the entry timestamps and the self cycles take
+    2 words each. A basic block costs 12 more instructions, 18 when a counter carries into its high
+    word, a function entry 10 and a call site 2. The counters are numbered across the whole program,
+    in the order the code is translated, and the symbol map tells which counter is which. They rely
+    on the RAM being cleared at reset.
+    '''
+    def __init__(self, addr_top):
+        self.addr_top = addr_top   # the clock
+        self.addr_next = addr_top - 2
+        self.list_counters = [(addr_top, "clock", "instructions run so far")]
+        self.dict_functions = {}   # function name -> (calls counter, entry timestamp, self cycles)
+        self.num_labels = 0
+
+    def alloc(self, kind, name, size = 1):
+        '''
+        Allocate a counter of size words, the address of its highest word is returned
+        '''
+        addr = self.addr_next
+        if addr - size + 1 < PROFILE_ADDR_MIN:
+            print "Error: too many profiler counters, only RAM[%d..%d] is reserved for them" % (PROFILE_ADDR_MIN, self.addr_top, )
+            sys.exit(1)
+        self.addr_next -= size
+        self.list_counters.append((addr, kind, name))
+        return addr
+
+    def get_function(self, func_name):
+        counters = self.dict_functions.get(func_name)
+        if None == counters:
+            counters = (self.alloc("calls", func_name), self.alloc("entry", func_name, 2), self.alloc("self", func_name, 2))
+            self.dict_functions[func_name] = counters
+        return counters
+
+    def count_cycles(self, asm_cmds):
+        num_instructions = 0
+        for line in asm_cmds:
+            if "(" != line[0]:
+                num_instructions += 1
+        return num_instructions
+
+    def function_entry(self, func_name):
+        counters = self.get_function(func_name)
+        return [
+            "@%d" % (counters[0], ),  # calls += 1
+            "M=M+1",
+            "@%d" % (self.addr_top - 1, ),  # entry = clock
+            "D=M",
+            "@%d" % (counters[1] - 1, ),
+            "M=D",
+            "@%d" % (self.addr_top, ),
+            "D=M",
+            "@%d" % (counters[1], ),
+            "M=D",
+        ]
+
+    def add_counter(self, addr):
+        '''
+        The low word of the counter at addr is in D, carry it into the high word when it overflowed
+        '''
+        label = "PROFILE.%d" % (self.num_labels, )
+        self.num_labels += 1
+        return [
+            "@" + label,
+            "D;JGE",
+            "@%d" % (PROFILE_LOW_RANGE - 1, ),
+            "D=D&A",
+            "@%d" % (addr - 1, ),
+            "M=D",
+            "@%d" % (addr, ),
+            "M=M+1",
+            "(%s)" % (label, ),
+        ]
+
+    def add_cycles(self, func_name, num_cycles):
+        '''
+        Add num_cycles to the clock and to the self cycles of func_name, D is lost
+        '''
+        addr_self = self.get_function(func_name)[2]
+        asm_cmds = []
+        while num_cycles > 0:
+            # the sum of the low words must not reach past 16 bits
+            num = min(num_cycles, PROFILE_LOW_RANGE - 1)
+            num_cycles -= num
+            asm_cmds += [
+                "@%d" % (num, ),
+                "D=A",
+                "@%d" % (self.addr_top - 1, ),
+                "M=D+M",
+                "@%d" % (addr_self - 1, ),
+                "MD=D+M",
+            ] + self.add_counter(addr_self) + [
+                "@%d" % (self.addr_top - 1, ),
+                "D=M",
+            ] + self.add_counter(self.addr_top)
+        return asm_cmds
+
+    def call_site(self, caller, callee, file_name, index):
+        addr = self.alloc("site", "%s -> %s (%s.vm command %d)" % (caller, callee, file_name, index, ))
+        return ["@%d" % (addr, ), "M=M+1"]
+
+    def write_map(self, map_path):
+        fd_map = open_file(map_path, "w")
+        fd_map.write("# profiler counters in RAM[%d..%d]\n" % (self.addr_next + 1, self.addr_top, ))
+        fd_map.write("# clock, entry and self take 2 words: RAM[address] * %d + RAM[address - 1]\n" % (PROFILE_LOW_RANGE, ))
+        fd_map.write("# address kind name\n")
+        for addr, kind, name in self.list_counters:
+            fd_map.write("%d %s %s\n" % (addr, kind, name, ))
+        fd_map.close()
+
+
+class FootprintReport:
+    '''
+    Measures the asm code of every vm function: its vm commands, its Hack instructions, the share
+    of them spent on the call/return boilerplate (function, call and return commands) and on the
+    comparisons, and the cycles taken by the shortest and the longest path from its entry to a
+    return. The jumps backwards are not followed, so the paths go around the loops without any
+    iteration, and the callees are not counted. The instructions outside of any function
+    (bootstrap, file guards) are kept apart.
+    '''
+    def __init__(self):
+        self.list_functions = []  # [function name, file name, list of [vm command, instructions]]
+        self.list_cmds_cur = None
+        self.cmd_cur = None
+        self.num_other = 0
+
+    def iter_commands(self, file_name, iter_cmds):
+        '''
+        Generator passing the vm commands through, it tells iter_asm which command the asm code
+        coming next belongs to
+        '''
+        self.list_cmds_cur = None
+        for cmd in iter_cmds:
+            if C_FUNCTION == cmd.type or None == self.list_cmds_cur:
+                if C_FUNCTION == cmd.type:
+                    func_name = cmd.arg1
+                else:
+                    func_name = "(%s.vm)" % (file_name, )
+                self.list_cmds_cur = []
+                self.list_functions.append((func_name, file_name, self.list_cmds_cur))
+            self.cmd_cur = cmd
+            yield cmd
+        self.cmd_cur = None
+
+    def iter_asm(self, iter_asm):
+        for asm_cmds in iter_asm:
+            self.add_asm(asm_cmds)
+            yield asm_cmds
+
+    def add_asm(self, asm_cmds):
+        num_instructions = 0
+        for line in asm_cmds:
+            if "(" != line[0]:
+                num_instructions += 1
+        if None == self.cmd_cur:
+            self.num_other += num_instructions
+        else:
+            self.list_cmds_cur.append((self.cmd_cur, num_instructions))
+
+    def measure_function(self, func_name, file_name, list_cmds):
+        entry = {
+            "name": func_name,
+            "file": file_name,
+            "vm": len(list_cmds),
+            "rom": 0,
+            "call_rom": 0,
+            "compare_rom": 0,
+            "cycles_min": None,
+            "cycles_max": None,
+        }
+        dict_labels = {}
+        list_cycles = []  # the fewest and the most cycles every command may take
+        for pos, (cmd, num_instructions) in enumerate(list_cmds):
+            entry["rom"] += num_instructions
+            if cmd.type in (C_FUNCTION, C_CALL, C_RETURN):
+                entry["call_rom"] += num_instructions
+            if cmd.type in dict_compare_jumps:
+                entry["compare_rom"] += num_instructions
+                # either the true or the false branch of the comparison is skipped
+                list_cycles.append((num_instructions - 5, num_instructions - 3))
+            else:
+                list_cycles.append((num_instructions, num_instructions))
+            if C_LABEL == cmd.type:
+                dict_labels[cmd.arg1] = pos
+
+        # the jumps backwards close the loops, the other ones keep the commands in topological order
+        list_paths = [None] * len(list_cmds)  # (fewest, most) cycles from the entry to every command
+        list_exits = []
+        def reach(pos, cycles_min, cycles_max):
+            if pos >= len(list_cmds):
+                list_exits.append((cycles_min, cycles_max))
+                return
+            cycles_cmd = list_cycles[pos]
+            cycles_min += cycles_cmd[0]
+            cycles_max += cycles_cmd[1]
+            if None == list_paths[pos]:
+                list_paths[pos] = (cycles_min, cycles_max)
+            else:
+                list_paths[pos] = (min(list_paths[pos][0], cycles_min), max(list_paths[pos][1], cycles_max))
+        if 0 != len(list_cmds):
+            reach(0, 0, 0)
+        for pos, (cmd, num_instructions) in enumerate(list_cmds):
+            if None == list_paths[pos]:
+                continue
+            cycles_min, cycles_max = list_paths[pos]
+            if C_RETURN == cmd.type:
+                list_exits.append((cycles_min, cycles_max))
+                continue
+            if cmd.type in set_jumps:
+                pos_target = dict_labels.get(cmd.arg1)
+                if None != pos_target and pos_target > pos:
+                    reach(pos_target, cycles_min, cycles_max)
+            if C_GOTO != cmd.type:
+                reach(pos + 1, cycles_min, cycles_max)
+        if 0 != len(list_exits):
+            entry["cycles_min"] = min([cycles[0] for cycles in list_exits])
+            entry["cycles_max"] = max([cycles[1] for cycles in list_exits])
+        return entry
+
+    def get_report(self, sort_key):
+        list_entries = [self.measure_function(*func) for func in self.list_functions]
+        if "name" == sort_key:
+            list_entries.sort(key = lambda entry: entry["name"])
+        else:
+            # the largest first, the functions without an estimate last
+            list_entries.sort(key = lambda entry: entry["name"])
+            list_entries.sort(key = lambda entry: entry[sort_key], reverse = True)
+        return {
+            "functions": list_entries,
+            "total": {
+                "functions": len(list_entries),
+                "vm": sum([entry["vm"] for entry in list_entries]),
+                "rom": sum([entry["rom"] for entry in list_entries]) + self.num_other,
+                "other_rom": self.num_other,
+            },
+        }
+
+    def print_report(self, sort_key):
+        report = self.get_report(sort_key)
+        print "%-32s %-10s %6s %6s %6s %6s %15s" % ("function", "file", "vm", "rom", "call%", "cmp%", "cycles", )
+        for entry in report["functions"]:
+            if None == entry["cycles_min"]:
+                str_cycles = "-"
+            else:
+                str_cycles = "%d-%d" % (entry["cycles_min"], entry["cycles_max"], )
+            rom = max(entry["rom"], 1)
+            print "%-32s %-10s %6d %6d %5.1f%% %5.1f%% %15s" % (entry["name"], entry["file"], entry["vm"], entry["rom"],
+                100.0 * entry["call_rom"] / rom, 100.0 * entry["compare_rom"] / rom, str_cycles, )
+        total = report["total"]
+        print "%d functions, %d vm commands, %d instructions (%d outside of the functions)" % (
+            total["functions"], total["vm"], total["rom"], total["other_rom"], )
+
+    def write_json(self, json_path, sort_key):
+        fd_json = open_file(json_path, "w")
+        json.dump(self.get_report(sort_key), fd_json, indent = 1, sort_keys = True)
+        fd_json.write("\n")
+        fd_json.close()
 
 
 def validate_file_path(file_path):
@@ -718,7 +1960,8 @@ def path_pre_process(file_path):
         if True == validate_file_path(file_path):
             list_files.append(file_path)
     elif True == os.path.isdir(file_path):
-        files = os.listdir(file_path)
+        # sorted, so that the files are always merged in the same order
+        files = sorted(os.listdir(file_path))
         for f in files:
             child_file_path = file_path + "/" + f
             if True == validate_file_path(child_file_path):
@@ -728,63 +1971,341 @@ def path_pre_process(file_path):
 
     return list_files
 
-def create_asm_file(file_path, list_asm_code):
-    output_file_path = ""
-    if os.path.isfile(file_path):
-         output_file_path = file_path.split(".")[0] + ".asm"
-    elif os.path.isdir(file_path):
-        output_file_path = file_path + "/" + os.path.basename(file_path) + ".asm"
-
+def open_file(file_path, mode):
     try:
-        fd_ou_file = open(output_file_path, "w")
+        return open(file_path, mode)
     except IOError as e:
         print "I/O error: %s" % (str(e), )
         sys.exit(1)
     except Exception as e:
         print "Unexpected error: %s" % (str(e), )
         sys.exit(1)
-    finally:
-        for line in list_asm_code:
-            fd_ou_file.write(line + "\n")
-        fd_ou_file.close()
-        print "%s generated " % (output_file_path, )
+
+def translate_file(job):
+    '''
+    Translate a whole vm file, job is a (vm file, vm code, optimization level, file guard) tuple.
+    Return the asm code as a single string along with the statistics of the optimizer, or None if
+    the file could not be translated (the error has been printed already)
+    '''
+    vm_file, str_in, optimize, file_guard = job
+    list_asm = []
+    try:
+        parser = Parser(vm_file, file_guard = file_guard)
+        for asm_cmds in parser.translate(str_in.split("\n"), optimize):
+            list_asm += asm_cmds
+    except SystemExit:
+        return None
+    if 0 == len(list_asm):
+        return ("", parser.opt.get_stats())
+    return ("\n".join(list_asm) + "\n", parser.opt.get_stats())
+
+def iter_translate_files(list_jobs, num_jobs):
+    '''
+    Generator of the results of translate_file for every job, in the order of list_jobs. With more
+    than one job, the files are translated by a pool of num_jobs processes
+    '''
+    if num_jobs <= 1 or len(list_jobs) <= 1:
+        for job in list_jobs:
+            yield translate_file(job)
+        return
+    pool = multiprocessing.Pool(min(num_jobs, len(list_jobs)))
+    try:
+        for result in pool.imap(translate_file, list_jobs):
+            yield result
+    except BaseException:
+        # including the GeneratorExit raised when the caller gives up on the results
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+def read_vm_file(vm_file):
+    fd_in_file = open_file(vm_file, "r")
+    str_in = fd_in_file.read()
+    fd_in_file.close()
+    return str_in
+
+def find_returning_functions(list_cmds):
+    '''
+    Return the names of the functions in list_cmds which may return to their caller. A function
+    does not, when every return of it follows a goto or a call of a function which does not return
+    either, with no label jumped to in between
+    '''
+    dict_functions = {}
+    func_name = None
+    for cmd in list_cmds:
+        if C_FUNCTION == cmd.type:
+            func_name = cmd.arg1
+            dict_functions[func_name] = []
+        elif None != func_name:
+            dict_functions[func_name].append(cmd)
+    set_returning = set()
+    changed = True
+    while True == changed:
+        changed = False
+        for func_name, list_body in dict_functions.items():
+            if func_name in set_returning:
+                continue
+            set_targets = set([cmd.arg1 for cmd in list_body if cmd.type in set_jumps])
+            reachable = True
+            for cmd in list_body:
+                if C_LABEL == cmd.type:
+                    reachable = reachable or cmd.arg1 in set_targets
+                elif False == reachable:
+                    continue
+                elif C_GOTO == cmd.type:
+                    reachable = False
+                elif C_CALL == cmd.type and cmd.arg1 in dict_functions and cmd.arg1 not in set_returning:
+                    reachable = False
+                elif C_RETURN == cmd.type:
+                    set_returning.add(func_name)
+                    changed = True
+                    break
+    return set_returning
+
+def scan_sys_init(list_files):
+    '''
+    Look for Sys.init in the Sys.vm file of the program. Return None when there is no Sys.init,
+    otherwise whether it needs the frame pushed by a full call: it may return to its caller or it
+    reads its arguments. The code is optimized first, so that the loops on a constant are known
+    '''
+    for vm_file in list_files:
+        if "Sys" != os.path.basename(vm_file).split(".")[0]:
+            continue
+        parser = Parser(vm_file)
+        fd_in_file = open_file(vm_file, "r")
+        list_cmds = list(parser.opt.optimize(parser.iter_parsed(parser.iter_vm_lines(fd_in_file))))
+        fd_in_file.close()
+        list_names = [cmd.arg1 for cmd in list_cmds if C_FUNCTION == cmd.type]
+        if "Sys.init" not in list_names:
+            return None
+        if "Sys.init" in find_returning_functions(list_cmds):
+            return True
+        func_name = None
+        for cmd in list_cmds:
+            if C_FUNCTION == cmd.type:
+                func_name = cmd.arg1
+            elif "Sys.init" == func_name and (C_PUSH == cmd.type or C_POP == cmd.type) and SEG_ARGUMENT == cmd.arg1:
+                return True
+        return False
+    return None
+
+def select_bootstrap(mode, list_files):
+    '''
+    Return the bootstrap code of the program along with whether the code of its files has to be
+    guarded against Sys.init returning into it. auto picks the minimal bootstrap code when Sys.init
+    does not need a frame, auto and default pick no bootstrap code at all when there is no Sys.init
+    '''
+    needs_frame = scan_sys_init(list_files)
+    if "default" == mode:
+        if None == needs_frame:
+            mode = "none"
+        else:
+            mode = "full"
+    elif "auto" == mode:
+        if None == needs_frame:
+            mode = "none"
+        elif True == needs_frame:
+            mode = "full"
+        else:
+            mode = "minimal"
+    if "none" == mode:
+        return ([], False)
+    if None == needs_frame:
+        print "The %s bootstrap code calls Sys.init, which is not defined in Sys.vm" % (mode, )
+        sys.exit(1)
+    if "minimal" == mode:
+        if True == needs_frame:
+            print "Sys.init returns or reads its arguments, it needs the full bootstrap code"
+            sys.exit(1)
+        return (BOOTSTRAP_MINIMAL_CODE, False)
+    return (BOOTSTRAP_CODE, needs_frame)
+
+def run_benchmark(list_files, num_rounds, optimize, level = LEVEL_FULL):
+    '''
+    Time every stage of the translation over the given files and print its throughput,
+    the best of num_rounds rounds is reported. No output file is written.
+    '''
+    list_sources = [(vm_file, read_vm_file(vm_file)) for vm_file in list_files]
+    list_best = [None, None, None, None]  # parse, optimize, generate, streamed pipeline
+    num_cmds = 0
+    for i in range(num_rounds):
+        list_times = [0.0, 0.0, 0.0, 0.0]
+        num_cmds = 0
+        for vm_file, str_in in list_sources:
+            parser = Parser(vm_file, level = level)
+            parser.set_input_str(str_in)
+            time_start = time.time()
+            parser.parse_vm_code()
+            time_parsed = time.time()
+            if optimize >= 1:
+                parser.optimize_vm_code(optimize)
+            parser.cw.set_sp_batching(optimize >= 2)
+            time_optimized = time.time()
+            parser.generate_asm_code()
+            time_generated = time.time()
+            list_times[0] += time_parsed - time_start
+            list_times[1] += time_optimized - time_parsed
+            list_times[2] += time_generated - time_optimized
+            num_cmds += len(parser.list_in_vm)
+            # the same translation through the generators, as done when writing the .asm file
+            parser = Parser(vm_file, level = level)
+            time_start = time.time()
+            for asm_cmds in parser.translate(str_in.split("\n"), optimize):
+                pass
+            list_times[3] += time.time() - time_start
+        list_best = [t if None == best else min(t, best) for t, best in zip(list_times, list_best)]
+
+    print "%d files, %d vm commands, best of %d rounds" % (len(list_sources), num_cmds, num_rounds, )
+    for name, t in zip(["parse", "optimize", "generate", "pipeline"], list_best):
+        if t > 0:
+            print "%-9s %8.2f ms %10d commands/s" % (name, t * 1000, num_cmds / t, )
+
+def parse_arguments():
+    arg_parser = argparse.ArgumentParser(description = "Translate .vm file(s) into a Hack .asm file")
+    arg_parser.add_argument("path", help = "a .vm file or a folder of .vm files")
+    arg_parser.add_argument("-O", "--optimize", type = int, choices = [0, 1, 2], default = 1,
+                            help = "optimization level, 0 disables the vm level optimizer, 2 checks the stack depths "
+                                   "and updates SP once per basic block (default: 1)")
+    arg_parser.add_argument("-f", "--format", choices = ["asm", "hack", "bin"], default = "asm",
+                            help = "asm for Hack assembly, hack for Hack machine code, bin for machine code packed in 16-bit words (default: asm)")
+    arg_parser.add_argument("--keep-asm", action = "store_true",
+                            help = "also write the .asm file along with the machine code, for debugging")
+    arg_parser.add_argument("--bootstrap", choices = ["default", "auto", "full", "minimal", "none"], default = "default",
+                            help = "code run before Sys.init: full calls it, minimal only sets SP and jumps to it, auto picks the smallest "
+                                   "one which works (default: full when there is a Sys.init, none otherwise)")
+    arg_parser.add_argument("-j", "--jobs", type = int, default = 1,
+                            help = "number of processes translating the vm files, 0 for one per cpu (default: 1)")
+    arg_parser.add_argument("--cache", metavar = "DIR", default = None,
+                            help = "keep the asm code of every vm file in DIR and reuse it while the file is unchanged")
+    arg_parser.add_argument("--cache-max", type = int, metavar = "N", default = CACHE_MAX_ENTRIES,
+                            help = "number of files kept in the cache, the least recently used are evicted (default: %d)" % (CACHE_MAX_ENTRIES, ))
+    arg_parser.add_argument("--profile", action = "store_true",
+                            help = "count the instructions run in every function, its calls and the calls of every call site in RAM, "
+                                   "the counters are listed in a .map file")
+    arg_parser.add_argument("--profile-top", type = int, metavar = "ADDR", default = PROFILE_ADDR_TOP,
+                            help = "RAM address of the first profiler counter, the others go below it. The counters are kept in "
+                                   "RAM[%d..%d], above the keyboard, clear of the heap, the screen and the keyboard (default: %d)"
+                                   % (PROFILE_ADDR_MIN, PROFILE_ADDR_TOP, PROFILE_ADDR_TOP, ))
+    arg_parser.add_argument("--report", choices = ["text", "json"], default = None,
+                            help = "report the vm commands, instructions and cycles of every function, "
+                                   "printed as text or written to a .report.json file")
+    arg_parser.add_argument("--report-sort", choices = ["rom", "vm", "call_rom", "compare_rom", "cycles_max", "name"],
+                            default = "rom", help = "order of the functions in the report (default: rom)")
+    arg_parser.add_argument("--benchmark", type = int, metavar = "ROUNDS", default = 0,
+                            help = "time the translation stages over ROUNDS rounds instead of writing the .asm file")
+    return arg_parser.parse_args()
 
 def main():
     # arguments pre-processing
     if len(sys.argv) <= 1:
         print "Please supply the path to the .vm file(s)"
         sys.exit(1)
+    ARGS = parse_arguments()
 
     # if the system argument is a path to file, then translate this file to a single asm file
     # if the system argument is a foler, then translate all the vm files in that folder to a single asm file
-    LIST_OU_ASM = []
     IN_FILES = []
-    PATH_INPUT = os.path.normpath(sys.argv[1])
+    STATS = [0, 0, 0, 0]  # vm commands removed, jumps removed, jumps threaded, loops rotated
+    PATH_INPUT = os.path.normpath(ARGS.path)
 
     IN_FILES = path_pre_process(PATH_INPUT)
     if 0 == len(IN_FILES):
         sys.exit(1)
 
-    for vm_file in IN_FILES:
-        # Open the file
-        try:
-            fd_in_file = open(vm_file, "r")
-        except IOError as e:
-            print "I/O error: %s" % (str(e), )
-            sys.exit(1)
-        except Exception as e:
-            print "Unexpected error: %s" % (str(e), )
-            sys.exit(1)
+    if ARGS.benchmark > 0:
+        run_benchmark(IN_FILES, ARGS.benchmark, ARGS.optimize)
+        return
 
-        parser = Parser(vm_file)
-        parser.set_input_str(fd_in_file.read())
-        # Close the files
-        fd_in_file.close()
-        parser.parse_vm_code()
-        LIST_OU_ASM += parser.generate_asm_code()
+    # the output is written while the vm files are translated, into temporary files which
+    # replace the output files once every vm file has been translated successfully
+    OUTPUT = OutputWriter(PATH_INPUT, ARGS.format, ARGS.keep_asm)
+    NUM_JOBS = ARGS.jobs
+    if NUM_JOBS <= 0:
+        NUM_JOBS = multiprocessing.cpu_count()
+    NUM_JOBS = min(NUM_JOBS, len(IN_FILES))
+    BOOTSTRAP, FILE_GUARD = select_bootstrap(ARGS.bootstrap, IN_FILES)
+    CACHE = None
+    if None != ARGS.cache:
+        CACHE = TranslationCache(ARGS.cache, ARGS.cache_max, (ARGS.optimize, FILE_GUARD, ))
+    PROFILER = None
+    if True == ARGS.profile:
+        # the clock takes RAM[profile_top - 1..profile_top]
+        if ARGS.profile_top - 1 < PROFILE_ADDR_MIN or ARGS.profile_top > PROFILE_ADDR_TOP:
+            print "The profiler counters must be in RAM[%d..%d], out of the heap, the screen and the keyboard" % (PROFILE_ADDR_MIN, PROFILE_ADDR_TOP, )
+            sys.exit(1)
+        # the counters are numbered across the whole program, so the files are translated in turn
+        PROFILER = Profiler(ARGS.profile_top)
+        NUM_JOBS = 1
+        CACHE = None
+    REPORT = None
+    if None != ARGS.report:
+        # the asm code has to be followed command by command, so the files are translated in turn
+        REPORT = FootprintReport()
+        NUM_JOBS = 1
+        CACHE = None
+    ITER_RESULTS = None
+    try:
+        OUTPUT.write_asm(BOOTSTRAP)
+        if None != REPORT:
+            REPORT.add_asm(BOOTSTRAP)
+        if None == CACHE and 1 == NUM_JOBS:
+            for vm_file in IN_FILES:
+                parser = Parser(vm_file, PROFILER, file_guard = FILE_GUARD)
+                fd_in_file = open_file(vm_file, "r")
+                for asm_cmds in parser.translate(fd_in_file, ARGS.optimize, REPORT):
+                    OUTPUT.write_asm(asm_cmds)
+                fd_in_file.close()
+                STATS = [total + num for total, num in zip(STATS, parser.opt.get_stats())]
+        else:
+            # every file is translated on its own, the cached ones are not translated at all.
+            # The results come back in the order of IN_FILES and are written as soon as they are ready
+            list_sources = [(vm_file, read_vm_file(vm_file)) for vm_file in IN_FILES]
+            list_cached = [None] * len(list_sources)
+            list_keys = [None] * len(list_sources)
+            if None != CACHE:
+                for i, (vm_file, str_in) in enumerate(list_sources):
+                    list_keys[i] = CACHE.get_key(vm_file, str_in)
+                    list_cached[i] = CACHE.load(list_keys[i])
+            list_jobs = [(vm_file, str_in, ARGS.optimize, FILE_GUARD) for (vm_file, str_in), result in zip(list_sources, list_cached) if None == result]
+            ITER_RESULTS = iter_translate_files(list_jobs, NUM_JOBS)
+            for i in range(len(list_sources)):
+                result = list_cached[i]
+                if None == result:
+                    result = next(ITER_RESULTS)
+                    if None == result:
+                        sys.exit(1)
+                    if None != CACHE:
+                        CACHE.store(list_keys[i], result)
+                OUTPUT.write_text(result[0])
+                STATS = [total + num for total, num in zip(STATS, result[1])]
+    except SystemExit:
+        if None != ITER_RESULTS:
+            ITER_RESULTS.close()
+        OUTPUT.discard()
+        raise
+    try:
+        LIST_PATHS = OUTPUT.close()
+    except SystemExit:
+        OUTPUT.discard()
+        raise
 
-    LIST_OU_ASM = BOOTSTRAP_CODE + LIST_OU_ASM
-    create_asm_file(PATH_INPUT, LIST_OU_ASM)
+    if None != PROFILER:
+        PROFILER.write_map(OUTPUT.path_base + ".map")
+        LIST_PATHS.append(OUTPUT.path_base + ".map")
+    if "text" == ARGS.report:
+        REPORT.print_report(ARGS.report_sort)
+    elif "json" == ARGS.report:
+        REPORT.write_json(OUTPUT.path_base + ".report.json", ARGS.report_sort)
+        LIST_PATHS.append(OUTPUT.path_base + ".report.json")
+    if None != CACHE:
+        CACHE.evict()
+        print "%d of %d vm files taken from the cache" % (CACHE.num_hits, len(IN_FILES), )
+    if ARGS.optimize >= 1:
+        print "%d vm commands removed by the optimizer" % (STATS[0], )
+        print "%d jumps removed, %d jumps threaded and %d loops rotated" % (STATS[1], STATS[2], STATS[3], )
+    for path in LIST_PATHS:
+        print "%s generated " % (path, )
 
 if "__main__" == __name__:
     main()
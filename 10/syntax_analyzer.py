@@ -11,52 +11,75 @@
 import sys
 import os
 import re
-
-import xml.etree.ElementTree as ET
-import xml.dom.minidom as md
-
-class Token:
+import time
+import collections
+import argparse
+import multiprocessing
+import StringIO
+
+# token kinds. They are small ints so that a type check is an int comparison, the names are the
+# ones of the master regex groups and of the tags in the xml output
+KEYWORD, SYMBOL, INT_CONST, STRING_CONST, IDENTIFIER = range(5)
+token_type_names = ["keyword", "symbol", "integerConstant", "stringConstant", "identifier"]
+token_kinds = dict(zip(token_type_names, range(len(token_type_names))))
+
+class Token(object):
     '''
-    one single token
+    one single token: its kind, its text and the offset of its first character in the file.
+    Tokens are many and short lived, hence the slots
     '''
-    def __init__(self, token_type, raw_str, match_str):
-        self.token_type = token_type
-        self.raw_str = raw_str
-        self.match_str = match_str
-
-    def get_type(self):
-        return self.token_type
-
-    def get_raw_str(self):
-        return self.raw_str
-
-    def get_mth_str(self):
-        return self.match_str
-
-
-class Regex:
+    __slots__ = ("kind", "text", "offset")
+
+    def __init__(self, kind, text, offset):
+        self.kind = kind
+        self.text = text
+        self.offset = offset
+
+
+# All the lexical elements in a single regex, one named group per token type. The input is scanned
+# once from left to right, the first alternative matching at the current position wins, so please
+# note the order of the groups is important. The white spaces before a token are part of its match,
+# comments are matched as "skip" and anything else which is not a token as "error"
+lex_master_regex = re.compile(r'''
+    \s*(?:
+    (?P<skip>//[^\n]*|/\*.*?\*/)
+  | (?P<keyword>(?:class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)(?!\w))
+  | (?P<symbol>>=|<=|[{}()\[\].,;+\-*/&|<>=~])
+  | (?P<integerConstant>\d+)
+  | (?P<stringConstant>"[^"\n]*")
+  | (?P<identifier>[a-zA-Z_]\w*)
+  | (?P<error>\S)
+    )
+''', re.DOTALL | re.VERBOSE)
+
+# the token kind matched by each group of the master regex, by group number. None for the groups
+# which do not make a token
+lex_group_kinds = [None] * (lex_master_regex.groups + 1)
+for group_name, group_index in lex_master_regex.groupindex.items():
+    lex_group_kinds[group_index] = token_kinds.get(group_name)
+
+# The sets of the tokens which the grammar rules can start with, the parser only has to look them up
+# with the next token to know which rule comes next, it never tries a rule and goes back. A token is
+# looked up by its key, the text of a keyword or a symbol and the kind of any other token
+first_type = frozenset(["int", "char", "boolean", IDENTIFIER])
+first_return_type = first_type | frozenset(["void"])
+first_class_var_dec = frozenset(["static", "field"])
+first_subroutine_dec = frozenset(["constructor", "function", "method"])
+first_var_dec = frozenset(["var"])
+first_term = frozenset([INT_CONST, STRING_CONST, IDENTIFIER, "true", "false", "null", "this", "(", "-", "~"])
+keyword_constants = frozenset(["true", "false", "null", "this"])
+op_symbols = frozenset(["+", "-", "*", "/", "&", "|", "<", ">", "="])
+unary_op_symbols = frozenset(["-", "~"])
+
+# the comment delimiters and the quotes, where a comment or a string constant starts and ends. An
+# edit which changes their sequence may change the tokens far away from it
+lex_delimiters_regex = re.compile(r'/\*|\*/|//|"')
+
+def xml_escape(text):
     '''
-    specific regex expression object with a name
+    Escape the characters which are special in xml text, the same ones as minidom
     '''
-    def __init__(self, reg_name, pattern):
-        self.reg_name = reg_name
-        self.reg_obj  = re.compile(pattern)
-
-    def get_name(self):
-        return self.reg_name
-
-    def match(self, string):
-        return self.reg_obj.match(string)
-
-
-lex_ele_regex_list = [
-    # lexical elements, please note the order of items in this list is important.
-    Regex("keyword", "^(class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)[\W]+"),
-    Regex("symbol", "^(>=|<=|[{}()\[\]\.,;\+\-\*\/\&\|<>=~])"),
-    Regex("integerConstant", "^(\d+)"),
-    Regex("stringConstant", "^\"(.*?)\""),
-    Regex("identifier", "^([a-zA-Z|\d]\w*)")
-]
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
 
 class JackAnalyzer:
     '''
@@ -67,27 +90,29 @@ class JackAnalyzer:
         Remove all comments and white space from the input stream and breaks it
         into Jack lanaguage tokens, as specified by the Jack grammar
         '''
-        def __init__(self, file_path):
+        def __init__(self, file_path, file_content = None):
             self.in_file_path = file_path
             self.fd_in_file = None
-            # read the file and sanitize the content
-            try:
-                self.fd_in_file = open(file_path, "r")
-            except IOError as e:
-                print "I/O error: %s" % (str(e), )
-                sys.exit(1)
-            except Exception as e:
-                print "Unexpected error: %s" % (str(e), )
-                sys.exit(1)
-            self.file_content = self.fd_in_file.read()
-            self.file_content_list = self.input_sanitize(self.file_content)
-            self.tok_list = []
-
-            # the first step in the syntax analysis of a program is to group the characters into tokens
-            self.tokenize()
+            if None != file_content:
+                # the text is given, e.g. the buffer of an editor
+                self.file_content = file_content
+            else:
+                # read the file and sanitize the content
+                try:
+                    self.fd_in_file = open(file_path, "r")
+                except IOError as e:
+                    print "I/O error: %s" % (str(e), )
+                    sys.exit(1)
+                except Exception as e:
+                    print "Unexpected error: %s" % (str(e), )
+                    sys.exit(1)
+                self.file_content = self.fd_in_file.read()
+                self.fd_in_file.close()
 
-            # prepare for the next steps
-            self.tok_len = len(self.tok_list)
+            # the tokens are grouped from the characters on demand while the parser runs, only the
+            # tokens peeked at but not consumed yet are buffered
+            self.tok_stream = self.tokenize()
+            self.lookahead = collections.deque()
             self.token_index = -1
             self.current_token = None # there is no current token initially
 
@@ -98,27 +123,32 @@ class JackAnalyzer:
             This method should only be called if hasMoreTokens() is True. Initialy,
             there is no current token
             '''
-            if True == self.hasMoreTokens():
+            if None != self.peek():
                 self.token_index += 1
-                self.current_token = self.tok_list[self.token_index]
+                self.current_token = self.lookahead.popleft()
                 return self.current_token
             else:
                 return None
 
-        def rollBack(self):
-            if self.token_index > 0:
-                self.token_index -= 1
-                self.current_token = self.tok_list[self.token_index]
-                return self.current_token
-            else:
-                return None
+        def peek(self, k = 1):
+            '''
+            Returns the k-th token after the current one without consuming it,
+            None if the input ends before it
+            '''
+            lookahead = self.lookahead
+            while len(lookahead) < k:
+                token = next(self.tok_stream, None)
+                if None == token:
+                    return None
+                lookahead.append(token)
+            return lookahead[k - 1]
 
         def hasMoreTokens(self):
             '''
             API function
             Do we have more tokens in the input
             '''
-            if self.token_index < (self.tok_len - 1):
+            if None != self.peek():
                 return True
             else:
                 return False
@@ -128,7 +158,7 @@ class JackAnalyzer:
             API function
             Returns the type of the current token
             '''
-            return self.current_token.get_type()
+            return token_type_names[self.current_token.kind]
 
         def keyWord(self):
             '''
@@ -136,8 +166,8 @@ class JackAnalyzer:
             Returns the keyword which is the current token. Should be called only
             when tokenType() is KEYWORD
             '''
-            if "keyword" == self.tokenType():
-                return self.current_token.get_mth_str()
+            if KEYWORD == self.current_token.kind:
+                return self.current_token.text
             else:
                 return None
 
@@ -147,8 +177,8 @@ class JackAnalyzer:
             Returns the character which is the current token. Should be called only
             when tokenType() is SYMBOL
             '''
-            if "symbol" == self.tokenType():
-                return self.current_token.get_mth_str()
+            if SYMBOL == self.current_token.kind:
+                return self.current_token.text
             else:
                 return None
 
@@ -158,8 +188,8 @@ class JackAnalyzer:
             Returns the identifier which is the current token. Should be called only
             when tokenType() is IDENTIFIER
             '''
-            if "identifier" == self.tokenType():
-                return self.current_token.get_mth_str()
+            if IDENTIFIER == self.current_token.kind:
+                return self.current_token.text
             else:
                 return None
 
@@ -169,8 +199,8 @@ class JackAnalyzer:
             Returns the integer values of the current token. Should be called only
             when tokenType() is INT_CONST
            '''
-           if "integerConstant" == self.tokenType():
-               return int(self.current_token.get_mth_str())
+           if INT_CONST == self.current_token.kind:
+               return int(self.current_token.text)
            else:
                return None
 
@@ -180,90 +210,191 @@ class JackAnalyzer:
             Returns the integer values of the current token. Should be called only
             when tokenType() is INT_CONST
            '''
-           if "stringConstant" == self.tokenType():
-               return self.current_token.get_mth_str()
+           if STRING_CONST == self.current_token.kind:
+               return self.current_token.text
            else:
                return None
 
-        def input_sanitize(self, input_content):
-            '''
-            remove all the comments
-            '''
-            # get rid of the leading and trailing whitespaces
-            temp = input_content.strip()
-            # remove multi-lines comments. Note that the question mark(?) here indicates a non-greedy match mode
-            temp = re.sub("\/\*.*?\*\/", "", temp, flags = re.DOTALL)
-            # remove single line comments
-            temp = re.sub("\/\/.*", "", temp)
-            sanitized_content = temp.strip()
-            return [l.strip() for l in sanitized_content.split("\n") if "" != l.strip()]
-
-        def process_single_line(self, line_str):
-            '''
-            tokenize one line of code
-            '''
-            obj_mth = None
-            list_obj_tok = []
-            try_time = 0
-            while "" != line_str:
-                try_time += 1
-                obj_tok = None
-                token_type = ""
-                # try to match the first token against the line string from left to right
-                for regex in lex_ele_regex_list:
-                    obj_mth = regex.match(line_str)
-                    if None != obj_mth:
-                        obj_tok = Token(regex.get_name(), obj_mth.group(0), obj_mth.group(1))
-                        list_obj_tok.append(obj_tok)
-                        token_type = regex.get_name()
-                        break
+        def tokenKey(self):
+            '''
+            Returns the key of the current token in the sets of the first tokens of the grammar
+            rules, the text of a keyword or a symbol and the kind of any other token
+            '''
+            token = self.current_token
+            if KEYWORD == token.kind or SYMBOL == token.kind:
+                return token.text
+            else:
+                return token.kind
 
-                if None == obj_tok:
-                    print "No regex matched this line: %s at %d try" % (line_str, try_time, )
-                    sys.exit(1)
-                # remove the matched part from line string
-                if "keyword" == token_type:
-                    entire_match = obj_tok.get_mth_str()
+        def peekKey(self, k = 1):
+            '''
+            Returns the key of the k-th token after the current one, see tokenKey()
+            '''
+            token = self.peek(k)
+            if None == token:
+                return None
+            elif KEYWORD == token.kind or SYMBOL == token.kind:
+                return token.text
+            else:
+                return token.kind
+
+        def lineNumber(self, offset = None):
+            '''
+            Returns the line of the given offset in the file, the one of the current
+            token by default
+            '''
+            if None == offset:
+                offset = self.current_token.offset
+            return self.file_content.count("\n", 0, offset) + 1
+
+        def setSpan(self, start, end):
+            '''
+            Restart the tokenizer on the characters [start, end) of the file only, the offsets of
+            the tokens are still the ones in the whole file
+            '''
+            self.tok_stream = self.tokenize(start, end)
+            self.lookahead.clear()
+            self.current_token = None
+
+        def tokenize(self, start = 0, end = None):
+            '''
+            Generator scanning the file with the master regex and yielding its tokens one at a time.
+            The regex engine keeps the position in the file, so that the file is never sliced but for
+            the tokens themselves. Keywords, symbols and identifiers come back again and again, their
+            text is interned so that all their tokens share one string
+            '''
+            if None == end:
+                end = len(self.file_content)
+            for obj_mth in lex_master_regex.finditer(self.file_content, start, end):
+                group_index = obj_mth.lastindex
+                kind = lex_group_kinds[group_index]
+                raw_str = obj_mth.group(group_index)
+                offset = obj_mth.start(group_index)
+                if None == kind:
+                    if "error" == obj_mth.lastgroup:
+                        print "Invalid character in %s at line %d: %s" % (self.in_file_path, self.lineNumber(offset), raw_str, )
+                        sys.exit(1)
+                    continue    # a comment
+                if STRING_CONST == kind:
+                    yield Token(kind, raw_str[1:-1], offset)
+                elif INT_CONST == kind:
+                    yield Token(kind, raw_str, offset)
                 else:
-                    entire_match = obj_tok.get_raw_str()
-                len_mth = len(entire_match)
-                start  = line_str.find(entire_match)
-                line_str = line_str[start + len_mth:].strip()
+                    yield Token(kind, intern(raw_str), offset)
+
+
+    class XmlWriter:
+        '''
+        Writes the parse tree to a stream while it is being built, indented by two spaces per level.
+        An element is referred to by its nesting level, the level of its children, and it is closed
+        as soon as something is written to one of its ancestors. Only the tags of the open elements
+        are kept
+        '''
+        def __init__(self, stream):
+            self.stream = stream
+            self.open_tags = []
+
+        def closeTo(self, level):
+            '''
+            Close the open elements deeper than level
+            '''
+            open_tags = self.open_tags
+            while len(open_tags) > level:
+                tag = open_tags.pop()
+                self.stream.write("%s</%s>\n" % ("  " * len(open_tags), tag, ))
 
-            return list_obj_tok
+        def openElement(self, parent, tag):
+            '''
+            Open a non-terminal element in parent and return its level
+            '''
+            self.closeTo(parent)
+            self.stream.write("%s<%s>\n" % ("  " * parent, tag, ))
+            self.open_tags.append(tag)
+            return parent + 1
 
-        def tokenize(self):
-            for line in self.file_content_list:
-                tok_list_single_line = self.process_single_line(line)
-                self.tok_list += tok_list_single_line
+        def writeTerminal(self, parent, tag, value):
+            '''
+            Write a terminal element holding value in parent. The characters which are special
+            in xml are escaped
+            '''
+            self.closeTo(parent)
+            self.stream.write("%s<%s> %s </%s>\n" % ("  " * parent, tag, xml_escape(str(value)), tag, ))
+
+        def close(self):
+            self.closeTo(0)
 
 
     class CompilationEngine:
         '''
         Gets input from a JackTokenizer and emits parsed structure into an output file / stream.
         The output is generated by a series of compilexxx() routines, one for every syntactic element
-        xxx of the Jack grammar.
+        xxx of the Jack grammar. Where the grammar has a choice, the next token is looked up in the
+        first sets of the alternatives, a compilexxx() routine is only called once its rule is known
+        to come next
         '''
         def __init__(self, jt):
             self.tokenizer = jt
-            self.root = None    # the root element of the parse tree
+            self.root = None    # the level of the children of the root element of the parse tree
+            self.writer = None
+            # the statement rules by the keyword they start with
+            self.statement_rules = {
+                "let"    : self.CompileLet,
+                "if"     : self.CompileIf,
+                "while"  : self.CompileWhile,
+                "do"     : self.CompileDo,
+                "return" : self.CompileReturn,
+            }
 
         def CompileNow(self):
-            # the first program structure in a file is always class
-            # and this function will recursively call other compile functions
-            self.CompileClass()
-            self.CreateOutputFile()
+            # the parse tree is written to the output file while it is built
+            fd_ou_file, output_file_path = self.CreateOutputFile("fromSyntaxAnalyzer.xml")
+            self.writer = JackAnalyzer.XmlWriter(fd_ou_file)
+            try:
+                # the first program structure in a file is always class
+                # and this function will recursively call other compile functions
+                self.CompileClass()
+            except SystemExit:
+                # the tokenizer gave up in the middle of the file, do not leave half of the tree
+                fd_ou_file.close()
+                os.remove(output_file_path)
+                raise
+            self.writer.close()
+            fd_ou_file.close()
+            print "%s generated " % (output_file_path, )
+
+        def TokenizeNow(self):
+            '''
+            Write the tokens of the file to the xxxT.xml file straight from the tokenizer, one
+            element per token. Nothing is parsed
+            '''
+            fd_ou_file, output_file_path = self.CreateOutputFile("fromSyntaxAnalyzerT.xml")
+            write = fd_ou_file.write
+            try:
+                write("<tokens>\n")
+                for token in self.tokenizer.tokenize():
+                    kind = token.kind
+                    text = token.text
+                    if SYMBOL == kind or STRING_CONST == kind:
+                        text = xml_escape(text)
+                    elif INT_CONST == kind:
+                        text = str(int(text))   # as intVal() does in the parse tree
+                    tag = token_type_names[kind]
+                    write("<%s> %s </%s>\n" % (tag, text, tag, ))
+                write("</tokens>\n")
+            except SystemExit:
+                # the tokenizer gave up in the middle of the file, do not leave half of the tokens
+                fd_ou_file.close()
+                os.remove(output_file_path)
+                raise
+            fd_ou_file.close()
+            print "%s generated " % (output_file_path, )
 
-        def CreateOutputFile(self):
+        def CreateOutputFile(self, suffix):
             file_path = self.tokenizer.in_file_path
 
-            # you don't need to worry about special characters like: <>&", they will be dealt by this function below
-            xml_content = ET.tostring(self.root)
-            # add indents to the output
-            pretty_xml_content =  md.parseString(xml_content).toprettyxml(indent = "  ")
             output_file_path = ""
             if os.path.isfile(file_path):
-                output_file_path = file_path.split(".")[0] + "fromSyntaxAnalyzer.xml"
+                output_file_path = file_path.split(".")[0] + suffix
             else:
                 print "Error: cannot create output file for %s" % (file_path, )
 
@@ -275,14 +406,7 @@ class JackAnalyzer:
             except Exception as e:
                 print "Unexpected error: %s" % (str(e), )
                 sys.exit(1)
-            finally:
-                for line in pretty_xml_content.splitlines():
-                    if "<pad/>" in line:
-                        continue
-                    else:
-                        fd_ou_file.write(line + "\n")
-                fd_ou_file.close()
-                print "%s generated " % (output_file_path, )
+            return fd_ou_file, output_file_path
 
         def CompileClass(self):
             '''
@@ -292,9 +416,8 @@ class JackAnalyzer:
                 self.tokenizer.advance()
 
             if "class" == self.tokenizer.keyWord():
-                self.root = ET.Element("class")
-                item = ET.SubElement(self.root, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
+                self.root = self.writer.openElement(0, "class")
+                self.writer.writeTerminal(self.root, self.tokenizer.tokenType(), self.tokenizer.keyWord())
             else:
                 print "Failed to compile class"
                 return False
@@ -305,8 +428,7 @@ class JackAnalyzer:
 
             # className
             if self.tokenizer.identifier():
-                item = ET.SubElement(self.root, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                self.writer.writeTerminal(self.root, self.tokenizer.tokenType(), self.tokenizer.identifier())
             else:
                 print "Failed to match the identifier in %s" % (sys._getframe().f_code.co_name, )
 
@@ -316,19 +438,20 @@ class JackAnalyzer:
 
             # symbol '{'
             if '{' == self.tokenizer.symbol():
-                item = ET.SubElement(self.root, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(self.root, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # classVarDec*
-            while self.CompileClassVarDec(self.root):
-                pass
+            while self.tokenizer.peekKey() in first_class_var_dec:
+                if False == self.CompileClassVarDec(self.root):
+                    break
 
             # subroutineDec*
-            while self.CompileSubroutineDec(self.root):
-                pass
+            while self.tokenizer.peekKey() in first_subroutine_dec:
+                if False == self.CompileSubroutineDec(self.root):
+                    break
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
@@ -336,11 +459,10 @@ class JackAnalyzer:
 
             # symbol '}'
             if '}' == self.tokenizer.symbol():
-                item = ET.SubElement(self.root, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(self.root, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
-                print "Failed to match the '}' in %s, we got a %s" % (sys._getframe().f_code.co_name, self.tokenizer.keyWord(), )
+                print "Failed to match the '}' in %s, we got a %s at line %d" % (sys._getframe().f_code.co_name, self.tokenizer.keyWord(), self.tokenizer.lineNumber(), )
                 return False
 
             return True
@@ -352,35 +474,18 @@ class JackAnalyzer:
             Arg:
                 parent: the parent node which the tree nodes created in this function are attached to
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # (static | field)
-            if "static" == self.tokenizer.keyWord() or "field" == self.tokenizer.keyWord():
-                # since we know this is a classVarDec program structure
-                parent = ET.SubElement(parent, "classVarDec")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # (static | field), the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "classVarDec")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # type
-            if "int" == self.tokenizer.keyWord() or \
-               "char" == self.tokenizer.keyWord() or \
-               "boolean" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            elif self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier())
+            if self.tokenizer.tokenKey() in first_type:
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.current_token.text)
 
             else:
                 print "Failed to match the 'type' in %s" % (sys._getframe().f_code.co_name, )
@@ -392,8 +497,7 @@ class JackAnalyzer:
 
             # varName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
@@ -405,8 +509,7 @@ class JackAnalyzer:
 
             # (, varName)*
             while "," == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
 
                 if None == self.tokenizer.advance():
@@ -414,8 +517,7 @@ class JackAnalyzer:
                     return False
 
                 if self.tokenizer.identifier():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
                 else:
                     print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
@@ -426,8 +528,7 @@ class JackAnalyzer:
                     return False
 
             if ";" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                 return True
             else:
@@ -438,41 +539,18 @@ class JackAnalyzer:
             '''
             Compile a complete method, function or constructor
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # (constructor | function | method)
-            if "constructor" == self.tokenizer.keyWord() or \
-               "function" == self.tokenizer.keyWord() or \
-               "method" == self.tokenizer.keyWord():
-                # since we know this is a subroutineDec program structure
-                parent = ET.SubElement(parent, "subroutineDec")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # (constructor | function | method), the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "subroutineDec")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # void or type
-            if "void" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            elif "int" == self.tokenizer.keyWord() or \
-               "char" == self.tokenizer.keyWord() or \
-               "boolean" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            elif self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier())
+            if self.tokenizer.tokenKey() in first_return_type:
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.current_token.text)
 
             else:
                 print "Failed to match the '(void | type)' in %s" % (sys._getframe().f_code.co_name, )
@@ -484,8 +562,7 @@ class JackAnalyzer:
 
             # subroutineName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier())
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
             else:
                 print "Failed to match the 'subroutineName' in %s" % (sys._getframe().f_code.co_name, )
@@ -496,8 +573,7 @@ class JackAnalyzer:
                 return False
 
             if "(" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol())
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
@@ -512,8 +588,7 @@ class JackAnalyzer:
                 return False
 
             if ")" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol())
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failedf to match the ')' in %s" % (sys._getframe().f_code.co_name, )
@@ -529,26 +604,14 @@ class JackAnalyzer:
             '''
             Compile a (possibly empty) parameter list, not including the enclosing"()".
             '''
-            parent = ET.SubElement(parent, "parameterList")
-            ET.SubElement(parent, "pad")
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
+            parent = self.writer.openElement(parent, "parameterList")
             # type
-            if "int" == self.tokenizer.keyWord() or \
-               "char" == self.tokenizer.keyWord() or \
-               "boolean" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            elif self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier())
+            if self.tokenizer.peekKey() in first_type:
+                self.tokenizer.advance()
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.current_token.text)
 
             else:
                 # the whole parameterList structure is optional
-                self.tokenizer.rollBack()
                 return True
 
             if None == self.tokenizer.advance():
@@ -557,21 +620,16 @@ class JackAnalyzer:
 
             # varName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
             # (, type varName)*
-            while "," == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+            while "," == self.tokenizer.peekKey():
+                self.tokenizer.advance()
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
 
                 if None == self.tokenizer.advance():
@@ -579,15 +637,8 @@ class JackAnalyzer:
                     return False
 
                 # type
-                if "int" == self.tokenizer.keyWord() or \
-                   "char" == self.tokenizer.keyWord() or \
-                   "boolean" == self.tokenizer.keyWord():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.keyWord(), )
-
-                elif self.tokenizer.identifier():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier())
+                if self.tokenizer.tokenKey() in first_type:
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.current_token.text)
 
                 else:
                     print "Failed to match 'type' in %s" % (sys._getframe().f_code.co_name, )
@@ -599,43 +650,35 @@ class JackAnalyzer:
 
                 # varName
                 if self.tokenizer.identifier():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
                 else:
                     print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
                     return False
 
-                if None == self.tokenizer.advance():
-                    print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                    return False
-
-            self.tokenizer.rollBack()
             return True
 
         def CompileSubroutineBody(self, parent):
             '''
             Compile the body of a subroutine in a class
             '''
-            parent = ET.SubElement(parent, "subroutineBody")
-            ET.SubElement(parent, "pad")
+            parent = self.writer.openElement(parent, "subroutineBody")
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # '{'
             if "{" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            while self.CompileVarDec(parent):
-                pass
+            while self.tokenizer.peekKey() in first_var_dec:
+                if False == self.CompileVarDec(parent):
+                    break
 
-            while self.CompileStatements(parent):
-                pass
+            self.CompileStatements(parent)
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
@@ -643,8 +686,7 @@ class JackAnalyzer:
 
             # '}'
             if "}" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the '}' in %s" % (sys._getframe().f_code.co_name, )
@@ -656,35 +698,18 @@ class JackAnalyzer:
             '''
             Compile a var declaration
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # 'var'
-            if "var" == self.tokenizer.keyWord():
-                # since we know this is a varDec program structure
-                parent = ET.SubElement(parent, "varDec")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # 'var', the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "varDec")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # type
-            if "int" == self.tokenizer.keyWord() or \
-               "char" == self.tokenizer.keyWord() or \
-               "boolean" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            elif self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier())
+            if self.tokenizer.tokenKey() in first_type:
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.current_token.text)
 
             else:
                 print "Failed to match the 'type' in %s" % (sys._getframe().f_code.co_name, )
@@ -696,8 +721,7 @@ class JackAnalyzer:
 
             # varName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
@@ -709,8 +733,7 @@ class JackAnalyzer:
 
             # (, varName)*
             while "," == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
 
                 if None == self.tokenizer.advance():
@@ -719,8 +742,7 @@ class JackAnalyzer:
 
                 # varName
                 if self.tokenizer.identifier():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
                 else:
                     print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
@@ -731,8 +753,7 @@ class JackAnalyzer:
                     return False
 
             if ";" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
@@ -744,33 +765,23 @@ class JackAnalyzer:
             '''
             Compile a sequence of statements, not inclduing the enclosing "{}".
             '''
-            parent = ET.SubElement(parent, "statements")
-            ET.SubElement(parent, "pad")
-            while self.CompileDo(parent) or \
-                  self.CompileLet(parent) or \
-                  self.CompileWhile(parent) or \
-                  self.CompileReturn(parent) or \
-                  self.CompileIf(parent):
-                pass
+            parent = self.writer.openElement(parent, "statements")
+            statement_rules = self.statement_rules
+            key = self.tokenizer.peekKey()
+            while key in statement_rules:
+                if False == statement_rules[key](parent):
+                    break
+                key = self.tokenizer.peekKey()
             return False
 
         def CompileDo(self, parent):
             '''
             Compile a do statement
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # 'do'
-            if "do" == self.tokenizer.keyWord():
-                # since we know this is a doStatement program structure
-                parent = ET.SubElement(parent, "doStatement")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # 'do', the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "doStatement")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             # subroutineCall
             if False == self.CompileSubroutineCall(parent):
@@ -782,8 +793,7 @@ class JackAnalyzer:
                 return False
 
             if ";" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -794,17 +804,12 @@ class JackAnalyzer:
             '''
             Note that subroutineCall is not a non-terminal structure
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
             # (subroutineName | className)
-            if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+            if IDENTIFIER == self.tokenizer.peekKey():
+                self.tokenizer.advance()
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
             else:
                 print "Failed to match the 'subroutineName' in %s" % (sys._getframe().f_code.co_name, )
-                self.tokenizer.rollBack()
                 return False
 
             if None == self.tokenizer.advance():
@@ -812,8 +817,7 @@ class JackAnalyzer:
                 return False
 
             if "." == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
 
                 if None == self.tokenizer.advance():
@@ -822,8 +826,7 @@ class JackAnalyzer:
 
                 # subroutineName
                 if self.tokenizer.identifier():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
                 else:
                     print "Failed to match 'subroutineName' in %s" % (sys._getframe().f_code.co_name, )
@@ -834,8 +837,7 @@ class JackAnalyzer:
                     return False
 
             if "(" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -847,8 +849,7 @@ class JackAnalyzer:
                 return False
 
             if ")" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the ')' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -859,20 +860,10 @@ class JackAnalyzer:
             '''
             Compile a let statement
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # 'let'
-            if "let" == self.tokenizer.keyWord():
-                # since we know this is a letStatement program structure
-                parent = ET.SubElement(parent, "letStatement")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # 'let', the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "letStatement")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
@@ -880,8 +871,7 @@ class JackAnalyzer:
 
             # varName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
@@ -893,8 +883,7 @@ class JackAnalyzer:
 
             # ([expression])?
             if "[" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                 if False == self.CompileExpression(parent):
                     print "Failed to match the [expression] in %s" % (sys._getframe().f_code.co_name, )
@@ -905,8 +894,7 @@ class JackAnalyzer:
                     return False
 
                 if "]" == self.tokenizer.symbol():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.symbol(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
                 else:
                     print "Failed to match the ']' in %s" % (sys._getframe().f_code.co_name, )
                     return False
@@ -916,8 +904,7 @@ class JackAnalyzer:
                     return False
 
             if "=" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '=' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -931,8 +918,7 @@ class JackAnalyzer:
                 return False
 
             if ";" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -943,28 +929,17 @@ class JackAnalyzer:
             '''
             Compile a while statement
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # 'while'
-            if "while" == self.tokenizer.keyWord():
-                # since we know this is a whileStatement program structure
-                parent = ET.SubElement(parent, "whileStatement")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # 'while', the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "whileStatement")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             if "(" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
@@ -978,8 +953,7 @@ class JackAnalyzer:
                 return False
 
             if ")" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the ')' in %s" % (sys._getframe().f_code.co_name, )
@@ -990,23 +964,20 @@ class JackAnalyzer:
                 return False
 
             if "{" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            while self.CompileStatements(parent):
-                pass
+            self.CompileStatements(parent)
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             if "}" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
@@ -1018,19 +989,10 @@ class JackAnalyzer:
             '''
             Compile a return statement
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # 'return'
-            if "return" == self.tokenizer.keyWord():
-                # since we know this is a returnStatement program structure
-                parent = ET.SubElement(parent, "returnStatement")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # 'return', the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "returnStatement")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             self.CompileExpression(parent)
 
@@ -1038,8 +1000,7 @@ class JackAnalyzer:
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
             if ";" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -1050,27 +1011,17 @@ class JackAnalyzer:
             '''
             Compilea if statement, possibly witha trailing else clause
             '''
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            # 'if'
-            if "if" == self.tokenizer.keyWord():
-                # since we know this is a ifStatement program structure
-                parent = ET.SubElement(parent, "ifStatement")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-            else:
-                self.tokenizer.rollBack()
-                return False
+            # 'if', the caller knows it comes next
+            self.tokenizer.advance()
+            parent = self.writer.openElement(parent, "ifStatement")
+            self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             if "(" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -1083,8 +1034,7 @@ class JackAnalyzer:
                 return False
 
             if ")" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
             else:
                 print "Failed to match the ')' in %s" % (sys._getframe().f_code.co_name, )
@@ -1095,33 +1045,26 @@ class JackAnalyzer:
                 return False
 
             if "{" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            while self.CompileStatements(parent):
-                pass
+            self.CompileStatements(parent)
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             if "}" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
             else:
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-            if "else" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
+            if "else" == self.tokenizer.peekKey():
+                self.tokenizer.advance()
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
 
 
                 if None == self.tokenizer.advance():
@@ -1129,28 +1072,23 @@ class JackAnalyzer:
                     return False
 
                 if "{" == self.tokenizer.symbol():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.symbol(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                 else:
                     print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                     return False
 
-                while self.CompileStatements(parent):
-                    pass
+                self.CompileStatements(parent)
 
                 if None == self.tokenizer.advance():
                     print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                     return False
 
                 if "}" == self.tokenizer.symbol():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.symbol(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
                 else:
                     print "Failed to match the '}' in %s" % (sys._getframe().f_code.co_name, )
                     return False
-            else:
-                self.tokenizer.rollBack()
 
             return True
 
@@ -1159,51 +1097,25 @@ class JackAnalyzer:
             Compile an expression
             '''
             # take a peek if the next token is a term
-            if None == self.tokenizer.advance():
+            if None == self.tokenizer.peek():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if self.tokenizer.identifier() or \
-               "integerConstant" == self.tokenizer.tokenType() or \
-               "stringConstant" == self.tokenizer.tokenType() or \
-               "-" == self.tokenizer.symbol() or "~" == self.tokenizer.symbol() or \
-               "(" == self.tokenizer.symbol() or \
-               "true" == self.tokenizer.keyWord() or \
-               "false" == self.tokenizer.keyWord() or \
-               "null" == self.tokenizer.keyWord() or \
-               "this" == self.tokenizer.keyWord():
-                parent = ET.SubElement(parent, "expression")
-
-            self.tokenizer.rollBack()
-
-            if False == self.CompileTerm(parent):
+            if self.tokenizer.peekKey() not in first_term:
                 return False
+            parent = self.writer.openElement(parent, "expression")
 
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
+            if False == self.CompileTerm(parent):
                 return False
 
-            while ('+' == self.tokenizer.symbol() or \
-                   '-' == self.tokenizer.symbol() or \
-                   '*' == self.tokenizer.symbol() or \
-                   '/' == self.tokenizer.symbol() or \
-                   '&' == self.tokenizer.symbol() or \
-                   '|' == self.tokenizer.symbol() or \
-                   '<' == self.tokenizer.symbol() or \
-                   '>' == self.tokenizer.symbol() or \
-                   '=' == self.tokenizer.symbol()):
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+            while self.tokenizer.peekKey() in op_symbols:
+                self.tokenizer.advance()
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                 if False == self.CompileTerm(parent):
                     print "Failed to match 'term' in %s" % (sys._getframe().f_code.co_name, )
                     return False
 
-                if None == self.tokenizer.advance():
-                    print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                    return False
-
-            self.tokenizer.rollBack()
             return True
 
         def CompileTerm(self, parent):
@@ -1211,51 +1123,41 @@ class JackAnalyzer:
             Compile a term. This routine is faced with a slight diffculty when trying
             to decide between some of the alternative parsing rules.
             '''
-            if None == self.tokenizer.advance():
+            if None == self.tokenizer.peek():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if "integerConstant" == self.tokenizer.tokenType():  # integerConstant
-                parent = ET.SubElement(parent, "term")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.intVal(), )
-            elif "stringConstant" == self.tokenizer.tokenType():  # stringConstant
-                parent = ET.SubElement(parent, "term")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.stringVal(), )
-            elif "true" == self.tokenizer.keyWord() or \
-                 "false" == self.tokenizer.keyWord() or \
-                 "null" == self.tokenizer.keyWord() or \
-                 "this" == self.tokenizer.keyWord():  # keyWord constant
-                parent = ET.SubElement(parent, "term")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-            elif self.tokenizer.identifier():  # a variable name or an array element or a subroutineCall
-                parent = ET.SubElement(parent, "term")
-                # check if it is subroutineCall
-                if None == self.tokenizer.advance():
-                    print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                    return False
-                if "(" == self.tokenizer.symbol() or \
-                   "." == self.tokenizer.symbol():
+            key = self.tokenizer.peekKey()
+            if INT_CONST == key:  # integerConstant
+                self.tokenizer.advance()
+                parent = self.writer.openElement(parent, "term")
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.intVal())
+            elif STRING_CONST == key:  # stringConstant
+                self.tokenizer.advance()
+                parent = self.writer.openElement(parent, "term")
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.stringVal())
+            elif key in keyword_constants:  # keyWord constant
+                self.tokenizer.advance()
+                parent = self.writer.openElement(parent, "term")
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.keyWord())
+            elif IDENTIFIER == key:  # a variable name or an array element or a subroutineCall
+                parent = self.writer.openElement(parent, "term")
+                # check if it is subroutineCall, the token after the identifier decides
+                key = self.tokenizer.peekKey(2)
+                if "(" == key or "." == key:
                     # now, it must be a subroutineCall structure
-                    self.tokenizer.rollBack()
-                    self.tokenizer.rollBack()
-
                     if False == self.CompileSubroutineCall(parent):
                         print "Failed to match the 'subroutineCall' in %s" % (sys._getframe().f_code.co_name, )
                         return False
-                elif "[" == self.tokenizer.symbol():
-                    self.tokenizer.rollBack()
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier(), )
+                elif "[" == key:
+                    self.tokenizer.advance()
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
                     if None == self.tokenizer.advance():
                         print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                         return False
 
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.symbol(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                     if False == self.CompileExpression(parent):
                         print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
@@ -1266,20 +1168,18 @@ class JackAnalyzer:
                         return False
 
                     if "]" == self.tokenizer.symbol():
-                        item = ET.SubElement(parent, self.tokenizer.tokenType())
-                        item.text = " %s " % (self.tokenizer.symbol(), )
+                        self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
                     else:
                         print "Failed to match the ']' in %s" % (sys._getframe().f_code.co_name, )
                         return False
                 else:
-                    self.tokenizer.rollBack()
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.identifier(), )
+                    self.tokenizer.advance()
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.identifier())
 
-            elif "(" == self.tokenizer.symbol():  # an expression in parentheses
-                parent = ET.SubElement(parent, "term")
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+            elif "(" == key:  # an expression in parentheses
+                self.tokenizer.advance()
+                parent = self.writer.openElement(parent, "term")
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                 if False == self.CompileExpression(parent):
                     print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
@@ -1289,22 +1189,20 @@ class JackAnalyzer:
                     return False
 
                 if ")" == self.tokenizer.symbol():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.symbol(), )
+                    self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
                 else:
                     print "Failed to match the ) in %s" % (sys._getframe().f_code.co_name, )
                     return False
 
-            elif "-" == self.tokenizer.symbol() or "~" == self.tokenizer.symbol():  # an expression prefixed by unary operators
-                parent = ET.SubElement(parent, "term")
+            elif key in unary_op_symbols:  # an expression prefixed by unary operators
+                self.tokenizer.advance()
+                parent = self.writer.openElement(parent, "term")
 
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
                 if False == self.CompileTerm(parent):
                     print "Failed to match 'term' in %s" % (sys._getframe().f_code.co_name, )
                     return False
             else:
-                self.tokenizer.rollBack()
                 return False
 
             return True
@@ -1313,58 +1211,273 @@ class JackAnalyzer:
             '''
             Compile a (possibly empty) comma-separated list of expressions
             '''
-            parent = ET.SubElement(parent, "expressionList")
-            ET.SubElement(parent, "pad")
+            parent = self.writer.openElement(parent, "expressionList")
             if False == self.CompileExpression(parent):
                 return False
 
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
             # (, expression)*
-            while "," == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
+            while "," == self.tokenizer.peekKey():
+                self.tokenizer.advance()
+                self.writer.writeTerminal(parent, self.tokenizer.tokenType(), self.tokenizer.symbol())
 
                 if False == self.CompileExpression(parent):
                     print "Failed to match the 'expression' in %s" % (sys._getframe().f_code.co_name, )
                     return False
 
-                if None == self.tokenizer.advance():
-                    print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                    return False
+            return True
+
+
+    class IncrementalEngine(CompilationEngine):
+        '''
+        CompilationEngine which keeps apart the xml and the messages of every subroutine of the
+        class, together with the span of text it was parsed from. A subroutine which cannot be
+        parsed keeps its partial xml and its messages, its span runs up to the next subroutine
+        '''
+        def __init__(self, jt, stream):
+            JackAnalyzer.CompilationEngine.__init__(self, jt)
+            self.stream = stream
+            self.writer = JackAnalyzer.XmlWriter(stream)
+            self.segments = []
+            self.class_messages = sys.stdout   # where the messages outside the subroutines go
+            self.header_messages_end = None
+            self.header_xml_end = None
 
-            self.tokenizer.rollBack()
+        def CompileSubroutineDec(self, parent):
+            # the span starts right after the token before the subroutine, so that the lines
+            # leading to it belong to it
+            token = self.tokenizer.current_token
+            start = token.offset + len(token.text)
+            self.writer.closeTo(parent)
+            xml_start = self.stream.tell()
+            if None == self.header_xml_end:
+                self.header_xml_end = xml_start
+                self.header_messages_end = self.class_messages.tell()
+
+            sys.stdout = messages = StringIO.StringIO()
+            tokenizer_exit = None
+            try:
+                if False == JackAnalyzer.CompilationEngine.CompileSubroutineDec(self, parent):
+                    # the tokens up to the next subroutine, or up to the closing brace of the class,
+                    # are the rest of the broken one, its messages are kept with it
+                    tokenizer = self.tokenizer
+                    while tokenizer.peekKey() not in first_subroutine_dec and None != tokenizer.peek(2):
+                        tokenizer.advance()
+            except SystemExit as e:
+                # the message of the tokenizer belongs to this subroutine too
+                tokenizer_exit = e
+            finally:
+                sys.stdout = self.class_messages
+            self.writer.closeTo(parent)
+
+            token = self.tokenizer.current_token
+            end = token.offset + len(token.text)
+            self.segments.append(JackAnalyzer.IncrementalAnalyzer.Segment(start, end,
+                                 self.stream.getvalue()[xml_start:], messages.getvalue()))
+            self.stream.truncate(xml_start)
+            if None != tokenizer_exit:
+                raise tokenizer_exit
+            # the class goes on with the next subroutine even after a broken one
             return True
 
+    class IncrementalAnalyzer:
+        '''
+        Keeps the parse of one jack file between its edits, for an editor which analyzes the file
+        on every keystroke. The file is analyzed as a whole once, then an edit inside a single
+        subroutine only re-tokenizes and re-parses the span of text of that subroutine, which keeps
+        its messages and its partial xml when it cannot be parsed. Every subroutine is analyzed on
+        its own, so a broken one does not hide the messages of the others. An edit outside of the
+        subroutines, over several of them, changing the comment delimiters or the quotes, or one
+        after which the span does not hold one subroutine any more, analyzes the whole file again
+        '''
+        class Segment(object):
+            '''
+            one subroutine: its span [start, end) in the text, its xml and the messages of its parse
+            '''
+            __slots__ = ("start", "end", "xml", "messages")
+
+            def __init__(self, start, end, xml, messages):
+                self.start = start
+                self.end = end
+                self.xml = xml
+                self.messages = messages
+
+        def __init__(self, file_path, text = None):
+            self.file_path = file_path
+            if None == text:
+                text = JackAnalyzer.JackTokenizer(file_path).file_content
+            self.text = text
+            self.analyzeAll()
+
+        def analyzeAll(self):
+            '''
+            Analyze the whole text and split its xml and its messages into the class part and
+            the subroutines
+            '''
+            stream = StringIO.StringIO()
+            stdout = sys.stdout
+            sys.stdout = messages = StringIO.StringIO()
+            succeeded = False
+            try:
+                engine = JackAnalyzer.IncrementalEngine(JackAnalyzer.JackTokenizer(self.file_path, self.text), stream)
+                try:
+                    if True == engine.tokenizer.hasMoreTokens():
+                        succeeded = engine.CompileClass()
+                except SystemExit:
+                    pass    # the tokenizer has told about the invalid character
+                engine.writer.close()
+            finally:
+                sys.stdout = stdout
+
+            xml = stream.getvalue()
+            class_messages = messages.getvalue()
+            header_xml_end = engine.header_xml_end
+            header_messages_end = engine.header_messages_end
+            if None == header_xml_end:
+                header_xml_end = len(xml)
+                header_messages_end = len(class_messages)
+            self.header_xml = xml[:header_xml_end]
+            self.trailer_xml = xml[header_xml_end:]
+            self.header_messages = class_messages[:header_messages_end]
+            self.trailer_messages = class_messages[header_messages_end:]
+            self.segments = engine.segments
+            # the spans can only be trusted when the class has been parsed without a message
+            self.incremental = succeeded and "" == class_messages
+
+        def parseSegment(self, start, end):
+            '''
+            Parse the span [start, end) of the text as one subroutine. Returns its Segment, None
+            when the span does not hold exactly one subroutine, may it be broken or not. The tokens
+            after the error in a broken subroutine belong to it, as they do in analyzeAll, but when
+            the span runs out before the error, the subroutine may go on after the span
+            '''
+            tokenizer = JackAnalyzer.JackTokenizer(self.file_path, self.text)
+            tokenizer.setSpan(start, end)
+            stream = StringIO.StringIO()
+            engine = JackAnalyzer.CompilationEngine(tokenizer)
+            engine.writer = JackAnalyzer.XmlWriter(stream)
+            # the subroutine is parsed inside the class element
+            engine.writer.open_tags.append("class")
+            engine.root = 1
+
+            stdout = sys.stdout
+            sys.stdout = messages = StringIO.StringIO()
+            try:
+                if tokenizer.peekKey() not in first_subroutine_dec:
+                    return None
+                if True == engine.CompileSubroutineDec(engine.root):
+                    if None != tokenizer.peek():
+                        return None
+                else:
+                    # a broken subroutine which has used up the span may go on after it
+                    if None == tokenizer.peek() or tokenizer.tokenKey() in first_subroutine_dec:
+                        return None
+                    while None != tokenizer.peek():
+                        if tokenizer.peekKey() in first_subroutine_dec:
+                            return None
+                        tokenizer.advance()
+            except SystemExit:
+                pass    # the tokenizer has told about the invalid character
+            finally:
+                sys.stdout = stdout
+            engine.writer.closeTo(engine.root)
+            return JackAnalyzer.IncrementalAnalyzer.Segment(start, end, stream.getvalue(), messages.getvalue())
+
+        def lineOffset(self, line):
+            '''
+            Returns the offset of the first character of the line, counted from 1
+            '''
+            offset = 0
+            for i in range(line - 1):
+                offset = self.text.find("\n", offset) + 1
+                if 0 == offset:
+                    return len(self.text)
+            return offset
+
+        def edit(self, first_line, last_line, text):
+            '''
+            API function
+            Replace the lines first_line to last_line, counted from 1, with text. The newline at
+            the end of last_line is kept. Returns the refreshed diagnostics
+            '''
+            start = self.lineOffset(first_line)
+            end = self.text.find("\n", self.lineOffset(last_line))
+            if -1 == end:
+                end = len(self.text)
+            old_text = self.text[start:end]
+            # the edit with the characters around it, a comment may start or end there and run
+            # over the spans of several subroutines when the delimiters change
+            old_around = self.text[max(start - 1, 0):end + 1]
+            self.text = self.text[:start] + text + self.text[end:]
+            new_around = self.text[max(start - 1, 0):start + len(text) + 1]
+
+            index = None
+            if True == self.incremental:
+                for i, segment in enumerate(self.segments):
+                    if segment.start <= start and end <= segment.end:
+                        index = i
+                        break
+            if lex_delimiters_regex.findall(old_around) != lex_delimiters_regex.findall(new_around):
+                index = None
+            if None == index:
+                self.analyzeAll()
+                return self.diagnostics()
+
+            delta = len(text) - len(old_text)
+            segment = self.segments[index]
+            new_segment = self.parseSegment(segment.start, segment.end + delta)
+            if None == new_segment:
+                self.analyzeAll()
+                return self.diagnostics()
+            self.segments[index] = new_segment
+
+            # the subroutines after the edit only move
+            for i in range(index + 1, len(self.segments)):
+                segment = self.segments[i]
+                segment.start += delta
+                segment.end += delta
+            return self.diagnostics()
+
+        def diagnostics(self):
+            '''
+            API function
+            Returns the messages of the analysis of the current text, one per line
+            '''
+            messages = self.header_messages + "".join([segment.messages for segment in self.segments]) + self.trailer_messages
+            return messages.splitlines()
+
+        def parseTree(self):
+            '''
+            API function
+            Returns the xml parse tree of the current text
+            '''
+            return self.header_xml + "".join([segment.xml for segment in self.segments]) + self.trailer_xml
 
     def __init__(self, path):
         self.list_input_files = self.path_pre_process(path)
-        self.list_jt = []
-        self.list_ce = []
 
         if 0 == len(self.list_input_files):
             print "Error: no input files"
             sys.exit(1)
 
-        # create tokenizers
         for f in self.list_input_files:
             print "Input file %s found" % (f, )
-            jt = self.JackTokenizer(f)
-            self.list_jt.append(jt)
 
-        # create compilation engines
-        for jt in self.list_jt:
-            # avoid emptyfiles
-            if jt.tok_len > 0:
-                ce = self.CompilationEngine(jt)
-                self.list_ce.append(ce)
-
-    def compile(self):
-        # call the compile command on all CompilationEngine instances
-        for ce in self.list_ce:
-            ce.CompileNow()
+    def compile(self, num_jobs = 1, tokens_only = False):
+        '''
+        Analyze the input files, with a pool of num_jobs processes if it is more than one. The
+        messages of every file are printed in the order of the files. A file which cannot be
+        analyzed does not stop the others, the exit status tells about it at the end. With
+        tokens_only, only the tokens of the files are written
+        '''
+        num_failed = 0
+        list_jobs = [(f, tokens_only) for f in self.list_input_files]
+        for messages, succeeded in iter_analyze_files(list_jobs, num_jobs):
+            sys.stdout.write(messages)
+            if False == succeeded:
+                num_failed += 1
+        if num_failed > 0:
+            print "%d of %d files could not be analyzed" % (num_failed, len(self.list_input_files), )
+            sys.exit(1)
 
     def validate_file_path(self, file_path):
         if False == file_path.lower().endswith(".jack"):
@@ -1397,16 +1510,104 @@ class JackAnalyzer:
         return list_files
 
 
+def analyze_file(job):
+    '''
+    Tokenize and parse a whole jack file and write its xml file, job is a (jack file, tokens only)
+    tuple, with tokens only the file is just tokenized into its xxxT.xml file. Everything of the
+    file is freed once it is done. Return the messages printed meanwhile and whether the file could
+    be analyzed, the caller prints the messages so that the ones of different files are not interleaved
+    '''
+    file_path, tokens_only = job
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    succeeded = True
+    try:
+        jt = JackAnalyzer.JackTokenizer(file_path)
+        # avoid empty files
+        if True == jt.hasMoreTokens():
+            if True == tokens_only:
+                JackAnalyzer.CompilationEngine(jt).TokenizeNow()
+            else:
+                JackAnalyzer.CompilationEngine(jt).CompileNow()
+    except SystemExit:
+        succeeded = False
+    finally:
+        messages = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return (messages, succeeded)
+
+def iter_analyze_files(list_jobs, num_jobs):
+    '''
+    Generator of the results of analyze_file for every job, in the order of list_jobs. With more
+    than one job, the files are analyzed by a pool of num_jobs processes
+    '''
+    if num_jobs <= 1 or len(list_jobs) <= 1:
+        for job in list_jobs:
+            yield analyze_file(job)
+        return
+    pool = multiprocessing.Pool(min(num_jobs, len(list_jobs)))
+    try:
+        for result in pool.imap(analyze_file, list_jobs):
+            yield result
+    except BaseException:
+        # including the GeneratorExit raised when the caller gives up on the results
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+def run_benchmark(list_files, num_rounds):
+    '''
+    Time the tokenizer over the given files and print its throughput, the best of num_rounds
+    rounds is reported. No output file is written.
+    '''
+    list_jt = [JackAnalyzer.JackTokenizer(f) for f in list_files]
+    num_chars = sum([len(jt.file_content) for jt in list_jt])
+    num_tokens = 0
+    best = None
+    for i in range(num_rounds):
+        time_total = 0.0
+        num_tokens = 0
+        for jt in list_jt:
+            time_start = time.time()
+            for token in jt.tokenize():
+                num_tokens += 1
+            time_total += time.time() - time_start
+        if None == best or time_total < best:
+            best = time_total
+
+    print "%d files, %d characters, %d tokens, best of %d rounds" % (len(list_jt), num_chars, num_tokens, num_rounds, )
+    if best > 0:
+        print "%-9s %8.2f ms %10d tokens/s" % ("tokenize", best * 1000, num_tokens / best, )
+
+def parse_arguments():
+    arg_parser = argparse.ArgumentParser(description = "Parse .jack file(s) into .xml parse tree file(s)")
+    arg_parser.add_argument("path", help = "a .jack file or a folder of .jack files")
+    arg_parser.add_argument("-j", "--jobs", type = int, default = 1,
+                            help = "number of processes analyzing the .jack files, 0 for one per cpu (default: 1)")
+    arg_parser.add_argument("--tokens", action = "store_true",
+                            help = "only write the tokens of every file to its xxxT.xml file, without parsing it")
+    arg_parser.add_argument("--benchmark", type = int, metavar = "ROUNDS", default = 0,
+                            help = "time the tokenizer over ROUNDS rounds instead of writing the .xml files")
+    return arg_parser.parse_args()
+
 def main():
     # arguments pre-processing
     if len(sys.argv) <= 1:
         print "Please supply the path to the .jack file(s)"
         sys.exit(1)
+    ARGS = parse_arguments()
 
-    INPUT_PATH = os.path.normpath(sys.argv[1])
+    INPUT_PATH = os.path.normpath(ARGS.path)
 
     ja = JackAnalyzer(INPUT_PATH)
-    ja.compile()
+    if ARGS.benchmark > 0:
+        run_benchmark(ja.list_input_files, ARGS.benchmark)
+        return
+    NUM_JOBS = ARGS.jobs
+    if NUM_JOBS <= 0:
+        NUM_JOBS = multiprocessing.cpu_count()
+    ja.compile(NUM_JOBS, ARGS.tokens)
 
 if "__main__" == __name__:
     main()
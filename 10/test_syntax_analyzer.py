@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+# File name: test_syntax_analyzer.py
+# Description:
+# Tests of the incremental analyzer of syntax_analyzer.py
+#
+# Usage: python test_syntax_analyzer.py
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntax_analyzer import JackAnalyzer
+
+SQUARE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Square", "Square.jack")
+
+
+class CountingAnalyzer(JackAnalyzer.IncrementalAnalyzer):
+    '''
+    IncrementalAnalyzer counting its analyses of the whole file
+    '''
+    def __init__(self, file_path, text = None):
+        self.num_full = 0
+        JackAnalyzer.IncrementalAnalyzer.__init__(self, file_path, text)
+
+    def analyzeAll(self):
+        self.num_full += 1
+        JackAnalyzer.IncrementalAnalyzer.analyzeAll(self)
+
+
+class TestIncrementalAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.ia = CountingAnalyzer(SQUARE_PATH)
+        self.tree = self.ia.parseTree()
+
+    def test_clean_file(self):
+        self.assertEqual([], self.ia.diagnostics())
+        self.assertEqual(1, self.ia.num_full)
+
+    def test_syntax_error_and_fix(self):
+        # line 21 is "let x = Ax;" in the constructor
+        diagnostics = self.ia.edit(21, 21, "        let x = ;")
+        self.assertNotEqual([], diagnostics)
+        self.assertEqual(1, self.ia.num_full)
+        # the other subroutines are still there
+        self.assertEqual(self.tree.count("<subroutineDec>"), self.ia.parseTree().count("<subroutineDec>"))
+
+        diagnostics = self.ia.edit(21, 21, "        let x = Ax;")
+        self.assertEqual([], diagnostics)
+        self.assertEqual(1, self.ia.num_full)
+        self.assertEqual(self.tree, self.ia.parseTree())
+
+    def test_error_kept_across_edits(self):
+        # an error in the constructor, then an edit in dispose(), line 32
+        diagnostics = self.ia.edit(21, 21, "        let x = ;")
+        self.assertEqual(diagnostics, self.ia.edit(32, 32, "        do Memory.deAlloc(this);"))
+        self.assertNotEqual([], self.ia.edit(32, 32, "        do Memory.deAlloc(this)"))
+        self.assertNotEqual([], self.ia.edit(32, 32, "        do Memory.deAlloc(this);"))
+        self.assertEqual(diagnostics, self.ia.diagnostics())
+        self.assertEqual([], self.ia.edit(21, 21, "        let x = Ax;"))
+        self.assertEqual(1, self.ia.num_full)
+        self.assertEqual(self.tree, self.ia.parseTree())
+
+    def test_broken_file(self):
+        # a file loaded with a syntax error is still analyzed one subroutine at a time
+        text = self.ia.text.replace("let x = Ax;", "let x = ;")
+        ia = CountingAnalyzer(SQUARE_PATH, text)
+        self.assertNotEqual([], ia.diagnostics())
+        self.assertEqual([], ia.edit(21, 21, "        let x = Ax;"))
+        self.assertEqual(1, ia.num_full)
+        self.assertEqual(self.tree, ia.parseTree())
+
+    def test_comment_delimiter(self):
+        # a comment may run over several subroutines, the whole file is analyzed again
+        self.ia.edit(21, 21, "        /* let x = Ax;")
+        self.assertEqual(2, self.ia.num_full)
+
+
+if "__main__" == __name__:
+    unittest.main()
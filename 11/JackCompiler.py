@@ -11,166 +11,332 @@
 import sys
 import os
 import re
+import collections
 
-import xml.etree.ElementTree as ET
-import xml.dom.minidom as md
+# The nodes of the abstract syntax tree built by the CompilationEngine. A node only keeps what the
+# code generation needs, the keywords, brackets and separators which the grammar implies are not
+# stored. There are many nodes per class, hence the slots
+class AstNode(object):
+    '''
+    base class of all the nodes of the abstract syntax tree
+    '''
+    __slots__ = ()
+
+class ClassDec(AstNode):
+    __slots__ = ("name", "classVarDecs", "subroutineDecs")
+
+    def __init__(self, name):
+        self.name = name
+        self.classVarDecs = []
+        self.subroutineDecs = []
+
+class ClassVarDec(AstNode):
+    __slots__ = ("kind", "type", "names")
 
-class Tree:
+    def __init__(self, kind, varType):
+        self.kind = kind    # static or field
+        self.type = varType
+        self.names = []
+
+class SubroutineDec(AstNode):
     '''
-    Used in expression evaluation
+    a constructor, function or method, parameters is a list of (type, name) pairs
     '''
-    class Node:
-        def __init__(self, value):
-            self.value = value
-            self.leftChild = None
-            self.rightChild = None
+    __slots__ = ("kind", "returnType", "name", "parameters", "varDecs", "statements")
+
+    def __init__(self, kind, returnType, name):
+        self.kind = kind
+        self.returnType = returnType
+        self.name = name
+        self.parameters = []
+        self.varDecs = []
+        self.statements = []
+
+class VarDec(AstNode):
+    __slots__ = ("type", "names")
+
+    def __init__(self, varType):
+        self.type = varType
+        self.names = []
+
+class LetStatement(AstNode):
+    __slots__ = ("name", "index", "value")
 
-        def GetVal(self):
-            return self.value
+    def __init__(self, name):
+        self.name = name
+        self.index = None   # the index expression when an array element is assigned
+        self.value = None
 
-        def SetVal(self, value):
-            self.value = value
+class IfStatement(AstNode):
+    __slots__ = ("condition", "statements", "elseStatements")
 
-        def GetLeft(self):
-            return self.leftChild
+    def __init__(self):
+        self.condition = None
+        self.statements = []
+        self.elseStatements = None  # a list of statements when there is an else clause
+
+class WhileStatement(AstNode):
+    __slots__ = ("condition", "statements")
 
-        def GetRight(self):
-            return self.rightChild
+    def __init__(self):
+        self.condition = None
+        self.statements = []
 
-        def SetLeft(self, node):
-            self.leftChild = node
+class DoStatement(AstNode):
+    __slots__ = ("call", )
+
+    def __init__(self):
+        self.call = None
 
-        def SetRight(self, node):
-            self.rightChild = node
+class ReturnStatement(AstNode):
+    __slots__ = ("value", )
 
     def __init__(self):
-        self.root = None
-        self.RPN = []
-
-    def PostOrderTraversal(self, node):
-        if None == node:
-            return False
-        self.PostOrderTraversal(node.leftChild)
-        self.PostOrderTraversal(node.rightChild)
-        self.RPN.append(node.GetVal())
-
-    def AddNode(self, newNode):
-        self.root = self.InsertNode(self.root, newNode)
-
-    def AddVal(self, value):
-        self.root = self.InsertVal(self.root, value)
-
-    def InsertVal(self, node, value):
-        if None == node:
-            node = self.Node(value)
-            return node
-
-        if None == node.GetLeft():
-            newNode = self.Node(value)
-            # do the swap
-            if value in "+-*/":
-                tempVal = node.GetVal()
-                node.SetVal(value)
-                newNode.SetVal(tempVal)
-            node.SetLeft(newNode)
-            return node
-
-        if None == node.GetRight():
-            newNode = self.Node(value)
-            # do the swap
-            if value in "+-*/":
-                tempVal = node.GetVal()
-                node.SetVal(value)
-                newNode.SetVal(tempVal)
-            node.SetRight(newNode)
-            return node
-
-        leftNode = self.InsertVal(node.GetLeft(), value)
-        nde.SetLeft(leftNode)
-        return node
-
-    def InsertNode(self, curNode, newNode):
-        if None == curNode:
-            curNode = newNode
-            return curNode
-
-        if None == curNode.GetLeft():
-            curNode.SetLeft(newNode)
-            return curNode
-
-        if None == curNode.GetRight():
-            curNode.SetRight(newNode)
-            return curNode
-
-        leftNode = self.InsertNode(curNode.GetLeft(), newNode)
-        curNode.SetLeft(leftNode)
-        return curNode
-
-
-class Token:
+        self.value = None   # None when nothing is returned
+
+class IntegerConstant(AstNode):
+    __slots__ = ("value", )
+
+    def __init__(self, value):
+        self.value = value
+
+class StringConstant(AstNode):
+    __slots__ = ("value", )
+
+    def __init__(self, value):
+        self.value = value
+
+class KeywordConstant(AstNode):
+    __slots__ = ("value", )
+
+    def __init__(self, value):
+        self.value = value
+
+class VarRef(AstNode):
+    __slots__ = ("name", )
+
+    def __init__(self, name):
+        self.name = name
+
+class ArrayRef(AstNode):
+    __slots__ = ("name", "index")
+
+    def __init__(self, name):
+        self.name = name
+        self.index = None
+
+class SubroutineCall(AstNode):
     '''
-    one single token
+    a call of name, or of receiver.name where receiver is a class or a variable name
     '''
-    def __init__(self, token_type, raw_str, match_str):
-        self.token_type = token_type
-        self.raw_str = raw_str
-        self.match_str = match_str
+    __slots__ = ("receiver", "name", "arguments")
+
+    def __init__(self, name):
+        self.receiver = None
+        self.name = name
+        self.arguments = []
 
-    def get_type(self):
-        return self.token_type
+class ParenExpression(AstNode):
+    __slots__ = ("expression", )
 
-    def get_raw_str(self):
-        return self.raw_str
+    def __init__(self, expression):
+        self.expression = expression
 
-    def get_mth_str(self):
-        return self.match_str
+class UnaryOp(AstNode):
+    __slots__ = ("op", "operand")
 
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
 
-class Regex:
+class BinaryOp(AstNode):
     '''
-    specific regex expression object with a name
+    Jack has no operator priority, the terms of an expression are combined from left to right so
+    that the left operand is the rest of the expression and the right one is always a term
     '''
-    def __init__(self, reg_name, pattern):
-        self.reg_name = reg_name
-        self.reg_obj  = re.compile(pattern)
+    __slots__ = ("op", "left", "right")
 
-    def get_name(self):
-        return self.reg_name
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
 
-    def match(self, string):
-        return self.reg_obj.match(string)
 
+# token kinds. They are small ints so that a type check is an int comparison, the names are the
+# ones of the master regex groups and of the tags in the xml output
+KEYWORD, SYMBOL, INT_CONST, STRING_CONST, IDENTIFIER = range(5)
+token_type_names = ["keyword", "symbol", "integerConstant", "stringConstant", "identifier"]
+token_kinds = dict(zip(token_type_names, range(len(token_type_names))))
 
-lex_ele_regex_list = [
-    # lexical elements, please note the order of items in this list is important.
-    Regex("keyword", "^(class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)[\W]+"),
-    Regex("symbol", "^(>=|<=|[{}()\[\]\.,;\+\-\*\/\&\|<>=~])"),
-    Regex("integerConstant", "^(\d+)"),
-    Regex("stringConstant", "^\"(.*?)\""),
-    Regex("identifier", "^([a-zA-Z|\d]\w*)")
-]
+class Token(object):
+    '''
+    one single token: its kind, its text and the offset of its first character in the file.
+    Tokens are many and short lived, hence the slots
+    '''
+    __slots__ = ("kind", "text", "offset")
+
+    def __init__(self, kind, text, offset):
+        self.kind = kind
+        self.text = text
+        self.offset = offset
+
+
+# All the lexical elements in a single regex, one named group per token type. The input is scanned
+# once from left to right, the first alternative matching at the current position wins, so please
+# note the order of the groups is important. The white spaces before a token are part of its match,
+# comments are matched as "skip" and anything else which is not a token as "error"
+lex_master_regex = re.compile(r'''
+    \s*(?:
+    (?P<skip>//[^\n]*|/\*.*?\*/)
+  | (?P<keyword>(?:class|constructor|function|method|field|static|var|int|char|boolean|void|true|false|null|this|let|do|if|else|while|return)(?!\w))
+  | (?P<symbol>>=|<=|[{}()\[\].,;+\-*/&|<>=~])
+  | (?P<integerConstant>\d+)
+  | (?P<stringConstant>"[^"\n]*")
+  | (?P<identifier>[a-zA-Z_]\w*)
+  | (?P<error>\S)
+    )
+''', re.DOTALL | re.VERBOSE)
+
+# the token kind matched by each group of the master regex, by group number. None for the groups
+# which do not make a token
+lex_group_kinds = [None] * (lex_master_regex.groups + 1)
+for group_name, group_index in lex_master_regex.groupindex.items():
+    lex_group_kinds[group_index] = token_kinds.get(group_name)
+
+# The names starting with this prefix are reserved for the functions and labels the compiler adds
+# on its own, no subroutine of a class may be named so
+RESERVED_PREFIX = "__"
+
+# The String subroutines which change the string they are given, a string literal passed to them
+# is built anew instead of taken from the string pool of the class
+string_mutators = frozenset(["dispose", "setCharAt", "appendChar", "eraseLastChar", "setInt"])
 
 class CompilationEngine:
     '''
     Gets input from a JackTokenizer and emits parsed structure into an output file / stream.
     The output is generated by a series of compilexxx() routines, one for every syntactic element
-    xxx of the Jack grammar.
+    xxx of the Jack grammar. The vm commands are written while the tokens are parsed, the parsed
+    structure is only kept as an abstract syntax tree of AstNode when build_tree is set
     '''
-    def __init__(self, jt):
+    def __init__(self, jt, build_tree = False):
         self.tokenizer = jt
-        self.root = None    # the root element of the parse tree
+        self.build_tree = build_tree
+        self.root = None    # the ClassDec node at the root of the abstract syntax tree
         self.st = SymbolTable()
         self.vw = VMWriter(self.tokenizer.in_file_path)
         self.parameterNum = 0  # number of parameters in a subroutine
         self.varNum = 0  # number of local variables in a subroutine
         self.argNum = 0  # number of arguments supplied when a subroutine is called
+        # whether the constants and operators of the expression being compiled are written, so
+        # far only the arithmetic of the arguments of a call is compiled
+        self.writeArithmetic = False
+        # the string literals of the class, each to the static variable holding it
+        self.stringPool = collections.OrderedDict()
+        # where the vm commands of the current subroutine start, until the check building the
+        # string pool is inserted there
+        self.stringPoolEntry = None
+        self.buildString = False  # whether the string literals are built anew instead of pooled
 
     def StartCompiling(self):
         # the first program structure in a file is always class
         # and this function will recursively call other compile functions
         self.CompileClass()
+        self.WriteStringPool()
         self.vw.CreateOutputFile()
 
+    def WriteStringLiteral(self, literal):
+        '''
+        Write the push of a string literal, a single push of the static variable holding it. The
+        statics of the class are all defined before its subroutines and the pool takes the indexes
+        after them. The pool is built by the first call of a subroutine of the class using a
+        literal, which checks at its entry whether the pool is built yet
+        '''
+        if True == self.buildString:
+            self.WriteStringNew(literal)
+            return
+        index = self.stringPool.get(literal)
+        if None == index:
+            index = self.st.GetVarCount("static") + len(self.stringPool)
+            self.stringPool[literal] = index
+        if None != self.stringPoolEntry:
+            label = RESERVED_PREFIX + "STRING_POOL_BUILT"
+            self.vw.InsertCommands(self.stringPoolEntry, [
+                "push static %d" % (self.st.GetVarCount("static"), ),  # the first string of the pool
+                "if-goto %s" % (label, ),
+                "call %s.%sinitStringPool 0" % (self.st.classNameList[0], RESERVED_PREFIX, ),
+                "pop temp 0",
+                "label %s" % (label, ),
+            ])
+            self.stringPoolEntry = None
+        self.vw.WritePush(index, "static")
+
+    def WriteStringNew(self, literal):
+        '''
+        Write the building of a new string holding the literal, it is left on the stack
+        '''
+        self.vw.WritePush(len(literal))
+        self.vw.WriteCall("String.new", 1)
+        for c in literal:
+            self.vw.WritePush(ord(c))
+            self.vw.WriteCall("String.appendChar", 2)
+
+    def WriteStringPool(self):
+        '''
+        Write the function building all the string literals of the class, it is called once by
+        the first subroutine of the class using one of them. The uses of a literal share its string
+        '''
+        if 0 == len(self.stringPool):
+            return
+        self.vw.WriteFunction(self.st.classNameList[0] + "." + RESERVED_PREFIX + "initStringPool", 0)
+        for literal, index in self.stringPool.iteritems():
+            self.WriteStringNew(literal)
+            self.vw.WritePop("static", index)
+        self.vw.WriteReturn(True)
+
+    def WriteParseTree(self):
+        '''
+        Write the abstract syntax tree as the xml parse tree of the syntax analyzer
+        '''
+        if None == self.root:
+            return
+        file_path = self.tokenizer.in_file_path
+        output_file_path = file_path.split(".")[0] + "fromJackCompiler.xml"
+        try:
+            fd_ou_file = open(output_file_path, "w")
+        except IOError as e:
+            print "I/O error: %s" % (str(e), )
+            sys.exit(1)
+        XmlVisitor(fd_ou_file).Visit(self.root, 0)
+        fd_ou_file.close()
+        print "%s generated " % (output_file_path, )
+
+    def NewNode(self, nodeClass, *args):
+        '''
+        Returns a new node of the abstract syntax tree, None when no tree is built
+        '''
+        if True == self.build_tree:
+            return nodeClass(*args)
+        return None
+
+    def StatementList(self, parent):
+        '''
+        Returns the list the statements of the node parent go to, None when no tree is built
+        '''
+        if None == parent:
+            return None
+        return parent.statements
+
+    def CompileType(self):
+        '''
+        Returns the type which is the current token, None if it is not a type
+        '''
+        if "int" == self.tokenizer.keyWord() or \
+           "char" == self.tokenizer.keyWord() or \
+           "boolean" == self.tokenizer.keyWord():
+            return self.tokenizer.keyWord()
+        else:
+            return self.tokenizer.identifier()
+
     def CompileClass(self):
         '''
         Compile a complete class
@@ -178,11 +344,7 @@ class CompilationEngine:
         if None == self.tokenizer.current_token:
             self.tokenizer.advance()
 
-        if "class" == self.tokenizer.keyWord():
-            self.root = ET.Element("class")
-            item = ET.SubElement(self.root, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-        else:
+        if "class" != self.tokenizer.keyWord():
             print "Failed to compile class"
             return False
 
@@ -191,9 +353,8 @@ class CompilationEngine:
             return False
 
         # className
+        self.root = self.NewNode(ClassDec, self.tokenizer.identifier())
         if self.tokenizer.identifier():
-            item = ET.SubElement(self.root, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier(), )
             self.st.classNameList.append(self.tokenizer.identifier())
         else:
             print "Failed to match the identifier in %s" % (sys._getframe().f_code.co_name, )
@@ -203,10 +364,7 @@ class CompilationEngine:
             return False
 
         # symbol '{'
-        if '{' == self.tokenizer.symbol():
-            item = ET.SubElement(self.root, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if '{' != self.tokenizer.symbol():
             print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -223,12 +381,8 @@ class CompilationEngine:
             return False
 
         # symbol '}'
-        if '}' == self.tokenizer.symbol():
-            item = ET.SubElement(self.root, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
-            print "Failed to match the '}' in %s, we got a %s" % (sys._getframe().f_code.co_name, self.tokenizer.keyWord(), )
+        if '}' != self.tokenizer.symbol():
+            print "Failed to match the '}' in %s, we got a %s at line %d" % (sys._getframe().f_code.co_name, self.tokenizer.keyWord(), self.tokenizer.lineNumber(), )
             return False
 
         return True
@@ -238,21 +392,13 @@ class CompilationEngine:
         Compile a static declaration or a field declaration
 
         Arg:
-            parent: the parent node which the tree nodes created in this function are attached to
+            parent: the ClassDec node which the classVarDec node is added to
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # (static | field)
-        if "static" == self.tokenizer.keyWord() or "field" == self.tokenizer.keyWord():
-            # since we know this is a classVarDec program structure
-            parent = ET.SubElement(parent, "classVarDec")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
+        if "static" == self.tokenizer.peekKeyWord() or "field" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
             classVarKind = self.tokenizer.keyWord()
         else:
-            self.tokenizer.rollBack()
             return False
 
         if None == self.tokenizer.advance():
@@ -260,29 +406,24 @@ class CompilationEngine:
             return False
 
         # type
-        if "int" == self.tokenizer.keyWord() or \
-           "char" == self.tokenizer.keyWord() or \
-           "boolean" == self.tokenizer.keyWord():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-            classVarType = self.tokenizer.keyWord()
-        elif self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier())
-            classVarType = self.tokenizer.identifier()
-        else:
+        classVarType = self.CompileType()
+        if None == classVarType:
             print "Failed to match the 'type' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
+        node = self.NewNode(ClassVarDec, classVarKind, classVarType)
+        if None != node:
+            parent.classVarDecs.append(node)
+
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
         # varName
         if self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier(), )
             classVarName = self.tokenizer.identifier()
+            if None != node:
+                node.names.append(classVarName)
         else:
             print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
             return False
@@ -296,17 +437,14 @@ class CompilationEngine:
 
         # (, varName)*
         while "," == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
                 classVarName = self.tokenizer.identifier()
+                if None != node:
+                    node.names.append(classVarName)
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -318,8 +456,6 @@ class CompilationEngine:
                 return False
 
         if ";" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
             return True
         else:
             print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
@@ -329,20 +465,13 @@ class CompilationEngine:
         '''
         Compile a complete method, function or constructor
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # (constructor | function | method)
-        if "constructor" == self.tokenizer.keyWord() or \
-           "function" == self.tokenizer.keyWord() or \
-           "method" == self.tokenizer.keyWord():
-            # since we know this is a subroutineDec program structure
-            parent = ET.SubElement(parent, "subroutineDec")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
+        if "constructor" == self.tokenizer.peekKeyWord() or \
+           "function" == self.tokenizer.peekKeyWord() or \
+           "method" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
+            subroutineKind = self.tokenizer.keyWord()
         else:
-            self.tokenizer.rollBack()
             return False
 
         if None == self.tokenizer.advance():
@@ -351,17 +480,10 @@ class CompilationEngine:
 
         # void or type
         if "void" == self.tokenizer.keyWord():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-        elif "int" == self.tokenizer.keyWord() or \
-           "char" == self.tokenizer.keyWord() or \
-           "boolean" == self.tokenizer.keyWord():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-        elif self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier())
+            returnType = self.tokenizer.keyWord()
         else:
+            returnType = self.CompileType()
+        if None == returnType:
             print "Failed to match the '(void | type)' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -371,28 +493,30 @@ class CompilationEngine:
 
         # subroutineName
         if self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier())
             self.st.subroutineNameList.append(self.tokenizer.identifier())
             subroutineName = self.tokenizer.identifier()
         else:
             print "Failed to match the 'subroutineName' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
+        if subroutineName.startswith(RESERVED_PREFIX):
+            print "Error: the subroutine name %s at line %d is reserved, the names starting with %s are the compiler's" % (subroutineName, self.tokenizer.lineNumber(), RESERVED_PREFIX, )
+            return False
+
+        node = self.NewNode(SubroutineDec, subroutineKind, returnType, subroutineName)
+        if None != node:
+            parent.subroutineDecs.append(node)
         self.st.StartSubroutineScope(subroutineName)
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "(" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol())
-        else:
+        if "(" != self.tokenizer.symbol():
             print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if False == self.CompileParameterList(parent):
+        if False == self.CompileParameterList(node):
             print "Failed to match the parameterList in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -400,14 +524,11 @@ class CompilationEngine:
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if ")" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol())
-        else:
+        if ")" != self.tokenizer.symbol():
             print "Failedf to match the ')' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if False == self.CompileSubroutineBody(parent):
+        if False == self.CompileSubroutineBody(node):
             print "Failed to match the subroutineBody in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -420,26 +541,15 @@ class CompilationEngine:
         Compile a (possibly empty) parameter list, not including the enclosing"()".
         '''
         self.parameterNum = 0
-        parent = ET.SubElement(parent, "parameterList")
-        ET.SubElement(parent, "pad")
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # type
-        if "int" == self.tokenizer.keyWord() or \
-           "char" == self.tokenizer.keyWord() or \
-           "boolean" == self.tokenizer.keyWord():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-            argVarType = self.tokenizer.keyWord()
-        elif self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier())
-            argVarType = self.tokenizer.identifier()
+        if "int" == self.tokenizer.peekKeyWord() or \
+           "char" == self.tokenizer.peekKeyWord() or \
+           "boolean" == self.tokenizer.peekKeyWord() or \
+           self.tokenizer.peekIdentifier():
+            self.tokenizer.advance()
+            argVarType = self.CompileType()
         else:
             # the whole parameterList structure is optional
-            self.tokenizer.rollBack()
             return True
 
         if None == self.tokenizer.advance():
@@ -448,40 +558,27 @@ class CompilationEngine:
 
         # varName
         if self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier(), )
             argVarName = self.tokenizer.identifier()
+            if None != parent:
+                parent.parameters.append((argVarType, argVarName))
         else:
             print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
         self.st.Define(argVarName, argVarType, "argument")
         self.parameterNum += 1
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
 
         # (, type varName)*
-        while "," == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
+        while "," == self.tokenizer.peekSymbol():
+            self.tokenizer.advance()
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # type
-            if "int" == self.tokenizer.keyWord() or \
-               "char" == self.tokenizer.keyWord() or \
-               "boolean" == self.tokenizer.keyWord():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.keyWord(), )
-                argVarType = self.tokenizer.keyWord()
-            elif self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier())
-                argVarType = self.tokenizer.identifier()
-            else:
+            argVarType = self.CompileType()
+            if None == argVarType:
                 print "Failed to match 'type' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
@@ -491,37 +588,29 @@ class CompilationEngine:
 
             # varName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
                 argVarName = self.tokenizer.identifier()
+                if None != parent:
+                    parent.parameters.append((argVarType, argVarName))
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             self.st.Define(argVarName, argVarType, "argument")
             self.parameterNum += 1
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
 
-        self.tokenizer.rollBack()
         return True
 
     def CompileSubroutineBody(self, parent):
         '''
-        Compile the body of a subroutine in a class
+        Compile the body of a subroutine in a class, its declarations and statements go to
+        the SubroutineDec node parent
         '''
-        parent = ET.SubElement(parent, "subroutineBody")
-        ET.SubElement(parent, "pad")
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
         # '{'
-        if "{" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if "{" != self.tokenizer.symbol():
             print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -529,8 +618,9 @@ class CompilationEngine:
             pass
 
         self.vw.WriteFunction(self.st.classNameList[0] + "." + self.st.subroutineName, self.varNum)
+        self.stringPoolEntry = self.vw.GetCommandCount()
 
-        while self.CompileStatements(parent):
+        while self.CompileStatements(self.StatementList(parent)):
             pass
 
         if None == self.tokenizer.advance():
@@ -538,11 +628,7 @@ class CompilationEngine:
             return False
 
         # '}'
-        if "}" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if "}" != self.tokenizer.symbol():
             print "Failed to match the '}' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -553,18 +639,10 @@ class CompilationEngine:
         Compile a var declaration
         '''
         self.varNum = 0
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # 'var'
-        if "var" == self.tokenizer.keyWord():
-            # since we know this is a varDec program structure
-            parent = ET.SubElement(parent, "varDec")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
+        if "var" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
         else:
-            self.tokenizer.rollBack()
             return False
 
         if None == self.tokenizer.advance():
@@ -572,29 +650,24 @@ class CompilationEngine:
             return False
 
         # type
-        if "int" == self.tokenizer.keyWord() or \
-           "char" == self.tokenizer.keyWord() or \
-           "boolean" == self.tokenizer.keyWord():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-            varType = self.tokenizer.keyWord()
-        elif self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier())
-            varType = self.tokenizer.identifier()
-        else:
+        varType = self.CompileType()
+        if None == varType:
             print "Failed to match the 'type' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
+        node = self.NewNode(VarDec, varType)
+        if None != node:
+            parent.varDecs.append(node)
+
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
         # varName
         if self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier(), )
             varName = self.tokenizer.identifier()
+            if None != node:
+                node.names.append(varName)
         else:
             print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
             return False
@@ -608,18 +681,15 @@ class CompilationEngine:
 
         # (, varName)*
         while "," == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
             # varName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
                 varName = self.tokenizer.identifier()
+                if None != node:
+                    node.names.append(varName)
             else:
                 print "Failed to match the 'varName' in %s" % (sys._getframe().f_code.co_name, )
                 return False
@@ -630,11 +700,7 @@ class CompilationEngine:
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-        if ";" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if ";" != self.tokenizer.symbol():
             print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -642,10 +708,9 @@ class CompilationEngine:
 
     def CompileStatements(self, parent):
         '''
-        Compile a sequence of statements, not inclduing the enclosing "{}".
+        Compile a sequence of statements, not inclduing the enclosing "{}". The statement nodes
+        are appended to the list parent, which is None when no tree is built
         '''
-        parent = ET.SubElement(parent, "statements")
-        ET.SubElement(parent, "pad")
         while self.CompileDo(parent) or \
               self.CompileLet(parent) or \
               self.CompileWhile(parent) or \
@@ -658,22 +723,20 @@ class CompilationEngine:
         '''
         Compile a do statement
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # 'do'
-        if "do" == self.tokenizer.keyWord():
-            # since we know this is a doStatement program structure
-            parent = ET.SubElement(parent, "doStatement")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
+        if "do" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
+            node = self.NewNode(DoStatement)
+            if None != node:
+                parent.append(node)
         else:
-            self.tokenizer.rollBack()
             return False
 
         # subroutineCall
-        if False == self.CompileSubroutineCall(parent):
+        retVal, call = self.CompileSubroutineCall()
+        if None != node:
+            node.call = call
+        if False == retVal:
             print "Failed to match the 'subroutineCall' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -681,31 +744,24 @@ class CompilationEngine:
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if ";" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if ";" != self.tokenizer.symbol():
             print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
         return True
 
-    def CompileSubroutineCall(self, parent):
+    def CompileSubroutineCall(self):
         '''
-        Note that subroutineCall is not a non-terminal structure
+        Note that subroutineCall is not a non-terminal structure. Returns whether the call
+        could be compiled and its SubroutineCall node
         '''
         # TODO: I assume all subroutines are functions for simplicity
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
-        name1 = ""
-        name2 = ""
         # (subroutineName | className | varName)
-        if self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier(), )
-            name1 = self.tokenizer.identifier()
+        if self.tokenizer.peekIdentifier():
+            self.tokenizer.advance()
+            receiver = None
+            subroutineName = self.tokenizer.identifier()
+            node = self.NewNode(SubroutineCall, subroutineName)
             # # look up this identifier in the symbol table
             # varName = self.tokenizer.identifier()
             # entry = self.st.FindSymbol(varName)
@@ -717,75 +773,64 @@ class CompilationEngine:
             #     print "identifier %s is a class name defined in the current file"
         else:
             print "Failed to match the 'subroutineName' in %s" % (sys._getframe().f_code.co_name, )
-            self.tokenizer.rollBack()
-            return False
+            return False, None
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
+            return False, node
 
         if "." == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
+                return False, node
 
             # subroutineName
             if self.tokenizer.identifier():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
-                name2  = self.tokenizer.identifier()
+                receiver = subroutineName
+                subroutineName = self.tokenizer.identifier()
+                if None != node:
+                    node.receiver = receiver
+                    node.name = subroutineName
             else:
                 print "Failed to match 'subroutineName' in %s" % (sys._getframe().f_code.co_name, )
-                return False
+                return False, node
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
+                return False, node
 
-        if "(" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if "(" != self.tokenizer.symbol():
             print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
-            return False
+            return False, node
 
-        self.CompileExpressionList(parent)
+        # the arguments are pushed before the call
+        writeArithmetic = self.writeArithmetic
+        buildString = self.buildString
+        self.writeArithmetic = True
+        self.buildString = "String" == receiver and subroutineName in string_mutators
+        self.CompileExpressionList(node)
+        self.writeArithmetic = writeArithmetic
+        self.buildString = buildString
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
+            return False, node
 
-        if ")" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if ")" != self.tokenizer.symbol():
             print "Failed to match the ')' in %s" % (sys._getframe().f_code.co_name, )
-            return False
+            return False, node
 
-        self.vw.WriteCall(name1 + "." + name2 if "" != name2 else name1, self.argNum)
-        return True
+        self.vw.WriteCall(receiver + "." + subroutineName if None != receiver else subroutineName, self.argNum)
+        return True, node
 
     def CompileLet(self, parent):
         '''
         Compile a let statement
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # 'let'
-        if "let" == self.tokenizer.keyWord():
-            # since we know this is a letStatement program structure
-            parent = ET.SubElement(parent, "letStatement")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-
+        if "let" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
         else:
-            self.tokenizer.rollBack()
             return False
 
         if None == self.tokenizer.advance():
@@ -794,11 +839,11 @@ class CompilationEngine:
 
         # varName
         if self.tokenizer.identifier():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.identifier(), )
-
             # look up this identifier in the symbol table
             varName = self.tokenizer.identifier()
+            node = self.NewNode(LetStatement, varName)
+            if None != node:
+                parent.append(node)
             entry = self.st.FindSymbol(varName)
 
             if None == entry:
@@ -816,10 +861,10 @@ class CompilationEngine:
 
         # ([expression])?
         if "[" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-            if False == self.CompileExpression(parent):
+            retVal, index = self.CompileExpression()
+            if None != node:
+                node.index = index
+            if False == retVal:
                 print "Failed to match the [expression] in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
@@ -827,10 +872,7 @@ class CompilationEngine:
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if "]" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
-            else:
+            if "]" != self.tokenizer.symbol():
                 print "Failed to match the ']' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
@@ -838,14 +880,14 @@ class CompilationEngine:
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-        if "=" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if "=" != self.tokenizer.symbol():
             print "Failed to match the '=' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if False == self.CompileExpression(parent):
+        retVal, value = self.CompileExpression()
+        if None != node:
+            node.value = value
+        if False == retVal:
             print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -853,10 +895,7 @@ class CompilationEngine:
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if ";" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if ";" != self.tokenizer.symbol():
             print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -866,45 +905,34 @@ class CompilationEngine:
         '''
         Compile a while statement
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # 'while'
-        if "while" == self.tokenizer.keyWord():
-            # since we know this is a whileStatement program structure
-            parent = ET.SubElement(parent, "whileStatement")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-
+        if "while" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
+            node = self.NewNode(WhileStatement)
+            if None != node:
+                parent.append(node)
         else:
-            self.tokenizer.rollBack()
             return False
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "(" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if "(" != self.tokenizer.symbol():
             print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if False == self.CompileExpression(parent):
+        retVal, condition = self.CompileExpression()
+        if None != node:
+            node.condition = condition
+        if False == retVal:
             print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if ")" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if ")" != self.tokenizer.symbol():
             print "Failed to match the ')' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -912,26 +940,18 @@ class CompilationEngine:
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "{" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if "{" != self.tokenizer.symbol():
             print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        while self.CompileStatements(parent):
+        while self.CompileStatements(self.StatementList(node)):
             pass
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "}" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if "}" != self.tokenizer.symbol():
             print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -941,34 +961,27 @@ class CompilationEngine:
         '''
         Compile a return statement
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # 'return'
-        if "return" == self.tokenizer.keyWord():
-            # since we know this is a returnStatement program structure
-            parent = ET.SubElement(parent, "returnStatement")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
+        if "return" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
+            node = self.NewNode(ReturnStatement)
+            if None != node:
+                parent.append(node)
         else:
-            self.tokenizer.rollBack()
             return False
 
-        hasRetExp, parseTree = self.CompileExpression(parent)
+        hasRetExp, value = self.CompileExpression()
+        if None != node:
+            node.value = value
         if False == hasRetExp:
             self.vw.WriteReturn(True)
         else:
-            self.vm.WriteReturn(False)
+            self.vw.WriteReturn(False)
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
-        if ";" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-        else:
+        if ";" != self.tokenizer.symbol():
             print "Failed to match the ';' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -978,42 +991,34 @@ class CompilationEngine:
         '''
         Compilea if statement, possibly witha trailing else clause
         '''
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
         # 'if'
-        if "if" == self.tokenizer.keyWord():
-            # since we know this is a ifStatement program structure
-            parent = ET.SubElement(parent, "ifStatement")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
+        if "if" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
+            node = self.NewNode(IfStatement)
+            if None != node:
+                parent.append(node)
         else:
-            self.tokenizer.rollBack()
             return False
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "(" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if "(" != self.tokenizer.symbol():
             print "Failed to match the '(' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if False == self.CompileExpression(parent):
+        retVal, condition = self.CompileExpression()
+        if None != node:
+            node.condition = condition
+        if False == retVal:
             print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if ")" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if ")" != self.tokenizer.symbol():
             print "Failed to match the ')' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
@@ -1021,297 +1026,222 @@ class CompilationEngine:
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "{" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if "{" != self.tokenizer.symbol():
             print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        while self.CompileStatements(parent):
+        while self.CompileStatements(self.StatementList(node)):
             pass
 
         if None == self.tokenizer.advance():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if "}" == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-        else:
+        if "}" != self.tokenizer.symbol():
             print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
             return False
 
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
-
-        if "else" == self.tokenizer.keyWord():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-
+        if "else" == self.tokenizer.peekKeyWord():
+            self.tokenizer.advance()
+            elseStatements = None
+            if None != node:
+                node.elseStatements = elseStatements = []
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if "{" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
-            else:
+            if "{" != self.tokenizer.symbol():
                 print "Failed to match the '{' in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            while self.CompileStatements(parent):
+            while self.CompileStatements(elseStatements):
                 pass
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
                 return False
 
-            if "}" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
-            else:
+            if "}" != self.tokenizer.symbol():
                 print "Failed to match the '}' in %s" % (sys._getframe().f_code.co_name, )
                 return False
-        else:
-            self.tokenizer.rollBack()
 
         return True
 
-    def CompileExpression(self, parent):
+    def CompileExpression(self):
         '''
-        Compile an expression
+        Compile an expression. Returns whether there is one and its node, the terms are
+        combined into BinaryOp nodes from left to right
         '''
-        subTree = Tree()
         # take a peek if the next token is a term
-        if None == self.tokenizer.advance():
+        if None == self.tokenizer.peek():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False, subTree
-
-        if self.tokenizer.identifier() or \
-           "integerConstant" == self.tokenizer.tokenType() or \
-           "stringConstant" == self.tokenizer.tokenType() or \
-           "-" == self.tokenizer.symbol() or "~" == self.tokenizer.symbol() or \
-           "(" == self.tokenizer.symbol() or \
-           "true" == self.tokenizer.keyWord() or \
-           "false" == self.tokenizer.keyWord() or \
-           "null" == self.tokenizer.keyWord() or \
-           "this" == self.tokenizer.keyWord():
-            parent = ET.SubElement(parent, "expression")
-
-        self.tokenizer.rollBack()
-
-        retVal, subTree = self.CompileTerm(parent, subTree)
+            return False, None
+
+        retVal, node = self.CompileTerm()
         if False == retVal:
-            return False, subTree
+            return False, node
 
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False, subTree
-
-        while ('+' == self.tokenizer.symbol() or \
-               '-' == self.tokenizer.symbol() or \
-               '*' == self.tokenizer.symbol() or \
-               '/' == self.tokenizer.symbol() or \
-               '&' == self.tokenizer.symbol() or \
-               '|' == self.tokenizer.symbol() or \
-               '<' == self.tokenizer.symbol() or \
-               '>' == self.tokenizer.symbol() or \
-               '=' == self.tokenizer.symbol()):
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-
-            subTree.AddVal(self.tokenizer.symbol())
-
-            retVal, subTree = self.CompileTerm(parent, subTree)
+        while self.tokenizer.peekSymbol() in ('+', '-', '*', '/', '&', '|', '<', '>', '='):
+            self.tokenizer.advance()
+            op = self.tokenizer.symbol()
+
+            retVal, term = self.CompileTerm()
+            node = self.NewNode(BinaryOp, op, node, term)
             if False == retVal:
                 print "Failed to match 'term' in %s" % (sys._getframe().f_code.co_name, )
-                return False, subTree
+                return False, node
+            if True == self.writeArithmetic:
+                self.vw.WriteArithMetic(op)
 
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False, subTree
+        return True, node
 
-        self.tokenizer.rollBack()
-        return True, subTree
-
-    def CompileTerm(self, parent, parseTree):
+    def CompileTerm(self):
         '''
         Compile a term. This routine is faced with a slight diffculty when trying
-        to decide between some of the alternative parsing rules.
+        to decide between some of the alternative parsing rules. Returns whether there
+        is a term and its node
         '''
-        if None == self.tokenizer.advance():
+        if None == self.tokenizer.peek():
             print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False, parseTree
-
-        if "integerConstant" == self.tokenizer.tokenType():  # integerConstant
-            parent = ET.SubElement(parent, "term")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %d " % (self.tokenizer.intVal(), )
-            parseTree.AddVal(str(self.tokenizer.intVal()))
-
-        elif "stringConstant" == self.tokenizer.tokenType():  # stringConstant
-            parent = ET.SubElement(parent, "term")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.stringVal(), )
-        elif "true" == self.tokenizer.keyWord() or \
-             "false" == self.tokenizer.keyWord() or \
-             "null" == self.tokenizer.keyWord() or \
-             "this" == self.tokenizer.keyWord():  # keyWord constant
-            parent = ET.SubElement(parent, "term")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.keyWord(), )
-        elif self.tokenizer.identifier():  # a variable name or an array element or a subroutineCall
-            parent = ET.SubElement(parent, "term")
-            # check if it is subroutineCall
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False, parseTree
-            if "(" == self.tokenizer.symbol() or \
-               "." == self.tokenizer.symbol():
-                # now, it must be a subroutineCall structure
-                self.tokenizer.rollBack()
-                self.tokenizer.rollBack()
+            return False, None
+
+        if INT_CONST == self.tokenizer.peekKind():  # integerConstant
+            self.tokenizer.advance()
+            node = self.NewNode(IntegerConstant, self.tokenizer.intVal())
+            if True == self.writeArithmetic:
+                self.vw.WritePush(self.tokenizer.intVal())
 
-                if False == self.CompileSubroutineCall(parent):
+        elif STRING_CONST == self.tokenizer.peekKind():  # stringConstant
+            self.tokenizer.advance()
+            node = self.NewNode(StringConstant, self.tokenizer.stringVal())
+            # a string literal is built once in the pool of the class, not every time it is used
+            if True == self.writeArithmetic:
+                self.WriteStringLiteral(self.tokenizer.stringVal())
+        elif self.tokenizer.peekKeyWord() in ("true", "false", "null", "this"):  # keyWord constant
+            self.tokenizer.advance()
+            node = self.NewNode(KeywordConstant, self.tokenizer.keyWord())
+        elif self.tokenizer.peekIdentifier():  # a variable name or an array element or a subroutineCall
+            # check if it is subroutineCall, the token after the identifier decides
+            if "(" == self.tokenizer.peekSymbol(2) or \
+               "." == self.tokenizer.peekSymbol(2):
+                # now, it must be a subroutineCall structure
+                retVal, node = self.CompileSubroutineCall()
+                if False == retVal:
                     print "Failed to match the 'subroutineCall' in %s" % (sys._getframe().f_code.co_name, )
-                    return False, parseTree
-            elif "[" == self.tokenizer.symbol():
-                self.tokenizer.rollBack()
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                    return False, node
+            elif "[" == self.tokenizer.peekSymbol(2):
+                self.tokenizer.advance()
 
                 # look up this identifier in the symbol table
                 varName = self.tokenizer.identifier()
+                node = self.NewNode(ArrayRef, varName)
                 entry = self.st.FindSymbol(varName)
 
                 if None == entry:
                     print "Error: identifier %s referenced but not defined." % (varName, )
-                    return False, parseTree
+                    return False, node
                 else:
                     print "identifier %s found in symbol table, running index %d" % (varName, entry.GetIndex())
 
                 if None == self.tokenizer.advance():
                     print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                    return False, parseTree
-
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
-
-                if False == self.CompileExpression(parent):
+                    return False, node
+
+                # the index of an array element is not compiled yet
+                writeArithmetic = self.writeArithmetic
+                self.writeArithmetic = False
+                retVal, index = self.CompileExpression()
+                self.writeArithmetic = writeArithmetic
+                if None != node:
+                    node.index = index
+                if False == retVal:
                     print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
-                    return False, parseTree
+                    return False, node
 
                 if None == self.tokenizer.advance():
                     print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                    return False, parseTree
+                    return False, node
 
-                if "]" == self.tokenizer.symbol():
-                    item = ET.SubElement(parent, self.tokenizer.tokenType())
-                    item.text = " %s " % (self.tokenizer.symbol(), )
-                else:
+                if "]" != self.tokenizer.symbol():
                     print "Failed to match the ']' in %s" % (sys._getframe().f_code.co_name, )
-                    return False, parseTree
+                    return False, node
             else:
-                self.tokenizer.rollBack()
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.identifier(), )
+                self.tokenizer.advance()
 
                 # look up this identifier in the symbol table
                 varName = self.tokenizer.identifier()
+                node = self.NewNode(VarRef, varName)
                 entry = self.st.FindSymbol(varName)
 
                 if None == entry:
                     print "Error: identifier %s referenced but not defined." % (varName, )
-                    return False, parseTree
+                    return False, node
                 else:
                     print "identifier %s found in symbol table, running index %d" % (varName, entry.GetIndex())
 
-        elif "(" == self.tokenizer.symbol():  # an expression in parentheses
-            parent = ET.SubElement(parent, "term")
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
+        elif "(" == self.tokenizer.peekSymbol():  # an expression in parentheses
+            self.tokenizer.advance()
 
-            retVal, subTree = self.CompileExpression(parent)
+            retVal, subTree = self.CompileExpression()
             if False == retVal:
                 print "Failed to match the expression in %s" % (sys._getframe().f_code.co_name, )
 
-            parseTree.AddNode(subTree.root)
+            node = self.NewNode(ParenExpression, subTree)
 
             if None == self.tokenizer.advance():
                 print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False, parseTree
+                return False, node
 
-            if ")" == self.tokenizer.symbol():
-                item = ET.SubElement(parent, self.tokenizer.tokenType())
-                item.text = " %s " % (self.tokenizer.symbol(), )
-            else:
+            if ")" != self.tokenizer.symbol():
                 print "Failed to match the ) in %s" % (sys._getframe().f_code.co_name, )
-                return False, parseTree
+                return False, node
 
-        elif "-" == self.tokenizer.symbol() or "~" == self.tokenizer.symbol():  # an expression prefixed by unary operators
-            parent = ET.SubElement(parent, "term")
-
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
-            if False == self.CompileTerm(parent):
+        elif "-" == self.tokenizer.peekSymbol() or "~" == self.tokenizer.peekSymbol():  # an expression prefixed by unary operators
+            self.tokenizer.advance()
+            op = self.tokenizer.symbol()
+
+            # the unary operators are not compiled yet
+            writeArithmetic = self.writeArithmetic
+            self.writeArithmetic = False
+            retVal, operand = self.CompileTerm()
+            self.writeArithmetic = writeArithmetic
+            node = self.NewNode(UnaryOp, op, operand)
+            if False == retVal:
                 print "Failed to match 'term' in %s" % (sys._getframe().f_code.co_name, )
-                return False, parseTree
+                return False, node
         else:
-            self.tokenizer.rollBack()
-            return False, parseTree
+            return False, None
 
-        return True, parseTree
+        return True, node
 
     def CompileExpressionList(self, parent):
         '''
-        Compile a (possibly empty) comma-separated list of expressions
+        Compile a (possibly empty) comma-separated list of expressions, the arguments of the
+        SubroutineCall node parent
         '''
         self.argNum = 0
 
-        parent = ET.SubElement(parent, "expressionList")
-        ET.SubElement(parent, "pad")
-        retVal, parseTree = self.CompileExpression(parent)
+        retVal, node = self.CompileExpression()
         if False == retVal:
             return False
- 
-        parseTree.PostOrderTraversal(parseTree.root)
-        for item in parseTree.RPN:
-            if item in "+-*/":
-                self.vw.WriteArithMetic(item)
-            else:
-                self.vw.WritePush(item)
 
+        if None != parent:
+            parent.arguments.append(node)
         self.argNum += 1
- 
-        if None == self.tokenizer.advance():
-            print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-            return False
 
         # (, expression)*
-        while "," == self.tokenizer.symbol():
-            item = ET.SubElement(parent, self.tokenizer.tokenType())
-            item.text = " %s " % (self.tokenizer.symbol(), )
+        while "," == self.tokenizer.peekSymbol():
+            self.tokenizer.advance()
 
-            retVal, parseTree = self.CompileExpression(parent)
+            retVal, node = self.CompileExpression()
             if False == retVal:
                 print "Failed to match the 'expression' in %s" % (sys._getframe().f_code.co_name, )
                 return False
-            parseTree.PostOrderTraversal(parseTree.root)
-            for item in parseTree.RPN:
-                if item in "+-*/":
-                    self.vw.WriteArithMetic(item)
-                else:
-                    self.vw.WritePush(item)
+            if None != parent:
+                parent.arguments.append(node)
             self.argNum += 1
 
-            if None == self.tokenizer.advance():
-                print "Run out of tokens in %s" % (sys._getframe().f_code.co_name, )
-                return False
-
-        self.tokenizer.rollBack()
         return True
 
 
@@ -1333,14 +1263,12 @@ class JackTokenizer:
             print "Unexpected error: %s" % (str(e), )
             sys.exit(1)
         self.file_content = self.fd_in_file.read()
-        self.file_content_list = self.input_sanitize(self.file_content)
-        self.tok_list = []
-
-        # the first step in the syntax analysis of a program is to group the characters into tokens
-        self.tokenize()
+        self.fd_in_file.close()
 
-        # prepare for the next steps
-        self.tok_len = len(self.tok_list)
+        # the tokens are grouped from the characters on demand while the parser runs, only the
+        # tokens peeked at but not consumed yet are buffered
+        self.tok_stream = self.tokenize()
+        self.lookahead = collections.deque()
         self.token_index = -1
         self.current_token = None # there is no current token initially
 
@@ -1351,27 +1279,32 @@ class JackTokenizer:
         This method should only be called if hasMoreTokens() is True. Initialy,
         there is no current token
         '''
-        if True == self.hasMoreTokens():
+        if None != self.peek():
             self.token_index += 1
-            self.current_token = self.tok_list[self.token_index]
+            self.current_token = self.lookahead.popleft()
             return self.current_token
         else:
             return None
 
-    def rollBack(self):
-        if self.token_index > 0:
-            self.token_index -= 1
-            self.current_token = self.tok_list[self.token_index]
-            return self.current_token
-        else:
-            return None
+    def peek(self, k = 1):
+        '''
+        Returns the k-th token after the current one without consuming it,
+        None if the input ends before it
+        '''
+        lookahead = self.lookahead
+        while len(lookahead) < k:
+            token = next(self.tok_stream, None)
+            if None == token:
+                return None
+            lookahead.append(token)
+        return lookahead[k - 1]
 
     def hasMoreTokens(self):
         '''
         API function
         Do we have more tokens in the input
         '''
-        if self.token_index < (self.tok_len - 1):
+        if None != self.peek():
             return True
         else:
             return False
@@ -1381,7 +1314,7 @@ class JackTokenizer:
         API function
         Returns the type of the current token
         '''
-        return self.current_token.get_type()
+        return token_type_names[self.current_token.kind]
 
     def keyWord(self):
         '''
@@ -1389,8 +1322,8 @@ class JackTokenizer:
         Returns the keyword which is the current token. Should be called only
         when tokenType() is KEYWORD
         '''
-        if "keyword" == self.tokenType():
-            return self.current_token.get_mth_str()
+        if KEYWORD == self.current_token.kind:
+            return self.current_token.text
         else:
             return None
 
@@ -1400,8 +1333,8 @@ class JackTokenizer:
         Returns the character which is the current token. Should be called only
         when tokenType() is SYMBOL
         '''
-        if "symbol" == self.tokenType():
-            return self.current_token.get_mth_str()
+        if SYMBOL == self.current_token.kind:
+            return self.current_token.text
         else:
             return None
 
@@ -1411,8 +1344,8 @@ class JackTokenizer:
         Returns the identifier which is the current token. Should be called only
         when tokenType() is IDENTIFIER
         '''
-        if "identifier" == self.tokenType():
-            return self.current_token.get_mth_str()
+        if IDENTIFIER == self.current_token.kind:
+            return self.current_token.text
         else:
             return None
 
@@ -1422,8 +1355,8 @@ class JackTokenizer:
         Returns the integer values of the current token. Should be called only
         when tokenType() is INT_CONST
        '''
-       if "integerConstant" == self.tokenType():
-           return int(self.current_token.get_mth_str())
+       if INT_CONST == self.current_token.kind:
+           return int(self.current_token.text)
        else:
            return None
 
@@ -1433,76 +1366,101 @@ class JackTokenizer:
         Returns the integer values of the current token. Should be called only
         when tokenType() is INT_CONST
        '''
-       if "stringConstant" == self.tokenType():
-           return self.current_token.get_mth_str()
+       if STRING_CONST == self.current_token.kind:
+           return self.current_token.text
        else:
            return None
 
-    def input_sanitize(self, input_content):
-        '''
-        remove all the comments
-        '''
-        # get rid of the leading and trailing whitespaces
-        temp = input_content.strip()
-        # remove multi-lines comments. Note that the question mark(?) here indicates a non-greedy match mode
-        temp = re.sub("\/\*.*?\*\/", "", temp, flags = re.DOTALL)
-        # remove single line comments
-        temp = re.sub("\/\/.*", "", temp)
-        sanitized_content = temp.strip()
-        return [l.strip() for l in sanitized_content.split("\n") if "" != l.strip()]
-
-    def process_single_line(self, line_str):
-        '''
-        tokenize one line of code
-        '''
-        obj_mth = None
-        list_obj_tok = []
-        try_time = 0
-        while "" != line_str:
-            try_time += 1
-            obj_tok = None
-            token_type = ""
-            # try to match the first token against the line string from left to right
-            for regex in lex_ele_regex_list:
-                obj_mth = regex.match(line_str)
-                if None != obj_mth:
-                    obj_tok = Token(regex.get_name(), obj_mth.group(0), obj_mth.group(1))
-                    list_obj_tok.append(obj_tok)
-                    token_type = regex.get_name()
-                    break
-
-            if None == obj_tok:
-                print "No regex matched this line: %s at %d try" % (line_str, try_time, )
-                sys.exit(1)
-
-            if "keyword" == token_type:
-                # should not contain the tail of the pattern
-                entire_match = obj_tok.get_mth_str()
-            else:
-                entire_match = obj_tok.get_raw_str()
-            # remove the matched part from line string
-            len_mth = len(entire_match)
-            start  = line_str.find(entire_match)
-            line_str = line_str[start + len_mth:].strip()
+    def peekKind(self, k = 1):
+        '''
+        Returns the kind of the k-th token after the current one
+        '''
+        token = self.peek(k)
+        if None != token:
+            return token.kind
+        else:
+            return None
+
+    def peekKeyWord(self, k = 1):
+        '''
+        Returns the keyword which is the k-th token after the current one, None if
+        that token is not a keyword
+        '''
+        token = self.peek(k)
+        if None != token and KEYWORD == token.kind:
+            return token.text
+        else:
+            return None
+
+    def peekSymbol(self, k = 1):
+        '''
+        Returns the character which is the k-th token after the current one, None if
+        that token is not a symbol
+        '''
+        token = self.peek(k)
+        if None != token and SYMBOL == token.kind:
+            return token.text
+        else:
+            return None
+
+    def peekIdentifier(self, k = 1):
+        '''
+        Returns the identifier which is the k-th token after the current one, None if
+        that token is not an identifier
+        '''
+        token = self.peek(k)
+        if None != token and IDENTIFIER == token.kind:
+            return token.text
+        else:
+            return None
 
-        return list_obj_tok
+    def lineNumber(self, offset = None):
+        '''
+        Returns the line of the given offset in the file, the one of the current
+        token by default
+        '''
+        if None == offset:
+            offset = self.current_token.offset
+        return self.file_content.count("\n", 0, offset) + 1
 
     def tokenize(self):
-        for line in self.file_content_list:
-            tok_list_single_line = self.process_single_line(line)
-            self.tok_list += tok_list_single_line
+        '''
+        Generator scanning the file with the master regex and yielding its tokens one at a time.
+        The regex engine keeps the position in the file, so that the file is never sliced but for
+        the tokens themselves. Keywords, symbols and identifiers come back again and again, their
+        text is interned so that all their tokens share one string
+        '''
+        for obj_mth in lex_master_regex.finditer(self.file_content):
+            group_index = obj_mth.lastindex
+            kind = lex_group_kinds[group_index]
+            raw_str = obj_mth.group(group_index)
+            offset = obj_mth.start(group_index)
+            if None == kind:
+                if "error" == obj_mth.lastgroup:
+                    print "Invalid character in %s at line %d: %s" % (self.in_file_path, self.lineNumber(offset), raw_str, )
+                    sys.exit(1)
+                continue    # a comment
+            if STRING_CONST == kind:
+                yield Token(kind, raw_str[1:-1], offset)
+            elif INT_CONST == kind:
+                yield Token(kind, raw_str, offset)
+            else:
+                yield Token(kind, intern(raw_str), offset)
 
 
 class SymbolTable:
     '''
     The symbol table associates the identifier names found in the program with identifier properties
     needed for compilation: type, kind and running index. The symbol tables for Jack programs has two
-    nested scopes(class/subroutine)
+    nested scopes(class/subroutine). Every scope is a dict from the name to its entry, and the running
+    index of every kind is counted apart, so that a lookup does not depend on the number of symbols
     '''
-    class SymbolEntry:
+    class SymbolEntry(object):
         '''
         one entry in the symbol table
         '''
+        __slots__ = ("name", "type", "kind", "runningIndex")
+
         def __init__(self, name, symbolType, kind, index):
             self.name = name
             self.type = symbolType
@@ -1524,13 +1482,15 @@ class SymbolTable:
 
     def __init__(self):
         # class scope symbol table
-        self.classTable = {
-            "static": [],
-            "field": []
+        self.classTable = {}
+        self.classVarCount = {
+            "static": 0,
+            "field": 0
         }
         # subroutine scope symbol table
         self.subroutineName = None
         self.subroutineTable = None
+        self.subroutineVarCount = None
 
         self.subroutineTableStack = []
         self.classNameList = []
@@ -1550,9 +1510,10 @@ class SymbolTable:
         Start a new subroutine scope. i.e., resets the subrotine's symbol table
         '''
         self.subroutineName = name
-        self.subroutineTable = {
-            "argument": [],
-            "var": []
+        self.subroutineTable = {}
+        self.subroutineVarCount = {
+            "argument": 0,
+            "var": 0
         }
 
     def EndSubroutineScope(self):
@@ -1567,28 +1528,22 @@ class SymbolTable:
 
         self.subroutineName = None
         self.subroutineTable = None
+        self.subroutineVarCount = None
 
     def FindSymbol(self, name):
         '''
-        find the symbol entry with given name
+        find the symbol entry with given name, the subroutine scope hides the class scope
         '''
         entry = self.FindSymbolSubroutine(name)
         if None != entry:
             return entry
-        entry = self.FindSymbolClass(name)
-        if None != entry:
-            return entry
-        return None
+        return self.classTable.get(name)
 
     def FindSymbolClass(self, name):
         '''
         find the symbol entry with given name in class scope
         '''
-        for key, valList in self.classTable.iteritems():
-            for item in valList:
-                if name == item.GetName():
-                    return item
-        return None
+        return self.classTable.get(name)
 
     def FindSymbolSubroutine(self, name):
         '''
@@ -1596,105 +1551,69 @@ class SymbolTable:
         '''
         if None == self.subroutineTable:
             return None
-        for key, valList in self.subroutineTable.iteritems():
-            for item in valList:
-                if name == item.GetName():
-                    return item
-        return None
+        return self.subroutineTable.get(name)
 
-    def GetEntriesOfKinds(self, kind):
-        if "static" == kind or "field" == kind:
-            return self.classTable[kind]
-        elif "argument" == kind or "var" == kind:
-            if None == self.subroutineTable:
-                print "Error: no symbol of kind %s in the current scope" % (kind, )
-                return None
-            return self.subroutineTable[kind]
-
-    def AddToTables(self, entry):
-        kind = entry.GetKind()
+    def GetScope(self, kind):
+        '''
+        Return the table and the running index counts of the scope where symbols of the kind live
+        '''
         if "static" == kind or "field" == kind:
-            self.classTable[kind].append(entry)
+            return self.classTable, self.classVarCount
         elif "argument" == kind or "var" == kind:
             if None == self.subroutineTable:
                 print "Error: no symbol of kind %s in the current scope" % (kind, )
-                return None
-            self.subroutineTable[kind].append(entry)
+                return None, None
+            return self.subroutineTable, self.subroutineVarCount
+        return None, None
 
     def Define(self, symbolName, symbolType, symbolKind):
         '''
         Define a new identifier with given attributes
         '''
-        currentEntriesNumber = len(self.GetEntriesOfKinds(symbolKind))
-        se = self.SymbolEntry(symbolName, symbolType, symbolKind, currentEntriesNumber)  # the number of the current entries could be used as index value
-        self.AddToTables(se)
+        table, varCount = self.GetScope(symbolKind)
+        if None == table:
+            return
+        se = self.SymbolEntry(symbolName, symbolType, symbolKind, varCount[symbolKind])
+        varCount[symbolKind] += 1
+        # a name defined twice in a scope keeps its first entry, the second one still takes an index
+        table.setdefault(symbolName, se)
 
     def GetVarCount(self, kind):
         '''
         Return the number of variables of the given kind already defined in the current scope
         '''
-        if "static" == kind or "field" == kind:
-            return len(self.classTable[kind])
-        elif "argument" == kind or "var" == kind:
-            if None == self.subroutineTable:
-                print "Error: no symbol of kind %s in the current scope" % (kind, )
-                return None
-            return len(self.subroutineTable[kind])
+        table, varCount = self.GetScope(kind)
+        if None == table:
+            return None
+        return varCount[kind]
 
     def KindOf(self, name):
         '''
         Return the kind of the named identifier in the current scope,
         If the identifier is unknown in the current scope, return None
         '''
-        for key, valList in self.classTable.iteritems():
-            for item in valList:
-                if item.GetName() == name:
-                    return key
-        if None == self.subroutineTable:
-            print "Error: no symbol of kind %s in the current scope" % (kind, )
+        entry = self.FindSymbol(name)
+        if None == entry:
             return None
-        for key, valList in self.subroutineTable.iteritems():
-            for item in valList:
-                if item.GetName() == name:
-                    return key
-
-        return None
+        return entry.GetKind()
 
     def TypeOf(self, name):
         '''
         Return the type of the named identifier in the current scope,
         '''
-        for key, valList in self.classTable.iteritems():
-            for item in valList:
-                if item.GetName() == name:
-                    return item.GetType()
-        if None == self.subroutineTable:
-            print "Error: no symbol of kind %s in the current scope" % (kind, )
+        entry = self.FindSymbol(name)
+        if None == entry:
             return None
-        for key, valList in self.subroutineTable.iteritems():
-            for item in valList:
-                if item.GetName() == name:
-                    return item.GetType()
-
-        return None
+        return entry.GetType()
 
     def IndexOf(self, name):
         '''
         Return the index assigned to the named identifier
         '''
-        for key, valList in self.classTable.iteritems():
-            for item in valList:
-                if item.GetName() == name:
-                    return item.GetIndex()
-        if None == self.subroutineTable:
-            print "Error: no symbol of kind %s in the current scope" % (kind, )
+        entry = self.FindSymbol(name)
+        if None == entry:
             return None
-        for key, valList in self.subroutineTable.iteritems():
-            for item in valList:
-                if item.GetName() == name:
-                    return item.GetIndex()
-
-        return None
+        return entry.GetIndex()
 
     def DisplayContent(self):
         '''
@@ -1702,17 +1621,16 @@ class SymbolTable:
         and it is used for test purpose
         '''
         print "class scope symbol table:"
-        print "%12s | %12s | %12s | %12s" % ("Name", "Type", "Kind", "runningIndex")
-        for key, valList in self.classTable.iteritems():
-            for item in valList:
-                print "%12s | %12s | %12s | %12s" % (item.GetName(), item.GetType(), item.GetKind(), item.GetIndex())
+        self.DisplayTable(self.classTable)
 
         for entry in self.subroutineTableStack:
             print "subroutine scope symbol table for %s:" % (entry["name"], )
-            print "%12s | %12s | %12s | %12s" % ("Name", "Type", "Kind", "runningIndex")
-            for key, valList in entry["table"].iteritems():
-                for item in valList:
-                    print "%12s | %12s | %12s | %12s" % (item.GetName(), item.GetType(), item.GetKind(), item.GetIndex())
+            self.DisplayTable(entry["table"])
+
+    def DisplayTable(self, table):
+        print "%12s | %12s | %12s | %12s" % ("Name", "Type", "Kind", "runningIndex")
+        for item in sorted(table.itervalues(), key = lambda item: (item.GetKind(), item.GetIndex())):
+            print "%12s | %12s | %12s | %12s" % (item.GetName(), item.GetType(), item.GetKind(), item.GetIndex())
 
 class VMWriter:
     '''
@@ -1763,8 +1681,233 @@ class VMWriter:
         elif "/" == op:
             self.vmCmdList.append("call Math.divide 2")
 
-    def WritePush(self, val):
-        self.vmCmdList.append("push constant %d" % (int(val)))
+    def WritePush(self, val, segment = "constant"):
+        self.vmCmdList.append("push %s %d" % (segment, int(val)))
+
+    def WritePop(self, segment, index):
+        self.vmCmdList.append("pop %s %d" % (segment, index))
+
+    def GetCommandCount(self):
+        return len(self.vmCmdList)
+
+    def InsertCommands(self, position, cmds):
+        '''
+        Insert the vm commands cmds before the command at position
+        '''
+        self.vmCmdList[position:position] = cmds
+
+
+def xml_escape(text):
+    '''
+    Escape the characters which are special in xml text, the same ones as minidom
+    '''
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+class XmlVisitor:
+    '''
+    Writes an abstract syntax tree to a stream as the xml parse tree of the syntax analyzer, one
+    element per line indented by two spaces per level. The tokens which the tree does not keep
+    are put back from the grammar
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def Visit(self, node, level):
+        getattr(self, "Visit" + node.__class__.__name__)(node, level)
+
+    def Open(self, tag, level):
+        self.stream.write("%s<%s>\n" % ("  " * level, tag, ))
+
+    def Close(self, tag, level):
+        self.stream.write("%s</%s>\n" % ("  " * level, tag, ))
+
+    def Terminal(self, tag, value, level):
+        self.stream.write("%s<%s> %s </%s>\n" % ("  " * level, tag, xml_escape(str(value)), tag, ))
+
+    def Type(self, varType, level):
+        if varType in ("int", "char", "boolean", "void"):
+            self.Terminal("keyword", varType, level)
+        else:
+            self.Terminal("identifier", varType, level)
+
+    def Names(self, names, level):
+        for i, name in enumerate(names):
+            if 0 != i:
+                self.Terminal("symbol", ",", level)
+            self.Terminal("identifier", name, level)
+
+    def VisitClassDec(self, node, level):
+        self.Open("class", level)
+        self.Terminal("keyword", "class", level + 1)
+        self.Terminal("identifier", node.name, level + 1)
+        self.Terminal("symbol", "{", level + 1)
+        for child in node.classVarDecs:
+            self.Visit(child, level + 1)
+        for child in node.subroutineDecs:
+            self.Visit(child, level + 1)
+        self.Terminal("symbol", "}", level + 1)
+        self.Close("class", level)
+
+    def VisitClassVarDec(self, node, level):
+        self.Open("classVarDec", level)
+        self.Terminal("keyword", node.kind, level + 1)
+        self.Type(node.type, level + 1)
+        self.Names(node.names, level + 1)
+        self.Terminal("symbol", ";", level + 1)
+        self.Close("classVarDec", level)
+
+    def VisitSubroutineDec(self, node, level):
+        self.Open("subroutineDec", level)
+        level += 1
+        self.Terminal("keyword", node.kind, level)
+        self.Type(node.returnType, level)
+        self.Terminal("identifier", node.name, level)
+        self.Terminal("symbol", "(", level)
+        self.Open("parameterList", level)
+        for i, (varType, name) in enumerate(node.parameters):
+            if 0 != i:
+                self.Terminal("symbol", ",", level + 1)
+            self.Type(varType, level + 1)
+            self.Terminal("identifier", name, level + 1)
+        self.Close("parameterList", level)
+        self.Terminal("symbol", ")", level)
+        self.Open("subroutineBody", level)
+        self.Terminal("symbol", "{", level + 1)
+        for child in node.varDecs:
+            self.Visit(child, level + 1)
+        self.Statements(node.statements, level + 1)
+        self.Terminal("symbol", "}", level + 1)
+        self.Close("subroutineBody", level)
+        self.Close("subroutineDec", level - 1)
+
+    def VisitVarDec(self, node, level):
+        self.Open("varDec", level)
+        self.Terminal("keyword", "var", level + 1)
+        self.Type(node.type, level + 1)
+        self.Names(node.names, level + 1)
+        self.Terminal("symbol", ";", level + 1)
+        self.Close("varDec", level)
+
+    def Statements(self, statements, level):
+        self.Open("statements", level)
+        for child in statements:
+            self.Visit(child, level + 1)
+        self.Close("statements", level)
+
+    def Block(self, statements, level):
+        self.Terminal("symbol", "{", level)
+        self.Statements(statements, level)
+        self.Terminal("symbol", "}", level)
+
+    def VisitLetStatement(self, node, level):
+        self.Open("letStatement", level)
+        self.Terminal("keyword", "let", level + 1)
+        self.Terminal("identifier", node.name, level + 1)
+        if None != node.index:
+            self.Terminal("symbol", "[", level + 1)
+            self.Expression(node.index, level + 1)
+            self.Terminal("symbol", "]", level + 1)
+        self.Terminal("symbol", "=", level + 1)
+        self.Expression(node.value, level + 1)
+        self.Terminal("symbol", ";", level + 1)
+        self.Close("letStatement", level)
+
+    def VisitIfStatement(self, node, level):
+        self.Open("ifStatement", level)
+        self.Terminal("keyword", "if", level + 1)
+        self.Terminal("symbol", "(", level + 1)
+        self.Expression(node.condition, level + 1)
+        self.Terminal("symbol", ")", level + 1)
+        self.Block(node.statements, level + 1)
+        if None != node.elseStatements:
+            self.Terminal("keyword", "else", level + 1)
+            self.Block(node.elseStatements, level + 1)
+        self.Close("ifStatement", level)
+
+    def VisitWhileStatement(self, node, level):
+        self.Open("whileStatement", level)
+        self.Terminal("keyword", "while", level + 1)
+        self.Terminal("symbol", "(", level + 1)
+        self.Expression(node.condition, level + 1)
+        self.Terminal("symbol", ")", level + 1)
+        self.Block(node.statements, level + 1)
+        self.Close("whileStatement", level)
+
+    def VisitDoStatement(self, node, level):
+        self.Open("doStatement", level)
+        self.Terminal("keyword", "do", level + 1)
+        self.VisitSubroutineCall(node.call, level + 1)
+        self.Terminal("symbol", ";", level + 1)
+        self.Close("doStatement", level)
+
+    def VisitReturnStatement(self, node, level):
+        self.Open("returnStatement", level)
+        self.Terminal("keyword", "return", level + 1)
+        if None != node.value:
+            self.Expression(node.value, level + 1)
+        self.Terminal("symbol", ";", level + 1)
+        self.Close("returnStatement", level)
+
+    def Expression(self, node, level):
+        '''
+        The BinaryOp nodes of an expression are flattened back into its terms and operators
+        '''
+        operators = []
+        while isinstance(node, BinaryOp):
+            operators.append(node)
+            node = node.left
+        self.Open("expression", level)
+        self.Term(node, level + 1)
+        for op_node in reversed(operators):
+            self.Terminal("symbol", op_node.op, level + 1)
+            self.Term(op_node.right, level + 1)
+        self.Close("expression", level)
+
+    def Term(self, node, level):
+        self.Open("term", level)
+        self.Visit(node, level + 1)
+        self.Close("term", level)
+
+    def VisitIntegerConstant(self, node, level):
+        self.Terminal("integerConstant", node.value, level)
+
+    def VisitStringConstant(self, node, level):
+        self.Terminal("stringConstant", node.value, level)
+
+    def VisitKeywordConstant(self, node, level):
+        self.Terminal("keyword", node.value, level)
+
+    def VisitVarRef(self, node, level):
+        self.Terminal("identifier", node.name, level)
+
+    def VisitArrayRef(self, node, level):
+        self.Terminal("identifier", node.name, level)
+        self.Terminal("symbol", "[", level)
+        self.Expression(node.index, level)
+        self.Terminal("symbol", "]", level)
+
+    def VisitSubroutineCall(self, node, level):
+        if None != node.receiver:
+            self.Terminal("identifier", node.receiver, level)
+            self.Terminal("symbol", ".", level)
+        self.Terminal("identifier", node.name, level)
+        self.Terminal("symbol", "(", level)
+        self.Open("expressionList", level)
+        for i, argument in enumerate(node.arguments):
+            if 0 != i:
+                self.Terminal("symbol", ",", level + 1)
+            self.Expression(argument, level + 1)
+        self.Close("expressionList", level)
+        self.Terminal("symbol", ")", level)
+
+    def VisitParenExpression(self, node, level):
+        self.Terminal("symbol", "(", level)
+        self.Expression(node.expression, level)
+        self.Terminal("symbol", ")", level)
+
+    def VisitUnaryOp(self, node, level):
+        self.Terminal("symbol", node.op, level)
+        self.Term(node.operand, level)
 
 
 class JackCompiler:
@@ -1789,14 +1932,18 @@ class JackCompiler:
         # create compilation engines
         for jt in self.list_jt:
             # avoid emptyfiles
-            if jt.tok_len > 0:
+            if True == jt.hasMoreTokens():
                 ce = CompilationEngine(jt)
                 self.list_ce.append(ce)
 
-    def compile(self):
+    def compile(self, write_xml = False):
         # call the compile command on all CompilationEngine instances
         for ce in self.list_ce:
+            # the parse tree is only built on demand, for debugging
+            ce.build_tree = write_xml
             ce.StartCompiling()
+            if True == write_xml:
+                ce.WriteParseTree()
 
     def validate_file_path(self, file_path):
         if False == file_path.lower().endswith(".jack"):
@@ -1829,16 +1976,35 @@ class JackCompiler:
         return list_files
 
 
+USAGE = '''usage: JackCompiler.py path [--xml]
+
+Compile the .jack file, or all the .jack files of the folder, path to .vm files.
+
+  --xml    also write the parse tree of every file to its xxxfromJackCompiler.xml file
+
+String literals: every literal of a class is built once, into a static variable after the
+statics of the class, by the first call of a subroutine of the class which uses a literal. All
+the uses of a literal share that one string, so a subroutine changing a string it is given, or
+disposing of it, changes or frees it for every use of the literal. Only the literals passed
+straight to String.dispose, setCharAt, appendChar, eraseLastChar or setInt are built anew.
+The subroutine names starting with %s are reserved for the compiler.''' % (RESERVED_PREFIX, )
+
 def main():
     # arguments pre-processing
     if len(sys.argv) <= 1:
         print "Please supply the path to the .jack file(s)"
+        print USAGE
         sys.exit(1)
+    if sys.argv[1] in ("-h", "--help"):
+        print USAGE
+        return
 
     INPUT_PATH = os.path.normpath(sys.argv[1])
+    # --xml: also write the parse tree of every file to its xxxfromJackCompiler.xml file
+    WRITE_XML = "--xml" in sys.argv[2:]
 
     jc = JackCompiler(INPUT_PATH)
-    jc.compile()
+    jc.compile(WRITE_XML)
 
 if "__main__" == __name__:
     main()